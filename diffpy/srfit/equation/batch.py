@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""Batches of values for evaluating equations at many parameter vectors.
+
+A Batch holds the values of a quantity for a number of samples, such as the
+members of the population of a global optimizer, stacked along a leading
+batch axis. Arithmetic and numpy ufuncs on Batches broadcast the samples
+against each other and against plain values, so a function written with
+numpy ufuncs computes all samples in a single call.
+
+The per-sample values are aligned from the right, as numpy aligns arrays, so
+that a batch of scalars combines with an array of points to give a batch of
+arrays. Indexing, len and sum act on the per-sample values.
+
+Ufuncs are dispatched with the __array_ufunc__ protocol of numpy 1.13 and
+later. Numpy functions that convert their arguments to arrays do not work on
+Batches. 'call' detects this and raises ValueError.
+
+"""
+
+__all__ = ["Batch", "call", "hasBatch", "sample"]
+
+import numpy
+
+class Batch(object):
+    """Values of a number of samples.
+
+    Attributes
+    data    --  The array of the values, with the samples along the first
+                axis.
+
+    Properties
+    shape   --  The shape of the per-sample values.
+    ndim    --  The number of dimensions of the per-sample values.
+
+    """
+
+    # Make arrays defer to us in mixed arithmetic
+    __array_priority__ = 100
+
+    def __init__(self, data):
+        """Initialize.
+
+        data    --  The array of the values, with the samples along the first
+                    axis.
+
+        """
+        self.data = numpy.asarray(data)
+        return
+
+    shape = property(lambda self: self.data.shape[1:])
+    ndim = property(lambda self: self.data.ndim - 1)
+
+    def __repr__(self):
+        return "Batch(%r)" % (self.data,)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kw):
+        """Evaluate a ufunc on all samples."""
+        if method != "__call__" or kw or ufunc.nout != 1:
+            return NotImplemented
+        ndim = max(_ndim(x) for x in inputs)
+        values = [_expand(x, ndim) for x in inputs]
+        return Batch(ufunc(*values))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, tuple):
+            idx = (idx,)
+        return Batch(self.data[(slice(None),) + idx])
+
+    def __nonzero__(self):
+        raise TypeError("The truth value of a Batch is ambiguous")
+
+    __bool__ = __nonzero__
+
+    def sum(self, axis = None, dtype = None, out = None, **kw):
+        """Sum the per-sample values.
+
+        This supports numpy.sum. Keywords other than axis are not supported.
+
+        Raises TypeError if keywords other than axis are given.
+
+        """
+        if dtype is not None or out is not None or kw:
+            raise TypeError("Batch.sum only supports the axis keyword")
+        if axis is None:
+            axis = tuple(range(self.ndim))
+        elif not isinstance(axis, tuple):
+            axis = (axis,)
+        axis = tuple(a % self.ndim + 1 for a in axis)
+        return Batch(numpy.sum(self.data, axis = axis))
+
+    # Arithmetic
+
+    __add__ = lambda self, other: numpy.add(self, other)
+    __radd__ = lambda self, other: numpy.add(other, self)
+    __sub__ = lambda self, other: numpy.subtract(self, other)
+    __rsub__ = lambda self, other: numpy.subtract(other, self)
+    __mul__ = lambda self, other: numpy.multiply(self, other)
+    __rmul__ = lambda self, other: numpy.multiply(other, self)
+    __div__ = lambda self, other: numpy.true_divide(self, other)
+    __rdiv__ = lambda self, other: numpy.true_divide(other, self)
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+    __pow__ = lambda self, other: numpy.power(self, other)
+    __rpow__ = lambda self, other: numpy.power(other, self)
+    __mod__ = lambda self, other: numpy.mod(self, other)
+    __rmod__ = lambda self, other: numpy.mod(other, self)
+    __neg__ = lambda self: numpy.negative(self)
+    __pos__ = lambda self: self
+    __abs__ = lambda self: numpy.absolute(self)
+    __lt__ = lambda self, other: numpy.less(self, other)
+    __le__ = lambda self, other: numpy.less_equal(self, other)
+    __gt__ = lambda self, other: numpy.greater(self, other)
+    __ge__ = lambda self, other: numpy.greater_equal(self, other)
+
+# End class Batch
+
+def hasBatch(values):
+    """Check whether values contain Batches.
+
+    values  --  The list of values. Batches are looked for in the list and in
+                the lists and tuples it contains.
+
+    """
+    for x in values:
+        if isinstance(x, Batch):
+            return True
+        if isinstance(x, (list, tuple)) and \
+                any(isinstance(y, Batch) for y in x):
+            return True
+    return False
+
+def sample(value, k):
+    """Get the value of a sample.
+
+    value   --  A Batch, a list or tuple that contains Batches, or a plain
+                value.
+    k       --  The index of the sample.
+
+    Returns the value of sample k, or value itself if it is plain.
+
+    """
+    if isinstance(value, Batch):
+        return value.data[k]
+    if isinstance(value, (list, tuple)) and hasBatch([value]):
+        return type(value)(sample(x, k) for x in value)
+    return value
+
+def call(f, args, name = None):
+    """Call a function with arguments that may be Batches.
+
+    f       --  The function.
+    args    --  The list of arguments.
+    name    --  The name of the function for error messages (default None).
+                If this is None, the name is taken from f.
+
+    Returns the value of f. If any of args is a Batch or a list or tuple
+    that contains Batches, this is a Batch or a list or tuple that contains
+    Batches.
+
+    Raises ValueError if f does not broadcast the Batches.
+
+    """
+    if not hasBatch(args):
+        return f(*args)
+    if name is None:
+        name = getattr(f, "__name__", repr(f))
+    msg = "'%s' does not broadcast batches" % name
+    try:
+        value = f(*args)
+    except (TypeError, ValueError, AttributeError, IndexError), e:
+        raise ValueError("%s: %s" % (msg, e))
+    if not hasBatch([value]):
+        raise ValueError(msg)
+    items = value if isinstance(value, (list, tuple)) else [value]
+    for x in items:
+        if isinstance(x, Batch) and x.data.dtype == object:
+            raise ValueError(msg)
+    return value
+
+def _ndim(x):
+    """Get the number of per-sample dimensions of a value."""
+    if isinstance(x, Batch):
+        return x.ndim
+    return numpy.ndim(x)
+
+def _expand(x, ndim):
+    """Align a value from the right for per-sample values with ndim dims.
+
+    Plain values are aligned by numpy. Batches get axes after the first.
+
+    """
+    if not isinstance(x, Batch):
+        return x
+    data = x.data
+    missing = ndim - x.ndim
+    if missing <= 0:
+        return data
+    return data.reshape(data.shape[:1] + (1,) * missing + data.shape[1:])
+
+# End of file
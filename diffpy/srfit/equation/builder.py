@@ -88,10 +88,13 @@ __all__ = [ "EquationFactory", "BaseBuilder", "ArgumentBuilder",
 _builders = {}
 
 
+from itertools import chain
+
 import numpy
 
 import diffpy.srfit.equation.literals as literals
 from diffpy.srfit.equation.equationmod import Equation
+from diffpy.srfit.equation.visitors import Merger
 
 
 class EquationFactory(object):
@@ -248,6 +251,24 @@ class EquationFactory(object):
         self.equations.discard(eq)
         return
 
+    def mergeCommonSubexpressions(self, others = ()):
+        """Merge common subexpressions of the equations of the factory.
+
+        Structurally identical subtrees over the same Arguments are replaced
+        by a single shared node, so that each is computed once when the
+        equations are evaluated together. Invalidation works as before.
+
+        others  --  Iterable of other EquationFactory instances whose equations
+                    are merged with ours (default ()).
+
+        Returns the number of nodes that were replaced.
+        """
+        merger = Merger()
+        for factory in chain([self], others):
+            for eq in factory.equations:
+                eq.identify(merger)
+        return merger.merged
+
     def _prepareBuilders(self, eqstr, buildargs, argclass, argkw):
         """Prepare builders so that equation string can be evaluated.
 
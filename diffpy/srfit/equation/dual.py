@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""Dual numbers for forward-mode differentiation.
+
+A Dual holds a value and a batch of dual parts, which are the derivatives of
+the value with respect to a number of seeds. Arithmetic and numpy ufuncs on
+Duals propagate the dual parts by the chain rule, so a function written with
+numpy operations returns its value and its derivatives in a single call.
+
+The dual parts have one more dimension than the value. The first dimension
+runs over the seeds and the others broadcast to the shape of the value.
+
+Ufuncs are dispatched with the __array_ufunc__ protocol of numpy 1.13 and
+later. Ufuncs without a derivative in this module, and numpy functions that
+convert their arguments to arrays, do not propagate Duals. 'call' detects
+this and raises ValueError.
+
+"""
+
+__all__ = ["Dual", "seed", "call", "hasDual", "stack"]
+
+import numpy
+
+class Dual(object):
+    """Value with a batch of dual parts.
+
+    Attributes
+    value   --  The value, a scalar or an array.
+    dual    --  The dual parts, an array whose first dimension runs over the
+                seeds and whose other dimensions broadcast to the shape of
+                value.
+
+    Properties
+    shape   --  The shape of value.
+    ndim    --  The number of dimensions of value.
+
+    """
+
+    # Make arrays defer to us in mixed arithmetic
+    __array_priority__ = 100
+
+    def __init__(self, value, dual):
+        """Initialize.
+
+        value   --  The value.
+        dual    --  The dual parts. This must have one more dimension than
+                    value.
+
+        Raises ValueError if dual has the wrong number of dimensions.
+
+        """
+        self.value = value
+        self.dual = numpy.asarray(dual)
+        if self.dual.ndim != numpy.ndim(value) + 1:
+            raise ValueError("The dual parts must have %i dimensions" %
+                    (numpy.ndim(value) + 1))
+        return
+
+    shape = property(lambda self: numpy.shape(self.value))
+    ndim = property(lambda self: numpy.ndim(self.value))
+
+    def getDerivatives(self):
+        """Get the dual parts broadcast to the shape of the value."""
+        shape = self.dual.shape[:1] + self.shape
+        return numpy.broadcast_to(self.dual, shape)
+
+    def __repr__(self):
+        return "Dual(%r, %r)" % (self.value, self.dual)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kw):
+        """Evaluate a ufunc with Duals."""
+        partials = _partials.get(ufunc)
+        if method != "__call__" or kw:
+            return NotImplemented
+        values = [_valueOf(x) for x in inputs]
+        if ufunc in _predicates:
+            return ufunc(*values)
+        if partials is None:
+            return NotImplemented
+        value = ufunc(*values)
+        ndim = numpy.ndim(value)
+        dual = None
+        for x, partial in zip(inputs, partials):
+            if not isinstance(x, Dual):
+                continue
+            term = partial(*(values + [value]))
+            term = term * _expand(x.dual, ndim)
+            dual = term if dual is None else dual + term
+        return Dual(value, dual)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, tuple):
+            idx = (idx,)
+        return Dual(self.value[idx],
+                self.getDerivatives()[(slice(None),) + idx])
+
+    def sum(self, axis = None, dtype = None, out = None, **kw):
+        """Sum the value and the dual parts.
+
+        This supports numpy.sum. Keywords other than axis are not supported.
+
+        Raises TypeError if keywords other than axis are given.
+
+        """
+        if dtype is not None or out is not None or kw:
+            raise TypeError("Dual.sum only supports the axis keyword")
+        if axis is None:
+            axis = tuple(range(self.ndim))
+        elif not isinstance(axis, tuple):
+            axis = (axis,)
+        axis = tuple(a % self.ndim for a in axis)
+        value = numpy.sum(self.value, axis = axis)
+        dual = numpy.sum(self.getDerivatives(),
+                axis = tuple(a + 1 for a in axis))
+        return Dual(value, dual)
+
+    # Arithmetic
+
+    __add__ = lambda self, other: numpy.add(self, other)
+    __radd__ = lambda self, other: numpy.add(other, self)
+    __sub__ = lambda self, other: numpy.subtract(self, other)
+    __rsub__ = lambda self, other: numpy.subtract(other, self)
+    __mul__ = lambda self, other: numpy.multiply(self, other)
+    __rmul__ = lambda self, other: numpy.multiply(other, self)
+    __div__ = lambda self, other: numpy.true_divide(self, other)
+    __rdiv__ = lambda self, other: numpy.true_divide(other, self)
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+    __pow__ = lambda self, other: numpy.power(self, other)
+    __rpow__ = lambda self, other: numpy.power(other, self)
+    __mod__ = lambda self, other: numpy.mod(self, other)
+    __rmod__ = lambda self, other: numpy.mod(other, self)
+    __neg__ = lambda self: numpy.negative(self)
+    __pos__ = lambda self: self
+    __abs__ = lambda self: numpy.absolute(self)
+
+    # Comparisons use the value, so that piecewise functions can branch on
+    # it.
+
+    __lt__ = lambda self, other: numpy.less(self, other)
+    __le__ = lambda self, other: numpy.less_equal(self, other)
+    __gt__ = lambda self, other: numpy.greater(self, other)
+    __ge__ = lambda self, other: numpy.greater_equal(self, other)
+
+# End class Dual
+
+def seed(values):
+    """Make Duals that are seeded with respect to each of a list of values.
+
+    values  --  The list of values.
+
+    Returns a list of Duals. The dual parts of the i-th Dual are 1 for the
+    i-th seed and 0 for the others. For array values, this seeds the
+    derivative with respect to a uniform change of all elements.
+
+    """
+    n = len(values)
+    duals = []
+    for i, value in enumerate(values):
+        dual = numpy.zeros((n,) + (1,) * numpy.ndim(value))
+        dual[i] = 1
+        duals.append(Dual(value, dual))
+    return duals
+
+def call(f, args, name = None):
+    """Call a function with arguments that may be Duals.
+
+    f       --  The function.
+    args    --  The list of arguments.
+    name    --  The name of the function for error messages (default None).
+                If this is None, the name is taken from f.
+
+    Returns the value of f. If any of args is a Dual or a list or tuple that
+    contains Duals, this is a Dual or a list or tuple that contains Duals.
+
+    Raises ValueError if f does not propagate the Duals.
+
+    """
+    if not hasDual(args):
+        return f(*args)
+    if name is None:
+        name = getattr(f, "__name__", repr(f))
+    msg = "'%s' does not propagate dual numbers" % name
+    try:
+        value = f(*args)
+    except (TypeError, ValueError, AttributeError), e:
+        raise ValueError("%s: %s" % (msg, e))
+    if not hasDual([value]):
+        raise ValueError(msg)
+    items = value if isinstance(value, (list, tuple)) else [value]
+    for x in items:
+        if isinstance(x, Dual) and numpy.asarray(x.value).dtype == object:
+            raise ValueError(msg)
+    return value
+
+def hasDual(values):
+    """Check whether values contain Duals.
+
+    values  --  The list of values. Duals are looked for in the list and in
+                the lists and tuples it contains.
+
+    """
+    for x in values:
+        if isinstance(x, Dual):
+            return True
+        if isinstance(x, (list, tuple)) and \
+                any(isinstance(y, Dual) for y in x):
+            return True
+    return False
+
+def stack(items):
+    """Stack values, some of which may be Duals, into a Dual.
+
+    items   --  The list of values with the same shape.
+
+    Returns a Dual whose value is the array of the values.
+
+    Raises ValueError if none of the values is a Dual.
+
+    """
+    values = [_valueOf(x) for x in items]
+    value = numpy.array(values)
+    nseeds = set(x.dual.shape[0] for x in items if isinstance(x, Dual))
+    if len(nseeds) != 1:
+        raise ValueError("Cannot stack Duals with different numbers of seeds")
+    n = nseeds.pop()
+    dual = numpy.zeros((n,) + value.shape)
+    for i, x in enumerate(items):
+        if isinstance(x, Dual):
+            dual[:,i] = x.getDerivatives()
+    return Dual(value, dual)
+
+def _valueOf(x):
+    """Get the value of a Dual, or x itself if it is not a Dual."""
+    if isinstance(x, Dual):
+        return x.value
+    return x
+
+def _expand(dual, ndim):
+    """Add axes after the first to dual parts for a value with ndim dims."""
+    missing = ndim + 1 - dual.ndim
+    if missing <= 0:
+        return dual
+    return dual.reshape(dual.shape[:1] + (1,) * missing + dual.shape[1:])
+
+def _one(*args):
+    return 1.0
+
+def _zero(*args):
+    return 0.0
+
+def _minusOne(*args):
+    return -1.0
+
+def _arcsinFactor(a, v):
+    return 1 / numpy.sqrt(1 - a * a)
+
+# Partial derivatives of ufuncs. Each takes the arguments of the ufunc
+# followed by its value.
+_partials = {
+        numpy.add : (_one, _one),
+        numpy.subtract : (_one, _minusOne),
+        numpy.multiply : (lambda a, b, v: b, lambda a, b, v: a),
+        numpy.true_divide : (lambda a, b, v: 1.0 / b,
+            lambda a, b, v: -v / b),
+        numpy.power : (lambda a, b, v: b * a ** (b - 1),
+            lambda a, b, v: v * numpy.log(a)),
+        numpy.mod : (_one, lambda a, b, v: -numpy.floor_divide(a, b)),
+        numpy.hypot : (lambda a, b, v: a / v, lambda a, b, v: b / v),
+        numpy.arctan2 : (lambda a, b, v: b / (a * a + b * b),
+            lambda a, b, v: -a / (a * a + b * b)),
+        numpy.maximum : (lambda a, b, v: numpy.greater_equal(a, b),
+            lambda a, b, v: numpy.less(a, b)),
+        numpy.minimum : (lambda a, b, v: numpy.less_equal(a, b),
+            lambda a, b, v: numpy.greater(a, b)),
+        numpy.negative : (_minusOne,),
+        numpy.absolute : (lambda a, v: numpy.sign(a),),
+        numpy.square : (lambda a, v: 2 * a,),
+        numpy.sqrt : (lambda a, v: 0.5 / v,),
+        numpy.exp : (lambda a, v: v,),
+        numpy.expm1 : (lambda a, v: v + 1,),
+        numpy.log : (lambda a, v: 1.0 / a,),
+        numpy.log10 : (lambda a, v: 1.0 / (a * numpy.log(10)),),
+        numpy.log1p : (lambda a, v: 1.0 / (1 + a),),
+        numpy.sin : (lambda a, v: numpy.cos(a),),
+        numpy.cos : (lambda a, v: -numpy.sin(a),),
+        numpy.tan : (lambda a, v: 1 + v * v,),
+        numpy.sinh : (lambda a, v: numpy.cosh(a),),
+        numpy.cosh : (lambda a, v: numpy.sinh(a),),
+        numpy.tanh : (lambda a, v: 1 - v * v,),
+        numpy.arcsin : (_arcsinFactor,),
+        numpy.arccos : (lambda a, v: -_arcsinFactor(a, v),),
+        numpy.arctan : (lambda a, v: 1 / (1 + a * a),),
+        numpy.sign : (_zero,),
+        numpy.floor : (_zero,),
+        numpy.ceil : (_zero,),
+        numpy.rint : (_zero,),
+        }
+
+# Ufuncs that return flags. These are evaluated with the values.
+_predicates = frozenset([numpy.less, numpy.less_equal, numpy.greater,
+    numpy.greater_equal, numpy.isnan, numpy.isinf, numpy.isfinite,
+    numpy.signbit])
+
+if numpy.divide is not numpy.true_divide:
+    _partials[numpy.divide] = _partials[numpy.true_divide]
+
+# End of file
@@ -34,17 +34,33 @@ Example
 > eq.b.setValue(3)
 > eq() # uses last assignment of a and b, returns 0
 
+An Equation can be evaluated in compiled mode (see Equation.setCompiled), where
+the tree is lowered to a flat Program (diffpy.srfit.equation.program) that
+only recomputes the parts of the tree that depend on changed Arguments.
+
+The derivatives of an Equation can be found symbolically (see
+Equation.differentiate) or with dual numbers (see Equation.autodiff). An
+Equation can be evaluated for many samples of its Arguments at once (see
+Equation.evaluateBatch).
+
 See the class documentation for more information.
 
 """
 
 __all__ = ["Equation"]
 
+from numpy import array, zeros, shape, empty
+
 from diffpy.srfit.util.ordereddict import OrderedDict
 
 from diffpy.srfit.equation.visitors import validate, getArgs, swap
+from diffpy.srfit.equation.visitors import getDerivative, getDualValue
+from diffpy.srfit.equation.visitors import getBatchValue
 from diffpy.srfit.equation.literals.operators import Operator
 from diffpy.srfit.equation.literals.literal import Literal
+from diffpy.srfit.equation.program import Program
+from diffpy.srfit.equation.dual import Dual
+from diffpy.srfit.equation.batch import Batch
 
 class Equation(Operator):
     """Class for holding and evaluating a Literal tree.
@@ -65,6 +81,12 @@ class Equation(Operator):
     root    --  The root Literal of the equation tree
     argdict --  An OrderedDict of Arguments from the root.
     args    --  Property that gets the values of argdict.
+    compiled    --  Flag indicating whether the Equation is evaluated in
+                compiled mode (read only). See 'setCompiled'.
+    _compiled   --  The compiled mode flag.
+    _program    --  The Program used in compiled mode, or None.
+    _variables  --  The Arguments for which the Program is folded, or None.
+                See 'fold'.
 
     Operator Attributes
     args    --  List of Literal arguments, set with 'addLiteral'
@@ -77,6 +99,11 @@ class Equation(Operator):
     value   --  Property for 'getValue'.
     """
 
+    _compiled = False
+    _program = None
+    _variables = None
+    compiled = property(lambda self: self._compiled)
+
     def __init__(self, name = None, root = None):
         """Initialize.
 
@@ -91,6 +118,7 @@ class Equation(Operator):
         if name is None and root is not None:
             name = "eq_%s"%root.name
         Literal.__init__(self, name)
+        self._initCache()
         self.symbol = name
         self.nin = None
         self.nout = 1
@@ -142,12 +170,11 @@ class Equation(Operator):
         validate(root)
 
         # Stop observing the old root
-        if self.root is not None:
-            self.root.removeObserver(self._flush)
+        self._detach()
 
         # Add the new root
         self.root = root
-        self.root.addObserver(self._flush)
+        self._attach()
         self._flush(other=(self,))
 
         # Get the args
@@ -159,6 +186,17 @@ class Equation(Operator):
 
         return
 
+    def getVersion(self):
+        """Get the version of the Equation.
+
+        This is the largest version of the Equation and its tree.
+
+        """
+        version = self._version
+        if self.root is not None:
+            version = max(version, self.root.getVersion())
+        return version
+
     def __call__(self, *args, **kw):
         """Call the equation.
 
@@ -171,10 +209,12 @@ class Equation(Operator):
 
         """
         # Process args
+        if args:
+            eqargs = self.args
         for idx, val in enumerate(args):
             if idx > len(self.argdict):
                 raise ValueError("Too many arguments")
-            arg = self.args[idx]
+            arg = eqargs[idx]
             arg.setValue(val)
 
         # Process kw
@@ -184,9 +224,84 @@ class Equation(Operator):
                 raise ValueError("No argument named '%s' here"%name)
             arg.setValue(val)
 
-        self._value = self.root.getValue()
+        if self._program is None:
+            self._value = self.root.getValue()
+        else:
+            self._value = self._program.run()
         return self._value
 
+    def setCompiled(self, compiled = True):
+        """Toggle compiled mode.
+
+        In compiled mode the Literal tree is lowered to a flat Program. The
+        Equation observes the leaves of the tree directly, and an evaluation
+        only recomputes the Operators that depend on changed leaves. The
+        Program is rebuilt when the tree is changed with 'setRoot' or 'swap'.
+        Changes made to the tree in other ways are not seen in compiled mode.
+
+        compiled    --  Flag indicating whether to use compiled mode (default
+                        True).
+
+        """
+        compiled = bool(compiled)
+        if compiled == self._compiled:
+            return
+        self._detach()
+        self._compiled = compiled
+        if self.root is not None:
+            self._attach()
+            self._flush(other=(self,))
+        return
+
+    def fold(self, variables = None):
+        """Fold the subtrees that do not depend on a set of Arguments.
+
+        In compiled mode, the subtrees of the tree that do not depend on the
+        variables are evaluated once and their values are cached as leaves of
+        the Program. They are evaluated again only when one of their own
+        Arguments changes. Folding has no effect outside of compiled mode,
+        where every Operator caches its value.
+
+        variables   --  The Arguments that may change, such as the free
+                    variables of a refinement. If this is None (default), the
+                    folding is removed.
+
+        """
+        if variables is not None:
+            variables = list(variables)
+        self._variables = variables
+        if self._compiled and self.root is not None:
+            self._detach()
+            self._attach()
+            self._flush(other=(self,))
+        return
+
+    def _attach(self):
+        """Observe the tree, building the Program in compiled mode."""
+        if self._compiled:
+            self._program = Program(self.root, self._variables)
+            for leaf in self._program.leaves:
+                leaf.addObserver(self._flushLeaf)
+        else:
+            self.root.addObserver(self._flush)
+        return
+
+    def _detach(self):
+        """Stop observing the tree."""
+        if self._program is not None:
+            for leaf in self._program.leaves:
+                leaf.removeObserver(self._flushLeaf)
+            self._program = None
+        elif self.root is not None:
+            self.root.removeObserver(self._flush)
+        return
+
+    def _flushLeaf(self, other):
+        """Invalidate a leaf of the Program and notify observers."""
+        self._program.invalidate(other[0])
+        self._flush(other)
+        return
+
     def swap(self, oldlit, newlit):
         """Swap a literal in the equation for another.
 
@@ -197,6 +312,98 @@ class Equation(Operator):
         self.setRoot(newroot)
         return
 
+    def differentiate(self, arg, fallback = None):
+        """Get the derivative of the equation with respect to an Argument.
+
+        arg         --  The Argument, or its name.
+        fallback    --  The derivative rule for Operators without a registered
+                        rule, such as Calculators and ProfileGenerators
+                        (default None). See
+                        diffpy.srfit.equation.visitors.differentiator.
+
+        Returns an Equation for the derivative. It shares nodes with this
+        Equation, so values that this Equation has computed are reused.
+
+        Raises ValueError if the equation contains an Operator that cannot be
+        differentiated.
+
+        """
+        if isinstance(arg, basestring):
+            arg = self.argdict[arg]
+        root = getDerivative(self.root, arg, fallback)
+        name = "d%s_d%s" % (self.name, arg.name)
+        return Equation(name, root)
+
+    def autodiff(self, args = None, fallback = None):
+        """Evaluate the equation and its derivatives with dual numbers.
+
+        The Arguments are seeded with dual parts, which are propagated through
+        the Operators of the tree (see diffpy.srfit.equation.dual). This finds
+        the derivatives with respect to all of the Arguments in a single
+        evaluation. Registered functions must be written with numpy
+        operations that propagate dual numbers.
+
+        args        --  The Arguments or their names (default None). If this is
+                        None, all Arguments of the Equation are used.
+        fallback    --  The evaluation rule for Operators that are not
+                        evaluated from their arguments alone, such as
+                        Calculators and ProfileGenerators (default None). See
+                        diffpy.srfit.equation.visitors.dualevaluator.
+
+        Returns the value of the equation and an array of its derivatives
+        with respect to args. The derivatives of an array value with respect
+        to an array Argument are with respect to a uniform change of its
+        elements.
+
+        Raises ValueError if the equation contains an Operator that does not
+        propagate dual numbers.
+
+        """
+        if args is None:
+            args = self.args
+        args = [self.argdict[arg] if isinstance(arg, basestring) else arg
+                for arg in args]
+        value = getDualValue(self.root, args, fallback)
+        if isinstance(value, Dual):
+            return value.value, array(value.getDerivatives())
+        return value, zeros((len(args),) + shape(value))
+
+    def evaluateBatch(self, values, args = None):
+        """Evaluate the equation for many samples of the Argument values.
+
+        The samples are broadcast through the Operators of the tree along a
+        leading batch axis, so they are computed together. Operators that
+        cannot broadcast the samples are evaluated one sample at a time. See
+        diffpy.srfit.equation.visitors.batchevaluator.
+
+        values  --  The values of the samples, with one row per sample and one
+                    column per Argument.
+        args    --  The Arguments or their names (default None). If this is
+                    None, all Arguments of the Equation are used.
+
+        Returns an array with the value of the equation for each sample along
+        the first axis. The Arguments keep their values.
+
+        Raises ValueError if values does not have a column for each Argument.
+
+        """
+        if args is None:
+            args = self.args
+        args = [self.argdict[arg] if isinstance(arg, basestring) else arg
+                for arg in args]
+        saved = [arg.getValue() for arg in args]
+        try:
+            value = getBatchValue(self.root, args, values)
+        finally:
+            for arg, v in zip(args, saved):
+                arg.setValue(v)
+        if isinstance(value, Batch):
+            return value.data
+        # The value does not depend on the Arguments
+        result = empty((len(values),) + shape(value))
+        result[:] = value
+        return result
+
     # Operator methods
 
     def addLiteral(self, literal):
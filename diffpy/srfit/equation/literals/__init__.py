@@ -30,9 +30,13 @@ __all__ = ["Argument", "Operator", "AdditionOperator", "SubtractionOperator",
         "MultiplicationOperator", "DivisionOperator", "ExponentiationOperator",
         "RemainderOperator", "NegationOperator", "ConvolutionOperator",
         "SumOperator", "UFuncOperator", "ListOperator", "SetOperator",
-        "ArrayOperator", "PolyvalOperator"]
+        "ArrayOperator", "PolyvalOperator", "setInvalidation",
+        "getInvalidation"]
 
 
+from diffpy.srfit.equation.literals.literal import setInvalidation
+from diffpy.srfit.equation.literals.literal import getInvalidation
+
 # Import the operators
 
 from diffpy.srfit.equation.literals.argument import Argument
@@ -25,6 +25,7 @@ class LiteralABC(object):
     """Abstract Base Class for Literal. See Literal for usage."""
 
     __metaclass__ = ABCMeta
+    __slots__ = ()
 
     @abstractmethod
     def identify(self, visitor): pass
@@ -39,6 +40,8 @@ class LiteralABC(object):
 class ArgumentABC(LiteralABC):
     """Abstract Base Class for Argument. See Argument for usage."""
 
+    __slots__ = ()
+
     @abstractmethod
     def setValue(self, value): pass
 
@@ -50,6 +53,8 @@ class ArgumentABC(LiteralABC):
 class OperatorABC(LiteralABC):
     """Abstract Base Class for Operator. See Operator for usage."""
 
+    __slots__ = ()
+
     @abstractmethod
     def addLiteral(self, literal): pass
 
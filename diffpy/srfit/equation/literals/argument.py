@@ -21,8 +21,10 @@ constant.
 
 __all__ = ["Argument"]
 
+from numpy import ndarray
+
 from diffpy.srfit.equation.literals.abcs import ArgumentABC
-from diffpy.srfit.equation.literals.literal import Literal
+from diffpy.srfit.equation.literals.literal import Literal, _state
 
 class Argument(Literal, ArgumentABC):
     """Argument class.
@@ -36,7 +38,7 @@ class Argument(Literal, ArgumentABC):
 
     """
 
-    const = None
+    __slots__ = ("const",)
 
     def __init__(self, name = None, value = None, const = False):
         """Initialization."""
@@ -58,7 +60,15 @@ class Argument(Literal, ArgumentABC):
 
         val --  The value to assign
 
+        In the "version" invalidation model, arrays are not compared element
+        by element. An array is only unchanged if it is the stored array.
+
         """
+        if _state.versioned and isinstance(val, ndarray):
+            if val is not self._value:
+                self.notify()
+                self._value = val
+            return
         notequiv = self._value is None or val is None or (val != self._value)
         if notequiv is False:
             return
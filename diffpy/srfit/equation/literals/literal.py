@@ -18,13 +18,109 @@ Literals are base pieces of the equation hierarchy. The 'identify' method
 identifies the Literal to a visitor by calling the identifying method of the
 vistior.
 
+Literals carry a version that is advanced whenever they change. Two models
+are used to invalidate the cached values of Operators (see setInvalidation).
+In the "observer" model, a change is propagated through the tree by
+notifications. In the "version" model, notifications stop at the Operators
+that observe a changed Literal, and an Operator checks the versions of its
+arguments when its value is read. The model is shared by all Literals, and is
+not switched while Operators hold values cached in the other model.
+
+Literal, Argument, Operator and the built-in Operators store their attributes
+in __slots__, so that large trees and Parameter sets stay compact. Classes
+derived from them have an instance dictionary, unless they define __slots__
+as well.
+
 """
 
-__all__ = ["Literal"]
+__all__ = ["Literal", "setInvalidation", "getInvalidation"]
+
+import gc
+import threading
+import weakref
 
 from diffpy.srfit.equation.literals.abcs import LiteralABC
 from diffpy.srfit.util.observable import Observable
 
+class _InvalidationState(object):
+    """The invalidation model shared by all Literals.
+
+    Attributes
+    clock       --  The last version handed out to a Literal.
+    versioned   --  Flag indicating whether the "version" model is used.
+    since       --  The clock when the current model was set.
+    cached      --  Weak set of the Operators that computed a value since
+                    the current model was set.
+    lock        --  Lock that guards the clock and switching the model.
+
+    """
+
+    def __init__(self):
+        self.clock = 1
+        self.versioned = False
+        self.since = 1
+        self.cached = weakref.WeakSet()
+        self.lock = threading.Lock()
+        return
+
+    def tick(self):
+        """Advance the clock and return the new version."""
+        with self.lock:
+            self.clock += 1
+            return self.clock
+
+# End class _InvalidationState
+
+_state = _InvalidationState()
+
+def setInvalidation(model, flush = False):
+    """Set the model used to invalidate the cached values of Operators.
+
+    The model is shared by all Literals. Values cached in one model are not
+    invalidated correctly in the other, so the model is not switched while
+    Operators hold cached values, unless flush is True.
+
+    model   --  "observer" to propagate changes through the tree when they
+                are made, or "version" to check the versions of the arguments
+                of an Operator when its value is read.
+    flush   --  Flag indicating whether to discard the cached values of
+                Operators and notify their observers (default False).
+
+    Raises ValueError if model is not known, or if Operators hold cached
+    values and flush is False.
+
+    """
+    if model not in ("observer", "version"):
+        raise ValueError("Unknown invalidation model '%s'" % model)
+    versioned = (model == "version")
+    if versioned == _state.versioned:
+        return
+    cached = sum(op._value is not None for op in _state.cached)
+    if cached and not flush:
+        # Operators in reference cycles may be unreachable
+        gc.collect()
+        cached = sum(op._value is not None for op in _state.cached)
+    if cached and not flush:
+        m = "Cannot switch to the '%s' model while %i Operators hold " \
+            "cached values" % (model, cached)
+        raise ValueError(m)
+    # Discard the values in the "observer" model, so that the observers of
+    # the Operators are notified.
+    _state.versioned = False
+    for op in list(_state.cached):
+        op._value = None
+        op.notify()
+    with _state.lock:
+        _state.clock += 1
+        _state.since = _state.clock
+        _state.cached = weakref.WeakSet()
+        _state.versioned = versioned
+    return
+
+def getInvalidation():
+    """Get the model used to invalidate the cached values of Operators."""
+    return "version" if _state.versioned else "observer"
+
 class Literal(Observable,LiteralABC):
     """Abstract class for equation pieces, such as operators and arguments.
 
@@ -33,22 +129,44 @@ class Literal(Observable,LiteralABC):
     Attributes
     name    --  A name for this Literal (default None).
     _value  --  The value of the Literal.
+    _version    --  The version of the Literal. This is advanced from a
+                shared clock when the Literal notifies its observers.
 
     """
 
-    name = None
-    _value = None
+    __slots__ = ("_observers", "__weakref__", "name", "_value", "_version")
 
     def __init__(self, name = None):
         """Initialization."""
         Observable.__init__(self)
         self.name = name
+        self._value = None
+        self._version = 0
         return
 
     def getValue(self):
         """Get the value of the Literal."""
         raise NotImplementedError("Define in derived class")
 
+    def _getOperand(self):
+        """Get the value for use as an argument of a ufunc Operator.
+
+        Ufunc Operators do not hold on to the values of their arguments.
+        Operators use this to keep their output buffers. See
+        Operator.getValue.
+
+        """
+        return self.getValue()
+
+    def getVersion(self):
+        """Get the version of the Literal.
+
+        The version is larger than that of any earlier change of the Literal
+        or the Literals it depends on.
+
+        """
+        return self._version
+
     def identify(self, visitor):
         """Identify self to a visitor."""
         m = "'%s' must override 'identify'" % self.__class__.__name__
@@ -62,7 +180,61 @@ class Literal(Observable,LiteralABC):
         self.notify(other)
         return
 
+    def notify(self, other=()):
+        """Advance the version and notify observers."""
+        self._version = _state.tick()
+        Observable.notify(self, other)
+        return
+
     def __str__(self):
         return "%s(%s)"%(self.__class__.__name__, self.name)
 
+    def __getstate__(self):
+        """Get the state for pickling.
+
+        This holds the slots that are set and the instance dictionary, if
+        there is one.
+
+        """
+        state = dict(getattr(self, "__dict__", ()))
+        for name, slot in _getSlots(type(self)):
+            try:
+                state[name] = slot.__get__(self)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        """Restore the state from pickling."""
+        slots = dict(_getSlots(type(self)))
+        for name, value in state.iteritems():
+            slot = slots.get(name)
+            if slot is None:
+                self.__dict__[name] = value
+            else:
+                slot.__set__(self, value)
+        return
+
+# End class Literal
+
+# Slot names and descriptors of Literal classes, indexed by class
+_slotcache = {}
+
+def _getSlots(cls):
+    """Get the names and descriptors of the slots of a class.
+
+    Returns a list of (name, descriptor) tuples. The slot for weak references
+    is left out.
+
+    """
+    slots = _slotcache.get(cls)
+    if slots is None:
+        slots = []
+        for c in cls.__mro__:
+            for name in c.__dict__.get("__slots__", ()):
+                if name != "__weakref__":
+                    slots.append((name, c.__dict__[name]))
+        _slotcache[cls] = slots
+    return slots
+
 # End of file
@@ -31,10 +31,12 @@ __all__ = ["Operator", "AdditionOperator", "SubtractionOperator",
         "SumOperator", "UFuncOperator", "ListOperator", "SetOperator",
         "ArrayOperator", "PolyvalOperator"]
 
+
 import numpy
 
 from diffpy.srfit.equation.literals.abcs import OperatorABC
-from diffpy.srfit.equation.literals.literal import Literal
+from diffpy.srfit.equation.literals.literal import Literal, _state
+from diffpy.srfit.util import instrumentation
 
 
 class Operator(Literal, OperatorABC):
@@ -53,15 +55,19 @@ class Operator(Literal, OperatorABC):
     symbol  --  The symbolic representation. e.g. "+" or "sin".
     _value  --  The value of the Operator.
     value   --  Property for 'getValue'.
+    _buffer --  The array last returned by a ufunc operation, which is
+                reused as the output of the next evaluation, or None. The
+                buffer is dropped when the value is handed out by
+                'getValue'. See 'callUFunc'.
+    _bufsig --  The signature of the inputs that produced _buffer.
+    _stamp  --  The version clock when _value was computed.
+    _maxversion --  The largest version of the Operator and its arguments.
+    _checked    --  The version clock when _maxversion was found.
 
     """
 
-    args = None
-    nin = None
-    nout = None
-    operation = None
-    symbol = None
-    _value = None
+    __slots__ = ("args", "nin", "nout", "operation", "symbol", "_buffer",
+            "_bufsig", "_stamp", "_maxversion", "_checked")
 
     def __init__(self, name = None, symbol = None, operation = None, nin = 2,
             nout = 1):
@@ -72,6 +78,16 @@ class Operator(Literal, OperatorABC):
         self.nout = nout
         self.args = []
         self.operation = operation
+        self._initCache()
+        return
+
+    def _initCache(self):
+        """Initialize the bookkeeping of the cached value."""
+        self._buffer = None
+        self._bufsig = None
+        self._stamp = 0
+        self._maxversion = 0
+        self._checked = -1
         return
 
     def identify(self, visitor):
@@ -95,14 +111,71 @@ class Operator(Literal, OperatorABC):
         return
 
     def getValue(self):
-        """Get or evaluate the value of the operator."""
+        """Get or evaluate the value of the operator.
+
+        The caller may hold on to the value, so it is not reused as the output
+        buffer of a later evaluation. Ufunc Operators read the values of their
+        arguments with '_getOperand', which keeps the buffer.
+
+        """
+        value = self._getOperand()
+        if value is self._buffer:
+            self._buffer = None
+        return value
+
+    def _getOperand(self):
+        """Get or evaluate the value of the operator, keeping its buffer."""
+        if self._value is not None and _state.versioned:
+            if self._stamp < self.getVersion():
+                self._value = None
         if self._value is None:
-            vals = [l.value for l in self.args]
-            self._value = self.operation(*vals)
+            if self._stamp < _state.since:
+                # First value since the model was set. See setInvalidation.
+                _state.cached.add(self)
+            self._stamp = _state.clock
+            if isinstance(self.operation, numpy.ufunc):
+                vals = [l._getOperand() for l in self.args]
+                self._value, self._buffer, self._bufsig = callUFunc(
+                        self.operation, vals, self._buffer, self._bufsig)
+            else:
+                vals = [l.value for l in self.args]
+                self._value = self.operation(*vals)
         return self._value
 
     value = property(lambda self: self.getValue())
 
+    def getVersion(self):
+        """Get the version of the Operator.
+
+        This is the largest version of the Operator and its arguments. It is
+        found once for each state of the version clock.
+
+        """
+        clock = _state.clock
+        if self._checked != clock:
+            version = self._version
+            for arg in self.args:
+                v = arg.getVersion()
+                if v > version:
+                    version = v
+            self._maxversion = version
+            self._checked = clock
+        return self._maxversion
+
+    def _flush(self, other):
+        """Invalidate my state and notify observers.
+
+        In the "version" invalidation model the observers are not notified.
+        Operators that depend on this one find the change from its version.
+
+        """
+        if _state.versioned:
+            self._value = None
+            self._version = _state.tick()
+            return
+        Literal._flush(self, other)
+        return
+
     def _loopCheck(self, literal):
         """Check if a literal causes self-reference."""
         if literal is self:
@@ -114,12 +187,41 @@ class Operator(Literal, OperatorABC):
                 self._loopCheck(l)
         return
 
+def callUFunc(ufunc, vals, buf, bufsig):
+    """Call a ufunc, reusing an output buffer if it fits.
+
+    The buffer is reused only if the inputs have the same shapes and dtypes as
+    the inputs that produced it. Otherwise a new array is allocated. The caller
+    owns the buffer, and must only pass an array that nobody else holds.
+
+    ufunc   --  The numpy ufunc to call.
+    vals    --  The list of input values.
+    buf     --  The array last returned from this function that may be
+                overwritten, or None.
+    bufsig  --  The input signature returned with buf.
+
+    Returns the value, the buffer for the next call and its signature.
+    """
+    sig = tuple([(getattr(v, "shape", None), getattr(v, "dtype", type(v)))
+        for v in vals])
+    if buf is not None and sig == bufsig and ufunc.nout == 1:
+        instrumentation.increment("operator.reused")
+        return ufunc(*vals, out = buf), buf, sig
+
+    val = ufunc(*vals)
+    if isinstance(val, numpy.ndarray) and val.ndim > 0:
+        instrumentation.increment("operator.allocated")
+        return val, val, sig
+    return val, None, None
+
 # Some specified operators
 
 
 class AdditionOperator(Operator):
     """Addition operator."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -131,6 +233,8 @@ class AdditionOperator(Operator):
 class SubtractionOperator(Operator):
     """Subtraction operator."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -142,6 +246,8 @@ class SubtractionOperator(Operator):
 class MultiplicationOperator(Operator):
     """Multiplication operator."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -153,6 +259,8 @@ class MultiplicationOperator(Operator):
 class DivisionOperator(Operator):
     """Division operator."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -164,6 +272,8 @@ class DivisionOperator(Operator):
 class ExponentiationOperator(Operator):
     """Exponentiation operator."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -175,6 +285,8 @@ class ExponentiationOperator(Operator):
 class RemainderOperator(Operator):
     """Remainder operator."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -186,6 +298,8 @@ class RemainderOperator(Operator):
 class NegationOperator(Operator):
     """Negation operator."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -232,6 +346,8 @@ class ConvolutionOperator(Operator):
 
     """
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -243,6 +359,8 @@ class ConvolutionOperator(Operator):
 class SumOperator(Operator):
     """numpy.sum operator."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -261,6 +379,8 @@ class UFuncOperator(Operator):
 
     """
 
+    __slots__ = ()
+
     def __init__(self, op):
         """Initialization.
 
@@ -282,6 +402,8 @@ def _makeList(*args):
 class ListOperator(Operator):
     """Operator that will take parameters and turn them into a list."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -297,6 +419,8 @@ def _makeSet(*args):
 class SetOperator(Operator):
     """Operator that will take parameters and turn them into a set."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -312,6 +436,8 @@ def _makeArray(*args):
 class ArrayOperator(Operator):
     """Operator that will take parameters and turn them into an array."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
@@ -324,6 +450,8 @@ class ArrayOperator(Operator):
 class PolyvalOperator(Operator):
     """Operator for numpy polyval."""
 
+    __slots__ = ()
+
     def __init__(self):
         """Initialization."""
         Operator.__init__(self)
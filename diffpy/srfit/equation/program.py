@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""Flat evaluation programs for Literal trees.
+
+A Program is a Literal tree lowered into a list of value slots and a list of
+instructions that are executed in order. The leaves of the tree (Arguments
+and any Literal that manages its own value, such as a nested Equation or a
+ProfileGenerator) are read into slots. The Operators of the tree become
+instructions that compute a slot from other slots.
+
+Each leaf has a dirty flag. When a leaf is invalidated, the instructions that
+depend on it are marked, and only those are executed by the next run. This
+replaces the cascade of cache invalidation through the Operators of the tree.
+In the "version" invalidation model (see
+diffpy.srfit.equation.literals.literal.setInvalidation), Operator leaves do not
+notify the Program, so their versions are checked when the Program is run.
+
+A Program can be folded for a set of variable Arguments. The subtrees that do
+not depend on the variables then become leaves that cache their own values,
+so they add no instructions to the program.
+
+"""
+
+__all__ = ["Program"]
+
+import numpy
+
+from diffpy.srfit.equation.visitors.visitor import Visitor
+from diffpy.srfit.equation.visitors import getFolded
+from diffpy.srfit.equation.literals import operators
+from diffpy.srfit.equation.literals.operators import Operator, callUFunc
+from diffpy.srfit.equation.literals.literal import _state
+
+# Operator classes that can be lowered into instructions. Other Operators
+# (Equations, generators and calculators) manage their own values.
+_inlinetypes = frozenset(getattr(operators, name)
+        for name in operators.__all__)
+
+class Program(object):
+    """Flat evaluation program for a Literal tree.
+
+    The first slots hold the values of the leaves, in the order of 'leaves'.
+    Literals that appear several times in the tree are evaluated once.
+
+    Attributes
+    leaves  --  List of the leaf Literals of the tree.
+    code    --  List of (slot, operation, input slots) instructions, ordered
+                such that the inputs of an instruction are computed before it.
+    values  --  List of the slot values.
+    result  --  The slot holding the value of the tree.
+    _leafidx    --  Dictionary of leaf indices, indexed by the id of the leaf.
+    _downstream --  List of the instructions that depend on each leaf.
+    _dirty  --  List of the indices of the leaves that must be read.
+    _stale  --  List of flags indicating which instructions must be executed.
+    _bufsigs    --  List of the input signatures of the slot values of ufunc
+                instructions, or None for other instructions.
+    _reuse  --  List of flags indicating which ufunc instructions reuse their
+                slot value as the output buffer (see
+                diffpy.srfit.equation.literals.operators.callUFunc). This is
+                the case if only ufunc instructions read the slot, since other
+                operations may hold on to their inputs. The result is handed
+                to the caller, so its slot is not reused.
+    _pending    --  Flag indicating whether the program must be run.
+    _opleaves   --  List of the indices of the leaves that are Operators.
+    _versions   --  Dictionary of the versions of the Operator leaves when
+                they were last read, indexed by leaf index.
+
+    """
+
+    def __init__(self, root, variables = None):
+        """Lower a Literal tree.
+
+        root    --  The root of the Literal tree.
+        variables   --  The Arguments that may change (default None). If this
+                    is not None, then the subtrees that do not depend on these
+                    become leaves. The Program is correct for any change of
+                    the Arguments, but it is only efficient if it is limited
+                    to the variables.
+
+        """
+        folded = ()
+        if variables is not None:
+            folded = getFolded(root, variables)
+        lowerer = _Lowerer(folded)
+        self.result = root.identify(lowerer)
+        self.leaves = lowerer.leaves
+        nleaves = len(self.leaves)
+
+        # Number the slots with the leaves first
+        self.code = []
+        for out, operation, ins in lowerer.code:
+            ins = tuple(nleaves + j if j >= 0 else -1 - j for j in ins)
+            self.code.append( (nleaves + out, operation, ins) )
+        if self.result >= 0:
+            self.result += nleaves
+        else:
+            self.result = -1 - self.result
+
+        self._leafidx = dict((id(leaf), i)
+                for i, leaf in enumerate(self.leaves))
+
+        # Find the instructions that depend on each slot
+        deps = [set() for _i in xrange(nleaves + len(self.code))]
+        for k, (out, operation, ins) in enumerate(self.code):
+            for j in ins:
+                deps[out].update(deps[j])
+                deps[out].add(j)
+        self._downstream = [[] for _i in xrange(nleaves)]
+        for k, (out, operation, ins) in enumerate(self.code):
+            for j in deps[out]:
+                if j < nleaves:
+                    self._downstream[j].append(k)
+
+        self.values = [None] * (nleaves + len(self.code))
+        self._dirty = range(nleaves)
+        self._stale = [True] * len(self.code)
+        self._bufsigs = [() if isinstance(operation, numpy.ufunc) else None
+                for out, operation, ins in self.code]
+        private = [True] * len(self.values)
+        private[self.result] = False
+        for k, (out, operation, ins) in enumerate(self.code):
+            if self._bufsigs[k] is None:
+                for j in ins:
+                    private[j] = False
+        self._reuse = [private[out] for out, operation, ins in self.code]
+        self._pending = True
+        self._opleaves = [i for i, leaf in enumerate(self.leaves)
+                if isinstance(leaf, Operator)]
+        self._versions = {}
+        return
+
+    def invalidate(self, literal = None):
+        """Mark a leaf as changed.
+
+        literal --  The leaf that changed. If this is None or not a leaf of the
+                    program, then all leaves are marked.
+
+        """
+        idx = self._leafidx.get(id(literal))
+        if idx is None:
+            self._dirty = range(len(self.leaves))
+            self._stale = [True] * len(self.code)
+        else:
+            self._dirty.append(idx)
+            stale = self._stale
+            for k in self._downstream[idx]:
+                stale[k] = True
+        self._pending = True
+        return
+
+    def run(self):
+        """Get the value of the tree.
+
+        Only the instructions that depend on changed leaves are executed.
+        """
+        if _state.versioned:
+            self._checkVersions()
+        values = self.values
+        if not self._pending:
+            return values[self.result]
+
+        leaves = self.leaves
+        for i in self._dirty:
+            values[i] = leaves[i].getValue()
+        self._dirty = []
+
+        stale = self._stale
+        bufsigs = self._bufsigs
+        reuse = self._reuse
+        getvalue = values.__getitem__
+        for k, (out, operation, ins) in enumerate(self.code):
+            if stale[k]:
+                if bufsigs[k] is None:
+                    values[out] = operation(*map(getvalue, ins))
+                else:
+                    buf = values[out] if reuse[k] else None
+                    values[out], buf, bufsigs[k] = callUFunc(operation,
+                            map(getvalue, ins), buf, bufsigs[k])
+                stale[k] = False
+
+        self._pending = False
+        return values[self.result]
+
+    def _checkVersions(self):
+        """Invalidate the Operator leaves that changed since they were read.
+        """
+        versions = self._versions
+        for i in self._opleaves:
+            leaf = self.leaves[i]
+            version = leaf.getVersion()
+            if versions.get(i) != version:
+                versions[i] = version
+                self.invalidate(leaf)
+        return
+
+# End class Program
+
+class _Lowerer(Visitor):
+    """Visitor that lowers a Literal tree into instructions.
+
+    Each node returns its slot. Leaf slots are negative (-1 - leaf index) and
+    instruction slots are non-negative, so they can be numbered as they are
+    found.
+
+    Attributes
+    leaves  --  List of the leaf Literals.
+    code    --  List of (slot, operation, input slots) instructions.
+    _folded --  Set of the ids of the Operators that are leaves.
+    _slots  --  Dictionary of slots, indexed by the id of the Literal.
+
+    """
+
+    def __init__(self, folded = ()):
+        """Initialize.
+
+        folded  --  Operators that are leaves (default ()).
+
+        """
+        self.leaves = []
+        self.code = []
+        self._folded = set(id(op) for op in folded)
+        self._slots = {}
+        return
+
+    def onArgument(self, arg):
+        """Process an Argument node."""
+        return self._leaf(arg)
+
+    def onOperator(self, op):
+        """Process an Operator node."""
+        if type(op) not in _inlinetypes or id(op) in self._folded:
+            return self._leaf(op)
+        slot = self._slots.get(id(op))
+        if slot is None:
+            ins = tuple(arg.identify(self) for arg in op.args)
+            slot = self._slots[id(op)] = len(self.code)
+            self.code.append( (slot, op.operation, ins) )
+        return slot
+
+    def onEquation(self, eq):
+        """Process an Equation node.
+
+        Equations evaluate and cache their own values.
+        """
+        return self._leaf(eq)
+
+    def _leaf(self, literal):
+        """Get the slot of a leaf."""
+        slot = self._slots.get(id(literal))
+        if slot is None:
+            slot = self._slots[id(literal)] = -1 - len(self.leaves)
+            self.leaves.append(literal)
+        return slot
+
+# End class _Lowerer
+
+# End of file
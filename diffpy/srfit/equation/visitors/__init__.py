@@ -23,10 +23,22 @@ The Literal-Visitor relationship is that described by the Visitor pattern
 
 """
 
+from diffpy.srfit.equation.literals.abcs import OperatorABC
+from diffpy.srfit.equation.literals.argument import Argument
 from diffpy.srfit.equation.visitors.argfinder import ArgFinder
 from diffpy.srfit.equation.visitors.printer import Printer
 from diffpy.srfit.equation.visitors.validator import Validator
 from diffpy.srfit.equation.visitors.swapper import Swapper
+from diffpy.srfit.equation.visitors.affinefinder import AffineFinder
+from diffpy.srfit.equation.visitors.linearitychecker import LinearityChecker
+from diffpy.srfit.equation.visitors.merger import Merger
+from diffpy.srfit.equation.visitors.folder import Folder
+from diffpy.srfit.equation.visitors.differentiator import Differentiator
+from diffpy.srfit.equation.visitors.differentiator import registerRule
+from diffpy.srfit.equation.visitors.differentiator import gradientRule
+from diffpy.srfit.equation.visitors.differentiator import dualRule
+from diffpy.srfit.equation.visitors.dualevaluator import DualEvaluator
+from diffpy.srfit.equation.visitors.batchevaluator import BatchEvaluator
 
 def getArgs(literal, getconsts = True):
     """Get the Arguments of a Literal tree.
@@ -40,6 +52,133 @@ def getArgs(literal, getconsts = True):
     v = ArgFinder(getconsts)
     return literal.identify(v)
 
+def getAffine(literal):
+    """Get the affine form of a Literal tree.
+
+    Returns a tuple (coefs, offset), where coefs is a list of
+    (Argument, coefficient) pairs and offset is a scalar, such that the value
+    of the tree is the sum of coefficient*Argument plus offset. Each Argument
+    appears in coefs at most once. Returns None if the tree is not an affine
+    function of its non-constant Arguments.
+
+    """
+    v = AffineFinder()
+    form = literal.identify(v)
+    if form is None:
+        return None
+    coefs, offset = form
+    # Combine repeated Arguments
+    args = []
+    total = {}
+    for arg, c in coefs:
+        if id(arg) not in total:
+            args.append(arg)
+            total[id(arg)] = 0.0
+        total[id(arg)] += c
+    coefs = [(arg, total[id(arg)]) for arg in args]
+    return coefs, offset
+
+def getBatchValue(literal, args, values):
+    """Evaluate a Literal tree for many samples of some of its Arguments.
+
+    args    --  The Arguments to sample, as they appear in the tree.
+    values  --  The values of the samples, with one row per sample and one
+                column per Argument.
+
+    Returns the value of the tree. If the tree depends on the Arguments, this
+    is a Batch (diffpy.srfit.equation.batch) that holds the value of each
+    sample. Arguments may be left at the values of the last sample. See
+    diffpy.srfit.equation.visitors.batchevaluator.
+
+    Raises ValueError if values does not have a column for each Argument.
+
+    """
+    v = BatchEvaluator(args, values)
+    return literal.identify(v)
+
+def getDegree(literal, args):
+    """Get the degree of a Literal tree in a set of Arguments.
+
+    Returns 0 if the tree does not depend on the Arguments, 1 if it is an
+    affine function of them and None otherwise.
+
+    """
+    v = LinearityChecker(args)
+    return literal.identify(v)
+
+def getDerivative(literal, arg, fallback = None):
+    """Get the derivative of a Literal tree with respect to an Argument.
+
+    arg         --  The Argument, as it appears in the tree.
+    fallback    --  The derivative rule for Operators without a registered
+                    rule, such as Calculators and ProfileGenerators (default
+                    None). See diffpy.srfit.equation.visitors.differentiator.
+
+    Returns a Literal tree for the derivative. It shares nodes with the
+    original tree. If the tree does not depend on arg, this is a constant
+    Argument with value 0.
+
+    Raises ValueError if the tree contains an Operator that cannot be
+    differentiated.
+
+    """
+    v = Differentiator(arg, fallback)
+    deriv = literal.identify(v)
+    if deriv is None:
+        deriv = Argument(value = 0.0, const = True)
+    return deriv
+
+def getDualValue(literal, args, fallback = None):
+    """Evaluate a Literal tree with dual numbers.
+
+    args        --  The Arguments to seed, as they appear in the tree.
+    fallback    --  The evaluation rule for Operators that are not evaluated
+                    from their arguments alone, such as Calculators and
+                    ProfileGenerators (default None). See
+                    diffpy.srfit.equation.visitors.dualevaluator.
+
+    Returns the value of the tree. If the tree depends on the Arguments, this
+    is a Dual (diffpy.srfit.equation.dual) that holds the derivatives with
+    respect to args.
+
+    Raises ValueError if the tree contains an Operator that does not propagate
+    dual numbers.
+
+    """
+    v = DualEvaluator(args, fallback)
+    return literal.identify(v)
+
+def getFolded(literal, variables):
+    """Get the invariant subtrees of a Literal tree.
+
+    variables   --  The Arguments that may change.
+
+    Returns the list of the largest Operator subtrees that do not depend on
+    the variables.
+
+    """
+    v = Folder(variables)
+    if literal.identify(v):
+        return v.folded
+    if isinstance(literal, OperatorABC):
+        return [literal]
+    return []
+
+def mergeCommonSubexpressions(literals):
+    """Merge common subexpressions of Literal trees.
+
+    Structurally identical subtrees over the same Arguments are replaced by a
+    single shared node, within and between the trees. Changes are done
+    in-place, except for a root that is itself replaced.
+
+    literals    --  Iterable of the roots of the Literal trees.
+
+    Returns the list of the roots with the replacements made.
+
+    """
+    v = Merger()
+    return [literal.identify(v) for literal in literals]
+
 def prettyPrint(literal):
     """Print a Literal tree."""
     v = Printer()
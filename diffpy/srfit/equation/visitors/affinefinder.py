@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""Visitor for finding the affine form of a Literal tree.
+
+AffineFinder determines whether a Literal tree is an affine function of its
+non-constant Arguments, i.e. whether it can be written as
+c_1*a_1 + c_2*a_2 + ... + c_n*a_n + b,
+where a_i are the non-constant Arguments and c_i and b are scalars.
+
+"""
+
+__all__ = ["AffineFinder"]
+
+import numpy
+
+from diffpy.srfit.equation.visitors.visitor import Visitor
+
+class AffineFinder(Visitor):
+    """AffineFinder finds the coefficients of an affine Literal tree.
+
+    Each node returns a tuple (coefs, offset), where coefs is a list of
+    (Argument, coefficient) pairs and offset is a scalar, or None if the node
+    is not affine. An Argument may appear more than once in coefs. Constant
+    Arguments and Operators without non-constant Arguments are folded into the
+    offset. Only scalar values are considered affine.
+
+    """
+
+    def onArgument(self, arg):
+        """Process an Argument node."""
+        val = arg.getValue()
+        if not _isScalar(val):
+            return None
+        if arg.const:
+            return ([], val)
+        return ([(arg, 1.0)], 0.0)
+
+    def onOperator(self, op):
+        """Process an Operator node."""
+        parts = []
+        for arg in op.args:
+            part = arg.identify(self)
+            if part is None:
+                return None
+            parts.append(part)
+
+        # Fold constant operations
+        if not any(coefs for coefs, offset in parts):
+            val = op.getValue()
+            if not _isScalar(val):
+                return None
+            return ([], val)
+
+        f = op.operation
+        if f is numpy.add:
+            (c1, b1), (c2, b2) = parts
+            return (c1 + c2, b1 + b2)
+        if f is numpy.subtract:
+            (c1, b1), (c2, b2) = parts
+            return (c1 + _scale(c2, -1), b1 - b2)
+        if f is numpy.negative:
+            (c1, b1), = parts
+            return (_scale(c1, -1), -b1)
+        if f is numpy.multiply:
+            (c1, b1), (c2, b2) = parts
+            # One of the factors must be constant
+            if not c1:
+                return (_scale(c2, b1), b1 * b2)
+            if not c2:
+                return (_scale(c1, b2), b1 * b2)
+            return None
+        if f is numpy.divide or f is numpy.true_divide:
+            (c1, b1), (c2, b2) = parts
+            # The divisor must be a non-zero constant
+            if c2 or b2 == 0:
+                return None
+            d = 1.0 / b2
+            return (_scale(c1, d), b1 * d)
+
+        return None
+
+    def onEquation(self, eq):
+        """Process an Equation node.
+
+        This looks through the Equation to its root.
+
+        """
+        return eq.root.identify(self)
+
+# End class AffineFinder
+
+def _isScalar(val):
+    """Check whether a value is a real scalar."""
+    return numpy.isscalar(val) and numpy.isreal(val) and \
+            not isinstance(val, basestring)
+
+def _scale(coefs, c):
+    """Scale a list of (Argument, coefficient) pairs."""
+    return [(arg, c * v) for arg, v in coefs]
+
+# End of file
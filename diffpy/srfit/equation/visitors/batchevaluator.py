@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""Visitor for evaluating a Literal tree at many parameter vectors.
+
+BatchEvaluator evaluates a Literal tree for a number of samples of the values
+of some of its Arguments. The samples are held in Batches
+(diffpy.srfit.equation.batch) that are broadcast through the Operators of the
+tree, so the samples are computed together. The values of subtrees that do
+not depend on the sampled Arguments are taken from the tree.
+
+Operators whose operation does not broadcast Batches fall back to a loop over
+the samples. Operators that compute their value from their arguments alone
+are called with the values of each sample. Other Operators, such as
+Calculators and ProfileGenerators, are evaluated after setting the sampled
+Arguments to the values of each sample. The Arguments are left at the values
+of the last sample.
+
+"""
+
+__all__ = ["BatchEvaluator"]
+
+import numpy
+
+from diffpy.srfit.equation.visitors.visitor import Visitor
+from diffpy.srfit.equation.literals import operators
+from diffpy.srfit.equation.batch import Batch, call, hasBatch, sample
+
+# Operator classes that compute their value from their arguments alone
+_puretypes = frozenset(getattr(operators, name)
+        for name in operators.__all__)
+
+# Operations that are known to not broadcast Batches
+_loopoperations = frozenset([numpy.polyval, operators._conv,
+    operators._makeArray])
+
+class BatchEvaluator(Visitor):
+    """BatchEvaluator evaluates a Literal tree for many samples.
+
+    Each node returns its value. Values that depend on the sampled Arguments
+    are Batches.
+
+    Attributes
+    args    --  The sampled Arguments.
+    values  --  The array of the values of the samples, with one row per
+                sample and one column per Argument.
+    _batches    --  Dictionary of the Batches of the sampled Arguments,
+                indexed by the id of the Argument.
+    _done   --  Dictionary of the values of visited Operators, indexed by the
+                id of the Operator.
+
+    """
+
+    def __init__(self, args, values):
+        """Initialize.
+
+        Arguments
+        args    --  The Arguments to sample.
+        values  --  The values of the samples, with one row per sample and
+                    one column per Argument.
+
+        Raises ValueError if values does not have a column for each Argument.
+
+        """
+        values = numpy.asarray(values)
+        if values.ndim != 2 or values.shape[1] != len(args):
+            raise ValueError("The values must have %i columns" % len(args))
+        self.args = list(args)
+        self.values = values
+        self._batches = dict((id(arg), Batch(values[:,i]))
+                for i, arg in enumerate(args))
+        self._done = {}
+        return
+
+    def onArgument(self, arg):
+        """Process an Argument node."""
+        b = self._batches.get(id(arg))
+        if b is not None:
+            return b
+        return arg.getValue()
+
+    def onOperator(self, op):
+        """Process an Operator node."""
+        if id(op) in self._done:
+            return self._done[id(op)]
+
+        values = [arg.identify(self) for arg in op.args]
+        pure = type(op) in _puretypes
+        if pure and not hasBatch(values):
+            # Pure Operators do not depend on anything else
+            value = op.getValue()
+        elif pure and op.operation not in _loopoperations:
+            try:
+                value = call(op.operation, values, op.name)
+            except ValueError:
+                value = self._loop(op, values)
+        else:
+            value = self._loop(op, values)
+
+        self._done[id(op)] = value
+        return value
+
+    def onEquation(self, eq):
+        """Process an Equation node.
+
+        This looks through the Equation to its root.
+
+        """
+        if id(eq) not in self._done:
+            self._done[id(eq)] = eq.root.identify(self)
+        return self._done[id(eq)]
+
+    def _loop(self, op, values):
+        """Evaluate an Operator one sample at a time.
+
+        Returns a Batch, or the value of op if it does not depend on the
+        samples.
+
+        """
+        pure = type(op) in _puretypes
+        results = []
+        recomputed = False
+        version = None
+        for k, row in enumerate(self.values):
+            if pure:
+                results.append(op.operation(*[sample(v, k) for v in values]))
+                continue
+            for arg, v in zip(self.args, row):
+                arg.setValue(v)
+            # The version of the Operator advances if a sample changes it
+            current = op.getVersion()
+            recomputed = recomputed or (k > 0 and current != version)
+            version = current
+            # Copy, since the Operator may reuse its output array
+            results.append(numpy.array(op.getValue()))
+        if not pure and not recomputed:
+            # The Operator does not depend on the samples
+            return op.getValue()
+        return Batch(numpy.array(results))
+
+# End class BatchEvaluator
+
+# End of file
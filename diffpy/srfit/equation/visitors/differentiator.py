@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""Visitor for differentiating a Literal tree.
+
+Differentiator builds a Literal tree for the derivative of a Literal tree with
+respect to one of its Arguments. The derivative tree uses the nodes of the
+original tree where it needs their values, so the values that the original
+tree has already computed are reused.
+
+The derivative of an Operator is found from a rule that is registered for its
+operation with 'registerRule'. Rules are defined for the arithmetic
+operators, common numpy ufuncs, sum, polyval and the list and array
+operators. Operators without a rule, such as Calculators, ProfileGenerators
+and registered functions, are passed to the fallback rule of the
+Differentiator.
+
+A rule is called as rule(op, dargs), where op is the Operator and dargs is the
+list of the derivatives of the arguments of op. A derivative is a Literal, or
+None if it is zero. The rule returns the derivative of op in the same form.
+
+Functions that provide their own partial derivatives can use 'gradientRule'.
+Such a function has a 'gradient' attribute that takes the same arguments as
+the function and returns the list of the derivatives of the function with
+respect to its arguments after the first.
+
+Functions that are written with numpy operations can use 'dualRule', which
+evaluates them with dual numbers (diffpy.srfit.equation.dual).
+
+"""
+
+__all__ = ["Differentiator", "registerRule", "gradientRule", "dualRule"]
+
+import operator
+
+import numpy
+
+from diffpy.srfit.equation.visitors.visitor import Visitor
+from diffpy.srfit.equation.literals import operators
+from diffpy.srfit.equation.literals.argument import Argument
+from diffpy.srfit.equation.dual import Dual, call
+
+# Operator classes that compute their value from their arguments alone
+_puretypes = frozenset(getattr(operators, name)
+        for name in operators.__all__)
+
+# Derivative rules, indexed by operation
+_rules = {}
+
+def registerRule(operation, rule):
+    """Register the derivative rule of an operation.
+
+    operation   --  The operation of the Operators, e.g. numpy.sin.
+    rule        --  Callable rule(op, dargs) that returns the derivative of the
+                    Operator op, given the derivatives dargs of its arguments.
+                    Derivatives are Literals, or None if they are zero. This
+                    replaces the rule of the operation, if any.
+
+    """
+    _rules[operation] = rule
+    return
+
+class Differentiator(Visitor):
+    """Differentiator builds the derivative of a Literal tree.
+
+    Each node returns a Literal for its derivative with respect to the
+    Argument, or None if the derivative is zero.
+
+    Attributes
+    arg     --  The Argument to differentiate with respect to. This must be
+                the Argument that appears in the tree, not a ParameterProxy to
+                it.
+    fallback    --  The rule for Operators that have no registered rule, or
+                None. See the module documentation.
+    _done   --  Dictionary of the derivatives of visited Operators, indexed by
+                the id of the Operator.
+
+    """
+
+    def __init__(self, arg, fallback = None):
+        """Initialize.
+
+        Arguments
+        arg         --  The Argument to differentiate with respect to.
+        fallback    --  The rule for Operators that have no registered rule,
+                        such as Calculators and ProfileGenerators (default
+                        None). If this is None, such Operators cannot be
+                        differentiated.
+
+        """
+        self.arg = arg
+        self.fallback = fallback
+        self._done = {}
+        return
+
+    def onArgument(self, arg):
+        """Process an Argument node."""
+        if arg is self.arg:
+            return _const(1.0)
+        return None
+
+    def onOperator(self, op):
+        """Process an Operator node.
+
+        Raises ValueError if the Operator has no rule and the fallback rule is
+        None.
+
+        """
+        if id(op) in self._done:
+            return self._done[id(op)]
+
+        dargs = [arg.identify(self) for arg in op.args]
+        pure = type(op) in _puretypes
+        rule = _rules.get(op.operation)
+        if pure and not any(d is not None for d in dargs):
+            # Pure Operators do not depend on anything else
+            deriv = None
+        elif rule is not None and pure:
+            deriv = rule(op, dargs)
+        elif self.fallback is not None:
+            deriv = self.fallback(op, dargs)
+        else:
+            raise ValueError("Cannot differentiate '%s'" % op.name)
+
+        self._done[id(op)] = deriv
+        return deriv
+
+    def onEquation(self, eq):
+        """Process an Equation node.
+
+        This looks through the Equation to its root.
+
+        """
+        if id(eq) not in self._done:
+            self._done[id(eq)] = eq.root.identify(self)
+        return self._done[id(eq)]
+
+# End class Differentiator
+
+# Builders for derivative trees. These take and return derivatives, i.e.
+# Literals or None for zero, and skip trivial operations.
+
+def _const(value):
+    """Make a constant Argument."""
+    return Argument(value = value, const = True)
+
+def _isConst(lit, value):
+    """Check whether a Literal is a constant with a given scalar value."""
+    if not isinstance(lit, Argument) or not lit.const:
+        return False
+    v = lit.getValue()
+    return numpy.isscalar(v) and v == value
+
+def _op(opclass, *args):
+    """Make an Operator of a class with arguments."""
+    op = opclass()
+    for arg in args:
+        op.addLiteral(arg)
+    return op
+
+def _ufunc(ufunc, *args):
+    """Make a ufunc Operator with arguments."""
+    op = operators.UFuncOperator(ufunc)
+    for arg in args:
+        op.addLiteral(arg)
+    return op
+
+def _function(name, f, *args):
+    """Make an Operator for a function."""
+    op = operators.Operator(name, name, f, len(args), 1)
+    for arg in args:
+        op.addLiteral(arg)
+    return op
+
+def _add(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return _op(operators.AdditionOperator, a, b)
+
+def _sub(a, b):
+    if b is None:
+        return a
+    if a is None:
+        return _neg(b)
+    return _op(operators.SubtractionOperator, a, b)
+
+def _neg(a):
+    if a is None:
+        return None
+    return _op(operators.NegationOperator, a)
+
+def _mul(a, b):
+    if a is None or b is None:
+        return None
+    if _isConst(a, 1):
+        return b
+    if _isConst(b, 1):
+        return a
+    return _op(operators.MultiplicationOperator, a, b)
+
+def _div(a, b):
+    if a is None:
+        return None
+    if _isConst(b, 1):
+        return a
+    return _op(operators.DivisionOperator, a, b)
+
+def _orZero(d):
+    """Get a derivative as a Literal."""
+    if d is None:
+        return _const(0.0)
+    return d
+
+def _sumLike(du, u):
+    """Sum du broadcast to the shape of u."""
+    return numpy.sum(numpy.broadcast_to(du, numpy.shape(u)))
+
+# Rules
+
+def _addRule(op, dargs):
+    return _add(*dargs)
+
+def _subtractRule(op, dargs):
+    return _sub(*dargs)
+
+def _negativeRule(op, dargs):
+    return _neg(dargs[0])
+
+def _multiplyRule(op, dargs):
+    a, b = op.args
+    da, db = dargs
+    return _add(_mul(da, b), _mul(a, db))
+
+def _divideRule(op, dargs):
+    # d(a/b) = da/b - (a/b)*db/b
+    a, b = op.args
+    da, db = dargs
+    return _sub(_div(da, b), _div(_mul(op, db), b))
+
+def _powerRule(op, dargs):
+    # d(a**b) = b*a**(b-1)*da + a**b*log(a)*db
+    a, b = op.args
+    da, db = dargs
+    d = None
+    if da is not None:
+        if _isConst(b, 2):
+            factor = _mul(_const(2.0), a)
+        elif isinstance(b, Argument) and b.const:
+            bval = b.getValue()
+            factor = _mul(b, _op(operators.ExponentiationOperator, a,
+                _const(bval - 1)))
+        else:
+            power = _op(operators.ExponentiationOperator, a,
+                    _sub(b, _const(1.0)))
+            factor = _mul(b, power)
+        d = _mul(factor, da)
+    if db is not None:
+        d = _add(d, _mul(_mul(op, _ufunc(numpy.log, a)), db))
+    return d
+
+def _chain(factor):
+    """Make the rule of a unary function from the derivative factor.
+
+    factor  --  Function factor(op, a) that returns the derivative of op as a
+                function of its argument a.
+
+    """
+    def rule(op, dargs):
+        return _mul(factor(op, op.args[0]), dargs[0])
+    return rule
+
+def _arcsinFactor(op, a):
+    root = _ufunc(numpy.sqrt, _sub(_const(1.0), _mul(a, a)))
+    return _div(_const(1.0), root)
+
+def _sumRule(op, dargs):
+    du, = dargs
+    return _function("sum", _sumLike, du, op.args[0])
+
+def _polyvalRule(op, dargs):
+    # The value is linear in the coefficients p
+    p, x = op.args
+    dp, dx = dargs
+    d = None
+    if dp is not None:
+        d = _op(operators.PolyvalOperator, dp, x)
+    if dx is not None:
+        dpoly = _function("polyder", numpy.polyder, p)
+        d = _add(d, _mul(_op(operators.PolyvalOperator, dpoly, x), dx))
+    return d
+
+def _sequenceRule(op, dargs):
+    d = _function(op.name, op.operation, *map(_orZero, dargs))
+    d.nin = op.nin
+    return d
+
+def gradientRule(op, dargs):
+    """Derivative rule for functions with a 'gradient' attribute.
+
+    The first argument of the function, such as the r-grid of a
+    characteristic function, must not depend on the Argument.
+
+    Raises ValueError if the first argument depends on the Argument.
+
+    """
+    if dargs[0] is not None:
+        raise ValueError("Cannot differentiate '%s' with respect to its "
+                "first argument" % op.name)
+    f = op.operation
+    grad = _function("d%s" % op.name, f.gradient, *op.args)
+    d = None
+    for idx, darg in enumerate(dargs[1:]):
+        if darg is None:
+            continue
+        item = _function("getitem", operator.getitem, grad, _const(idx))
+        d = _add(d, _mul(item, darg))
+    return d
+
+def dualRule(op, dargs):
+    """Derivative rule that evaluates the operation with dual numbers.
+
+    The arguments of the operation that depend on the Argument are passed as
+    Duals whose dual parts are their derivatives. The derivative tree raises
+    ValueError when it is evaluated if the operation does not propagate the
+    Duals.
+
+    """
+    f = op.operation
+    nargs = len(op.args)
+    affected = [idx for idx, d in enumerate(dargs) if d is not None]
+    if not affected:
+        return None
+
+    def derivative(*values):
+        args = list(values[:nargs])
+        for idx, d in zip(affected, values[nargs:]):
+            args[idx] = _seeded(args[idx], d)
+        value = call(f, args, op.name)
+        if not isinstance(value, Dual):
+            raise ValueError("'%s' does not propagate dual numbers" %
+                    op.name)
+        deriv = value.getDerivatives()[0]
+        if deriv.ndim == 0:
+            return deriv.item()
+        return deriv
+
+    dvalues = [dargs[idx] for idx in affected]
+    return _function("d%s" % op.name, derivative, *(op.args + dvalues))
+
+def _seeded(value, d):
+    """Make a Dual with a single dual part.
+
+    Raises ValueError if the derivative d does not broadcast to the shape of
+    value.
+
+    """
+    ndim = numpy.ndim(value)
+    if numpy.ndim(d) > ndim:
+        raise ValueError("The derivative has more dimensions than the value")
+    shape = (1,) * (ndim - numpy.ndim(d) + 1) + numpy.shape(d)
+    return Dual(value, numpy.reshape(d, shape))
+
+registerRule(numpy.add, _addRule)
+registerRule(numpy.subtract, _subtractRule)
+registerRule(numpy.negative, _negativeRule)
+registerRule(numpy.multiply, _multiplyRule)
+registerRule(numpy.divide, _divideRule)
+registerRule(numpy.true_divide, _divideRule)
+registerRule(numpy.power, _powerRule)
+registerRule(numpy.sum, _sumRule)
+registerRule(numpy.polyval, _polyvalRule)
+registerRule(operators._makeList, _sequenceRule)
+registerRule(operators._makeArray, _sequenceRule)
+
+registerRule(numpy.sin, _chain(lambda op, a: _ufunc(numpy.cos, a)))
+registerRule(numpy.cos, _chain(lambda op, a: _neg(_ufunc(numpy.sin, a))))
+registerRule(numpy.tan,
+        _chain(lambda op, a: _add(_const(1.0), _mul(op, op))))
+registerRule(numpy.sinh, _chain(lambda op, a: _ufunc(numpy.cosh, a)))
+registerRule(numpy.cosh, _chain(lambda op, a: _ufunc(numpy.sinh, a)))
+registerRule(numpy.tanh,
+        _chain(lambda op, a: _sub(_const(1.0), _mul(op, op))))
+registerRule(numpy.arcsin, _chain(_arcsinFactor))
+registerRule(numpy.arccos, _chain(lambda op, a: _neg(_arcsinFactor(op, a))))
+registerRule(numpy.arctan, _chain(lambda op, a:
+        _div(_const(1.0), _add(_const(1.0), _mul(a, a)))))
+registerRule(numpy.exp, _chain(lambda op, a: op))
+registerRule(numpy.expm1, _chain(lambda op, a: _add(op, _const(1.0))))
+registerRule(numpy.log, _chain(lambda op, a: _div(_const(1.0), a)))
+registerRule(numpy.log10, _chain(lambda op, a:
+        _div(_const(1.0 / numpy.log(10)), a)))
+registerRule(numpy.log1p, _chain(lambda op, a:
+        _div(_const(1.0), _add(_const(1.0), a))))
+registerRule(numpy.sqrt, _chain(lambda op, a: _div(_const(0.5), op)))
+registerRule(numpy.square, _chain(lambda op, a: _mul(_const(2.0), a)))
+registerRule(numpy.absolute, _chain(lambda op, a: _ufunc(numpy.sign, a)))
+
+# End of file
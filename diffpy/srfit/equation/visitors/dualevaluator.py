@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""Visitor for evaluating a Literal tree with dual numbers.
+
+DualEvaluator evaluates a Literal tree with some of its Arguments seeded as
+Duals (diffpy.srfit.equation.dual). The value of the tree then holds its
+derivatives with respect to all of the seeded Arguments, which are found in a
+single evaluation. The values of subtrees that do not depend on the seeds are
+taken from the tree, so they are not recomputed.
+
+Operators pass the Duals to their operations. This works for the arithmetic
+operators, the numpy ufuncs supported by Dual and registered functions that
+are written with these. Operators whose operation does not propagate Duals
+raise ValueError. Operators that do not compute their value from their
+arguments alone, such as Calculators and ProfileGenerators, are passed to the
+fallback of the DualEvaluator.
+
+"""
+
+__all__ = ["DualEvaluator"]
+
+import numpy
+
+from diffpy.srfit.equation.visitors.visitor import Visitor
+from diffpy.srfit.equation.literals import operators
+from diffpy.srfit.equation.dual import call, hasDual, seed, stack
+
+# Operator classes that compute their value from their arguments alone
+_puretypes = frozenset(getattr(operators, name)
+        for name in operators.__all__)
+
+def _polyval(p, x):
+    """Evaluate a polynomial with Horner's method."""
+    value = 0
+    for i in xrange(len(p)):
+        value = value * x + p[i]
+    return value
+
+def _makeArray(*args):
+    return stack(args)
+
+# Replacements for operations that convert their arguments to arrays
+_dualoperations = {
+        numpy.polyval : _polyval,
+        operators._makeArray : _makeArray,
+        }
+
+class DualEvaluator(Visitor):
+    """DualEvaluator evaluates a Literal tree with dual numbers.
+
+    Each node returns its value. Values that depend on the seeded Arguments
+    are Duals.
+
+    Attributes
+    fallback    --  Callable fallback(op, values) for Operators that are not
+                evaluated from their arguments alone, or None. It gets the
+                Operator and the values of its arguments and returns the value
+                of the Operator, which must be a Dual if the Operator depends
+                on a seeded Argument.
+    _seeds  --  Dictionary of the seeded values, indexed by the id of the
+                Argument.
+    _done   --  Dictionary of the values of visited Operators, indexed by the
+                id of the Operator.
+
+    """
+
+    def __init__(self, args, fallback = None):
+        """Initialize.
+
+        Arguments
+        args        --  The Arguments to seed. The dual parts of the values
+                        run over these, in order.
+        fallback    --  The fallback for Operators that are not evaluated
+                        from their arguments alone, such as Calculators and
+                        ProfileGenerators (default None). If this is None,
+                        such Operators cannot be evaluated.
+
+        """
+        duals = seed([arg.getValue() for arg in args])
+        self._seeds = dict((id(arg), d) for arg, d in zip(args, duals))
+        self.fallback = fallback
+        self._done = {}
+        return
+
+    def onArgument(self, arg):
+        """Process an Argument node."""
+        d = self._seeds.get(id(arg))
+        if d is not None:
+            return d
+        return arg.getValue()
+
+    def onOperator(self, op):
+        """Process an Operator node.
+
+        Raises ValueError if the Operator does not propagate dual numbers.
+
+        """
+        if id(op) in self._done:
+            return self._done[id(op)]
+
+        values = [arg.identify(self) for arg in op.args]
+        pure = type(op) in _puretypes
+        dual = hasDual(values)
+        if pure and not dual:
+            # Pure Operators do not depend on anything else
+            value = op.getValue()
+        elif pure:
+            f = _dualoperations.get(op.operation, op.operation)
+            value = call(f, values, op.name)
+        elif self.fallback is not None:
+            value = self.fallback(op, values)
+        else:
+            raise ValueError("Cannot evaluate '%s' with dual numbers" %
+                    op.name)
+
+        self._done[id(op)] = value
+        return value
+
+    def onEquation(self, eq):
+        """Process an Equation node.
+
+        This looks through the Equation to its root.
+
+        """
+        if id(eq) not in self._done:
+            self._done[id(eq)] = eq.root.identify(self)
+        return self._done[id(eq)]
+
+# End class DualEvaluator
+
+# End of file
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""Visitor for finding the invariant subtrees of a Literal tree.
+
+Folder finds the largest subtrees that do not depend on a set of variable
+Arguments, such as the free variables of a refinement. The values of these
+subtrees can be cached for as long as the variables are the only Arguments
+that change.
+
+"""
+
+__all__ = ["Folder"]
+
+from diffpy.srfit.equation.visitors.visitor import Visitor
+from diffpy.srfit.equation.literals.abcs import OperatorABC
+
+class Folder(Visitor):
+    """Folder finds the invariant subtrees of a Literal tree.
+
+    Each node returns True if it depends on the variables and False
+    otherwise.
+
+    Attributes
+    variables   --  Set of the ids of the variable Arguments.
+    folded  --  List of the invariant Operators whose parent depends on the
+                variables, in the order they are found. If the root of the
+                tree is invariant, it must be added by the caller.
+    _folded --  Set of the ids of the Operators in folded.
+    _done   --  Dictionary of the results for visited Operators, indexed by
+                the id of the Operator.
+
+    """
+
+    def __init__(self, variables):
+        """Initialize.
+
+        Arguments
+        variables   --  The Arguments that may change.
+
+        """
+        self.variables = set(id(arg) for arg in variables)
+        self.folded = []
+        self._folded = set()
+        self._done = {}
+        return
+
+    def onArgument(self, arg):
+        """Process an Argument node."""
+        return id(arg) in self.variables
+
+    def onOperator(self, op):
+        """Process an Operator node."""
+        varies = self._done.get(id(op))
+        if varies is not None:
+            return varies
+        flags = [arg.identify(self) for arg in op.args]
+        varies = self._done[id(op)] = any(flags)
+        if varies:
+            self._fold(op.args, flags)
+        return varies
+
+    def onEquation(self, eq):
+        """Process an Equation node.
+
+        This looks through the Equation to its root.
+
+        """
+        varies = self._done.get(id(eq))
+        if varies is not None:
+            return varies
+        varies = self._done[id(eq)] = eq.root.identify(self)
+        return varies
+
+    def _fold(self, args, flags):
+        """Record the invariant Operator arguments of a variable node."""
+        for arg, varies in zip(args, flags):
+            if varies or not isinstance(arg, OperatorABC):
+                continue
+            if id(arg) not in self._folded:
+                self._folded.add(id(arg))
+                self.folded.append(arg)
+        return
+
+# End class Folder
+
+# End of file
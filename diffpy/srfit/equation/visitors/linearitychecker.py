@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""Visitor for checking whether a Literal tree is linear in some Arguments.
+
+LinearityChecker determines the degree of a Literal tree in a set of
+Arguments. Unlike AffineFinder, the other Arguments may hold arrays, so this
+can be used on the equations of a FitContribution.
+
+"""
+
+__all__ = ["LinearityChecker"]
+
+import numpy
+
+from diffpy.srfit.equation.visitors.visitor import Visitor
+from diffpy.srfit.equation.literals.operators import _makeList, _makeArray
+from diffpy.srfit.equation.literals.operators import _conv
+
+# Operations that are linear in each argument
+_additive = (numpy.add, numpy.subtract, numpy.negative, numpy.sum, _makeList,
+        _makeArray)
+
+class LinearityChecker(Visitor):
+    """LinearityChecker finds the degree of a tree in a set of Arguments.
+
+    Each node returns 0 if it does not depend on the Arguments, 1 if it is an
+    affine function of the Arguments and None otherwise.
+
+    Attributes
+    args    --  Set of the ids of the Arguments.
+    nodes   --  Set of the ids of the Operators that have been visited.
+
+    """
+
+    def __init__(self, args):
+        """Initialize.
+
+        Arguments
+        args    --  The Arguments in which to check the linearity.
+
+        """
+        self.args = set(id(arg) for arg in args)
+        self.nodes = set()
+        return
+
+    def onArgument(self, arg):
+        """Process an Argument node."""
+        if id(arg) in self.args:
+            return 1
+        return 0
+
+    def onOperator(self, op):
+        """Process an Operator node."""
+        self.nodes.add(id(op))
+        degrees = [arg.identify(self) for arg in op.args]
+        if None in degrees:
+            return None
+        if not any(degrees):
+            return 0
+
+        f = op.operation
+        if f in _additive:
+            return max(degrees)
+        if f is numpy.multiply or f is _conv:
+            # Only one factor may depend on the arguments
+            d1, d2 = degrees
+            return d1 + d2 if d1 + d2 == 1 else None
+        if f is numpy.divide or f is numpy.true_divide:
+            d1, d2 = degrees
+            return d1 if d2 == 0 else None
+        if f is numpy.polyval:
+            # Linear in the coefficients
+            d1, d2 = degrees
+            return d1 if d2 == 0 else None
+
+        return None
+
+    def onEquation(self, eq):
+        """Process an Equation node.
+
+        This looks through the Equation to its root.
+
+        """
+        self.nodes.add(id(eq))
+        return eq.root.identify(self)
+
+# End class LinearityChecker
+
+# End of file
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""Visitor for merging common subexpressions of Literal trees.
+
+Merger finds structurally identical subtrees, i.e. Operators of the same kind
+applied to the same Arguments, and replaces them by a single shared node. The
+shared node observes its arguments as before and is observed by all of its
+parents, so it is computed once per evaluation and invalidated as usual. The
+replaced nodes no longer observe their arguments.
+
+"""
+
+__all__ = ["Merger"]
+
+import numpy
+
+from diffpy.srfit.equation.visitors.visitor import Visitor
+from diffpy.srfit.equation.literals import operators
+
+# Operator classes that compute their value from their arguments alone. Other
+# Operators (generators and calculators) have their own state and are never
+# merged.
+_mergetypes = frozenset(getattr(operators, name)
+        for name in operators.__all__)
+
+class Merger(Visitor):
+    """Merger merges common subexpressions of Literal trees.
+
+    Each node returns the node that replaces it. Operators are merged if they
+    have the same operation, name, symbol and arguments. Constant
+    Arguments with the same name and scalar value are merged as well, since
+    the builder creates a new constant for every number in an equation
+    string. The arguments of Operators that are kept are replaced in-place.
+    The roots of Equations are reset after their trees are merged. Use the
+    same Merger on several trees to merge subexpressions between them.
+
+    Attributes
+    merged  --  Number of nodes that have been replaced.
+    _nodes  --  Dictionary of kept nodes, indexed by their key.
+    _done   --  Dictionary of the replacements of visited nodes, indexed by
+                the id of the node.
+
+    """
+
+    def __init__(self):
+        self.merged = 0
+        self._nodes = {}
+        self._done = {}
+        return
+
+    def onArgument(self, arg):
+        """Process an Argument node."""
+        val = arg.getValue()
+        if not (arg.const and numpy.isscalar(val)):
+            return arg
+        key = (type(arg), arg.name, type(val), val)
+        return self._keep(key, arg)
+
+    def onOperator(self, op):
+        """Process an Operator node."""
+        if type(op) not in _mergetypes:
+            return op
+        lit = self._done.get(id(op))
+        if lit is not None:
+            return lit
+
+        args = [arg.identify(self) for arg in op.args]
+        # The builder makes the first use of a ufunc a UFuncOperator and the
+        # others plain Operators, so the type is not part of the key.
+        key = (op.operation, op.name, op.symbol, op.nin, op.nout,
+                tuple(id(arg) for arg in args))
+        lit = self._keep(key, op)
+        if lit is op:
+            _replaceArgs(op, args)
+        else:
+            _detachArgs(op)
+        self._done[id(op)] = lit
+        return lit
+
+    def onEquation(self, eq):
+        """Process an Equation node.
+
+        Equations are never merged, but their trees are.
+
+        """
+        if id(eq) in self._done:
+            return eq
+        self._done[id(eq)] = eq
+        if eq.root is not None:
+            eq.setRoot(eq.root.identify(self))
+        return eq
+
+    def _keep(self, key, lit):
+        """Get the node for a key, registering lit if there is none."""
+        node = self._nodes.setdefault(key, lit)
+        if node is not lit:
+            self.merged += 1
+        return node
+
+# End class Merger
+
+def _replaceArgs(op, args):
+    """Replace the arguments of an Operator in-place."""
+    changed = False
+    for idx, (old, new) in enumerate(zip(op.args, args)):
+        if old is new:
+            continue
+        op.args[idx] = new
+        if old not in op.args:
+            old.removeObserver(op._flush)
+        new.addObserver(op._flush)
+        changed = True
+    if changed:
+        op._flush(other=())
+    return
+
+def _detachArgs(op):
+    """Stop a replaced Operator from observing its arguments."""
+    for arg in set(op.args):
+        if arg._observers and op._flush in arg._observers:
+            arg.removeObserver(op._flush)
+    return
+
+# End of file
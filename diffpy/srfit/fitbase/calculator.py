@@ -81,6 +81,23 @@ class Calculator(Operator, ParameterSet):
         """
         return 0
 
+    # Overload me!
+    def gradient(self, args, parnames):
+        """Get the derivatives of the signal with respect to Parameters.
+
+        This method can be overloaded to provide analytic derivatives. It is
+        optional, so a derivative that is not available is None and must be
+        computed by other means, e.g. by finite differences.
+
+        args        --  The tuple of arguments passed to __call__.
+        parnames    --  The names of the Parameters of this calculator.
+
+        Returns a list that holds the derivative of the signal for each name
+        in parnames, or None if that derivative is not available.
+
+        """
+        return [None] * len(parnames)
+
     def operation(self, *args):
         self._value = self.__call__(*args)
         return self._value
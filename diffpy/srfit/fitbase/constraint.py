@@ -19,12 +19,21 @@ Constraints are used by a FitRecipe (and other RecipeOrganizers) to organize
 constraint equations. They store a Parameter object and an Equation object that
 is used to compute its value. The Constraint.constrain method is used to create
 this association.
+
+Affine Constraints can be grouped into a ConstraintBlock, which updates all of
+its constrained Parameters with one sparse matrix-vector product.
 """
 
-__all__ = ["Constraint"]
+__all__ = ["Constraint", "ConstraintBlock"]
+
+from itertools import izip
+
+import numpy
 
 from diffpy.srfit.exceptions import SrFitError
+from diffpy.srfit.equation.literals import getInvalidation
 from diffpy.srfit.fitbase.validatable import Validatable
+from diffpy.srfit.util import instrumentation
 
 
 class Constraint(Validatable):
@@ -37,6 +46,11 @@ class Constraint(Validatable):
     par     --  A Parameter that is the subject of the constraint.
     eq      --  An equation whose evaluation is used to set the value of the
                 constraint.
+    _dirty  --  Flag indicating whether par needs to be updated. This is set
+                when eq or par notify that they have changed.
+    _eqversion  --  The version of eq at the last update. In the "version"
+                invalidation model eq does not notify, so this is compared
+                with its current version.
 
     """
 
@@ -44,6 +58,8 @@ class Constraint(Validatable):
         """Initialization. """
         self.par = None
         self.eq = None
+        self._dirty = True
+        self._eqversion = None
         return
 
     def constrain(self, par, eq):
@@ -66,23 +82,53 @@ class Constraint(Validatable):
 
         self.par = par
         self.eq = eq
+        self.eq.addObserver(self._flush)
+        self.par.addObserver(self._flush)
+        self._dirty = True
         self.update()
         return
 
     def unconstrain(self):
         """Clear the constraint."""
         self.par.constrained = False
+        self.eq.removeObserver(self._flush)
+        self.par.removeObserver(self._flush)
         self.par = None
         self.eq = None
+        self._dirty = True
         return
 
     def update(self):
-        """Update the parameter according to the equation."""
+        """Update the parameter according to the equation.
+
+        The equation is only evaluated if it or the parameter changed since
+        the last update.
+        """
+        version = None
+        if getInvalidation() == "version":
+            version = self.eq.getVersion()
+            self._dirty = self._dirty or version != self._eqversion
+        if not self._dirty:
+            instrumentation.increment("constraint.skipped")
+            return
+        instrumentation.increment("constraint.updated")
         # This will be evaluated quickly thanks to the Equation class.
         val = self.eq()
         # This will only change the Parameter if val is different from the
         # currently stored value.
         self.par.setValue(val)
+        # Setting par notifies us, so we clear the flag afterwards.
+        self._dirty = False
+        self._eqversion = version
+        return
+
+    def _flush(self, other):
+        """Mark the constraint as needing an update.
+
+        This is called when the equation or the constrained parameter
+        changes.
+        """
+        self._dirty = True
         return
 
     def _validate(self):
@@ -117,4 +163,174 @@ class Constraint(Validatable):
 
         return
 
+# End class Constraint
+
+class ConstraintBlock(object):
+    """A group of affine Constraints that are updated together.
+
+    Each Constraint in the block must have an equation that is an affine
+    function of its non-constant arguments (see
+    diffpy.srfit.equation.visitors.getAffine). The values of the constrained
+    Parameters are computed as
+    matrix * (values of args) + offset.
+    The Constraints in a block must not depend on each other.
+
+    Attributes
+    constraints --  The list of Constraints in the block.
+    pars        --  The list of constrained Parameters.
+    args        --  The list of arguments of the constraint equations.
+    matrix      --  Sparse matrix of coefficients with a row for each of pars
+                    and a column for each of args.
+    offset      --  Array of offsets, one for each of pars.
+    _consts     --  The constant arguments of the constraint equations. The
+                    coefficients are rebuilt if one of these changes.
+    _values     --  The values last assigned to pars, or None.
+    _dirty      --  Flag indicating whether the args changed since the last
+                    update.
+    _pardirty   --  Flag indicating whether pars were changed outside of the
+                    last update.
+    _stale      --  Flag indicating whether matrix and offset need to be
+                    rebuilt.
+
+    """
+
+    def __init__(self, constraints):
+        """Initialize the block.
+
+        constraints --  Constraints with affine equations.
+
+        Raises ValueError if a constraint equation is not affine.
+
+        """
+        self.constraints = list(constraints)
+        self.pars = [con.par for con in self.constraints]
+        self.args = []
+        self.matrix = None
+        self.offset = None
+        self._consts = []
+        self._values = None
+        self._dirty = True
+        self._pardirty = True
+        self._stale = True
+        self._build()
+        self._observe()
+        return
+
+    def release(self):
+        """Stop observing the arguments and Parameters of the block."""
+        for arg in self.args:
+            arg.removeObserver(self._flush)
+        for arg in self._consts:
+            arg.removeObserver(self._flushConstant)
+        for par in self.pars:
+            par.removeObserver(self._flushPar)
+        return
+
+    def update(self):
+        """Update the constrained Parameters.
+
+        The Parameters are only recomputed if an argument changed since the
+        last update, and only Parameters whose value changed are set.
+        """
+        n = len(self.pars)
+        if not (self._dirty or self._pardirty or self._stale):
+            instrumentation.increment("constraint.skipped", n)
+            return
+        instrumentation.increment("constraint.updated", n)
+
+        if self._stale:
+            self._rebuild()
+
+        x = numpy.array([arg.getValue() for arg in self.args], dtype=float)
+        values = self.matrix.dot(x) + self.offset
+        # Python floats are compared faster than numpy scalars in setValue
+        if self._pardirty or self._values is None:
+            for par, val in izip(self.pars, values.tolist()):
+                par.setValue(val)
+        else:
+            pars = self.pars
+            changed = numpy.flatnonzero(values != self._values)
+            for i, val in izip(changed, values[changed].tolist()):
+                pars[i].setValue(val)
+
+        self._values = values
+        self._dirty = False
+        self._pardirty = False
+        return
+
+    def _build(self):
+        """Find the arguments and the coefficients of the block.
+
+        Raises ValueError if a constraint equation is not affine.
+        """
+        from scipy.sparse import csr_matrix
+        from diffpy.srfit.equation.visitors import getAffine, getArgs
+
+        argidx = {}
+        rows = []
+        cols = []
+        data = []
+        offset = numpy.zeros(len(self.constraints), dtype=float)
+        consts = {}
+        for i, con in enumerate(self.constraints):
+            form = getAffine(con.eq)
+            if form is None:
+                raise ValueError("The constraint on '%s' is not affine" %
+                        con.par.name)
+            coefs, offset[i] = form
+            for arg, c in coefs:
+                j = argidx.get(id(arg))
+                if j is None:
+                    j = argidx[id(arg)] = len(self.args)
+                    self.args.append(arg)
+                rows.append(i)
+                cols.append(j)
+                data.append(c)
+            for arg in getArgs(con.eq.root):
+                if arg.const:
+                    consts[id(arg)] = arg
+
+        shape = (len(self.constraints), len(self.args))
+        self.matrix = csr_matrix((data, (rows, cols)), shape = shape)
+        self.offset = offset
+        self._consts = consts.values()
+        self._stale = False
+        return
+
+    def _rebuild(self):
+        """Rebuild the coefficients after a constant changed."""
+        self.release()
+        self.args = []
+        self._build()
+        self._observe()
+        self._pardirty = True
+        return
+
+    def _observe(self):
+        """Observe the arguments and Parameters of the block."""
+        for arg in self.args:
+            arg.addObserver(self._flush)
+        for arg in self._consts:
+            arg.addObserver(self._flushConstant)
+        for par in self.pars:
+            par.addObserver(self._flushPar)
+        return
+
+    def _flush(self, other):
+        """Mark the block as needing an update."""
+        self._dirty = True
+        return
+
+    def _flushConstant(self, other):
+        """Mark the coefficients of the block as needing a rebuild."""
+        self._stale = True
+        return
+
+    def _flushPar(self, other):
+        """Mark the constrained Parameters as changed outside of update."""
+        self._pardirty = True
+        return
+
+# End class ConstraintBlock
+
 # End of file
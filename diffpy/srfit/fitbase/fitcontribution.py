@@ -270,9 +270,28 @@ class FitContribution(_fitcontribution_interface, ParameterSet):
         # the following will not recompute the equation.
         return self._reseq()
 
-    def evaluate(self):
-        """Evaluate the contribution equation."""
-        return self._eq()
+    def evaluate(self, values = None, args = None):
+        """Evaluate the contribution equation.
+
+        values  --  The values of samples of the Parameters of the equation,
+                    with one row per sample and one column per Parameter
+                    (default None). If this is None, the equation is evaluated
+                    at the current values. See Equation.evaluateBatch.
+        args    --  The Parameters or their names (default None). If this is
+                    None, the Parameters of the equation other than those of
+                    the Profile are used, in the order of the 'args' attribute
+                    of the equation.
+
+        Returns the value of the equation, or an array of the values for the
+        samples along the first axis.
+
+        """
+        if values is None:
+            return self._eq()
+        if args is None:
+            pnames = (self._xname, self._yname, self._dyname)
+            args = [arg for arg in self._eq.args if arg.name not in pnames]
+        return self._eq.evaluateBatch(values, args)
 
     def _validate(self):
         """Validate my state.
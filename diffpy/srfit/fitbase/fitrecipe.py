@@ -34,14 +34,28 @@ using FitRecipe.
 
 __all__ = ["FitRecipe"]
 
-from numpy import array, concatenate, sqrt, dot
+from itertools import izip
 
+from numpy.linalg import lstsq
+from numpy import array, empty, zeros, arange, concatenate, multiply, sqrt, \
+        dot, isscalar, ravel
+
+from diffpy.srfit.exceptions import SrFitError
 from diffpy.srfit.interface import _fitrecipe_interface
 from diffpy.srfit.util.ordereddict import OrderedDict
 from diffpy.srfit.util.tagmanager import TagManager
+from diffpy.srfit.equation.literals.literal import Literal
+from diffpy.srfit.equation.visitors import getAffine, getDegree, \
+        LinearityChecker, Differentiator, gradientRule, dualRule
+from diffpy.srfit.equation.literals.operators import Operator
+from diffpy.srfit.fitbase.constraint import Constraint, ConstraintBlock
+from diffpy.srfit.fitbase.restraint import Restraint
 from diffpy.srfit.fitbase.parameter import ParameterProxy
 from diffpy.srfit.fitbase.recipeorganizer import RecipeOrganizer
+from diffpy.srfit.fitbase.profilegenerator import ProfileGenerator
+from diffpy.srfit.fitbase.calculator import Calculator
 from diffpy.srfit.fitbase.fithook import PrintFitHook
+from diffpy.srfit.fitbase.recipepool import _checkPopulation, _evaluate
 
 class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
     """FitRecipe class.
@@ -56,6 +70,14 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
                         'constrain' method.
     _oconstraints   --  An ordered list of the constraints from this and all
                         sub-components.
+    _constraintlevels   --  The constraints in '_oconstraints' grouped by
+                        level. The constraints of a level depend only on
+                        constraints of the previous levels, so those of one
+                        level can be updated in any order.
+    _constraintupdates  --  The ConstraintBlocks and Constraints that update
+                        the constrained Parameters, in the order they must be
+                        updated. The affine constraints of each level are
+                        grouped into a ConstraintBlock.
     _calculators    --  A managed dictionary of Calculators.
     _contributions  --  A managed OrderedDict of FitContributions.
     _parameters     --  A managed OrderedDict of parameters (in this case the
@@ -64,7 +86,8 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
     _eqfactory      --  A diffpy.srfit.equation.builder.EquationFactory
                         instance that is used to create constraints and
                         restraints from string
-    _restraintlist  --  A list of restraints from this and all sub-components.
+    _restraintlist  --  A list of restraints from this and all sub-components,
+                        in the order they were created.
     _restraints     --  A set of Restraints. Restraints can be added using the
                         'restrain' or 'confine' methods.
     _ready          --  A flag indicating if all attributes are ready for the
@@ -75,6 +98,37 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
                         FitContribution when determining the overall residual.
     _fixedtag       --  "__fixed", used for tagging variables as fixed. Don't
                         use this tag unless you want issues.
+    _lineartag      --  "__linear", used for tagging variables as projected.
+                        Don't use this tag unless you want issues.
+    _freevars       --  Cached list of the free variables, in the order of
+                        '_parameters', or None if it must be rebuilt. See
+                        '_prepareFree'. Projected variables are not included.
+    _freepars       --  The Parameters the free variables are bound to.
+                        Values are applied directly to these.
+    _freeidx        --  Array of the indices of the free variables within
+                        '_parameters'.
+    _linearvars     --  List of the free variables that are projected, i.e.
+                        solved by linear least squares in 'residual'.
+    _linearpars     --  The Parameters the projected variables are bound to.
+    _linearcons     --  Indices of the FitContributions that depend on the
+                        projected variables, or None if these must be found
+                        again. See '_prepareProjection'.
+    _chivlayout     --  List of (FitContribution, sqrt(weight), start, stop)
+                        tuples, giving the slice of the residual vector that
+                        holds the weighted residual of each FitContribution.
+                        This is computed in '_prepare'.
+    _chivsize       --  The total size of the FitContribution residuals. The
+                        restraint penalties follow these in the residual
+                        vector.
+    _dependencies   --  Dictionary of the indices of the FitContributions and
+                        Restraints that depend on a Parameter, indexed by
+                        Parameter. This is filled as needed and cleared in
+                        '_prepare'. See '_getDependencies'.
+    _derivatives    --  Dictionary of the derivative trees of equations with
+                        respect to Parameters, indexed by the ids of the
+                        equation and the Parameter. This is filled as needed
+                        and cleared with '_dependencies'. See
+                        '_getDerivative'.
 
     Properties
     names           --  Variable names (read only). See getNames.
@@ -103,8 +157,21 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         self.pushFitHook(PrintFitHook())
         self._restraintlist = []
         self._oconstraints = []
+        self._constraintlevels = []
+        self._constraintupdates = []
         self._ready = False
         self._fixedtag = "__fixed"
+        self._lineartag = "__linear"
+        self._freevars = None
+        self._freepars = None
+        self._freeidx = None
+        self._linearvars = []
+        self._linearpars = []
+        self._linearcons = None
+        self._chivlayout = []
+        self._chivsize = 0
+        self._dependencies = {}
+        self._derivatives = {}
 
         self._weights = []
         self._tagmanager = TagManager()
@@ -173,12 +240,14 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         """
         self._addObject(con, self._contributions, True)
         self._weights.append(weight)
+        self._updateConfiguration()
         return
 
     def setWeight(self, con, weight):
         """Set the weight of a FitContribution."""
         idx = self._contributions.values().index(con)
         self._weights[idx] = weight
+        self._updateConfiguration()
         return
 
     def addParameterSet(self, parset):
@@ -201,6 +270,50 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         self._removeObject(parset, self._parsets)
         return
 
+    def dispose(self):
+        """Detach the FitRecipe from the objects it refers to.
+
+        This removes the constraints, restraints, variables, Calculators,
+        FitContributions and ParameterSets of the FitRecipe. Objects that are
+        shared with other recipes, such as a phase, no longer refer to the
+        FitRecipe, and the Parameters it constrained are no longer marked as
+        constrained. The FitRecipe is empty afterwards.
+
+        The observers of Parameters and other objects are held by weak
+        references, so a FitRecipe that is no longer used is freed without
+        this. Dispose of a FitRecipe to release the objects it shares at once.
+        """
+        self.clearConstraints()
+        self.clearRestraints()
+        for var in self._parameters.values():
+            self.delVar(var)
+        for calc in self._calculators.values():
+            self._removeObject(calc, self._calculators)
+            self._eqfactory.deRegisterBuilder(calc.name)
+        for con in self._contributions.values():
+            self._removeObject(con, self._contributions)
+        for parset in self._parsets.values():
+            self._removeObject(parset, self._parsets)
+        del self._weights[:]
+
+        # Forget the state of the last preparation
+        self._restraintlist = []
+        self._oconstraints = []
+        self._constraintlevels = []
+        self._constraintupdates = []
+        self._freevars = None
+        self._freepars = None
+        self._freeidx = None
+        self._linearvars = []
+        self._linearpars = []
+        self._linearcons = None
+        self._chivlayout = []
+        self._chivsize = 0
+        self._dependencies = {}
+        self._derivatives = {}
+        self._updateConfiguration()
+        return
+
     def residual(self, p = []):
         """Calculate the vector residual to be optimized.
 
@@ -226,28 +339,515 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         # Update the variable parameters.
         self._applyValues(p)
 
-        # Update the constraints. These are ordered such that the list only
-        # needs to be cycled once.
-        for con in self._oconstraints:
-            con.update()
-
-        # Calculate the bare chiv
-        chiv = concatenate([
-            sqrt(self._weights[i])*\
-                    self._contributions.values()[i].residual().flatten() \
-                    for i in range(len(self._contributions))])
+        # Update the constraints.
+        self._updateConstraints()
 
-        # Calculate the point-average chi^2
-        w = dot(chiv, chiv)/len(chiv)
-        # Now we must append the restraints
-        penalties = [ sqrt(res.penalty(w)) for res in self._restraintlist ]
-        chiv = concatenate( [ chiv, penalties ] )
+        chiv = self.__calculateChiv()
 
         for fithook in self.fithooks:
             fithook.postcall(self, chiv)
 
         return chiv
 
+    def __calculateChiv(self):
+        """Calculate the residual vector from the current parameter values.
+
+        Each weighted FitContribution residual is written into its slice of a
+        single output array, as laid out by '_prepareLayout'. The restraint
+        penalties fill the tail of the array.
+        """
+        n = self._chivsize
+        chiv = empty(n + len(self._restraintlist))
+
+        # Calculate the bare chiv
+        for con, sw, start, stop in self._chivlayout:
+            res = con.residual()
+            if res.size != stop - start:
+                # The size of a FitContribution changed since the layout was
+                # computed. Lay out the vector again.
+                self._prepareLayout()
+                return self.__calculateChiv()
+            multiply(res.ravel(), sw, chiv[start:stop])
+
+        # Calculate the point-average chi^2
+        bare = chiv[:n]
+        w = dot(bare, bare)/n
+        # Now we must fill in the restraints
+        for i, res in enumerate(self._restraintlist):
+            chiv[n + i] = sqrt(res.penalty(w))
+
+        return chiv
+
+    def blockJacobian(self, p = [], step = 1e-8, sparse = True):
+        """Calculate the Jacobian of the residual by finite differences.
+
+        This uses the central difference formula. Only the FitContributions
+        and Restraints that depend on a variable are evaluated when the
+        variable is varied. In recipes where most variables affect a single
+        FitContribution this saves most of the work of the calculation.
+
+        p       --  The list of variable values at which to calculate the
+                    Jacobian, in the same order as the free variables. If p
+                    is an empty iterable (default), the current values are
+                    used.
+        step    --  The step size as a fraction of the variable value
+                    (default 1e-8). Variables whose value is 0 use step
+                    itself.
+        sparse  --  Return a scipy.sparse.csc_matrix (default True) rather
+                    than a dense array.
+
+        Returns the Jacobian with shape (len(chiv), len(p)), where chiv is
+        the output of the residual method. The variables are left at the
+        values in p.
+        """
+        self._prepare()
+        self._applyValues(p)
+        pvals = self.getValues()
+        delta = _relativeSteps(pvals, step)
+        m = self._chivsize + len(self._restraintlist)
+        shape = (m, len(pvals))
+
+        data = []
+        rows = []
+        cols = []
+        for k in range(len(pvals)):
+            blocks, dcon = self._differentiate(k, delta[k])
+            for start, deriv in blocks:
+                data.append(deriv)
+                rows.append(arange(start, start + len(deriv)))
+                cols.append(k + zeros(len(deriv), dtype=int))
+
+        # Reset the constrained parameters
+        self._updateConstraints()
+
+        if data:
+            data = concatenate(data)
+            rows = concatenate(rows)
+            cols = concatenate(cols)
+
+        if sparse:
+            from scipy.sparse import csc_matrix
+            if not len(data):
+                return csc_matrix(shape)
+            return csc_matrix((data, (rows, cols)), shape = shape)
+
+        jac = zeros(shape)
+        if len(data):
+            jac[rows, cols] = data
+        return jac
+
+    def jacobian(self, p = [], step = 1e-6, steprule = "relative",
+            analytic = True):
+        """Calculate the Jacobian of the residual.
+
+        The columns of the Jacobian are found from the derivatives of the
+        equations where these are available, and by the central difference
+        formula otherwise. Derivatives of the constrained Parameters are
+        propagated through the constraints by the chain rule. ProfileGenerators
+        and Calculators are differentiated with their 'gradient' method, and
+        registered functions with the derivative rules of
+        diffpy.srfit.equation.visitors.differentiator or with dual numbers.
+        Projected variables are not differentiated analytically, so if any
+        variable is projected, all columns are found by finite differences.
+
+        p       --  The list of variable values at which to calculate the
+                    Jacobian, in the same order as the free variables. If p
+                    is an empty iterable (default), the current values are
+                    used.
+        step    --  The step size of the finite differences, either a number
+                    or a sequence with a number for each free variable
+                    (default 1e-6).
+        steprule    --  How the step size is found from the value v of a
+                    variable. "relative" (default) uses step*|v|, or step if
+                    v is 0. "absolute" uses step. This can also be a function
+                    steprule(v, step) that returns the step size.
+        analytic    --  Use the derivatives of the equations where they are
+                    available (default True). If this is False, all columns
+                    are found by finite differences.
+
+        Returns the Jacobian as an array with shape (len(chiv), len(p)), where
+        chiv is the output of the residual method. This can be used as the
+        'Dfun' of scipy.optimize.leastsq or the 'jac' of
+        scipy.optimize.least_squares. The variables are left at the values in
+        p.
+
+        Raises ValueError if steprule is not known.
+        """
+        rule = steprule
+        if not callable(rule):
+            rule = _steprules.get(steprule)
+            if rule is None:
+                raise ValueError("Unknown step rule '%s'" % steprule)
+
+        self._prepare()
+        self._applyValues(p)
+        self._updateConstraints()
+        pvals = self.getValues()
+        steps = step + zeros(len(pvals))
+
+        chiv = None
+        if analytic and not self._linearpars:
+            chiv = self.__calculateChiv()
+        jac = zeros((self._chivsize + len(self._restraintlist), len(pvals)))
+
+        perturbed = False
+        for k in range(len(pvals)):
+            if chiv is not None:
+                col = self._analyticColumn(k, chiv)
+                if col is not None:
+                    jac[:,k] = col
+                    continue
+            h = rule(pvals[k], steps[k])
+            blocks, dcon = self._differentiate(k, h)
+            for start, deriv in blocks:
+                jac[start:start + len(deriv), k] = deriv
+            perturbed = True
+
+        # Reset the constrained parameters
+        if perturbed:
+            self._updateConstraints()
+
+        return jac
+
+    def _differentiate(self, k, h):
+        """Differentiate the residual with respect to a free variable.
+
+        This uses the central difference formula
+        df/dv = ( f(v+h)-f(v-h) ) / ( 2h ),
+        at the current variable values, and only evaluates the parts of the
+        residual that depend on the variable.
+
+        k   --  The index of the free variable.
+        h   --  The step size.
+
+        Returns a list of (start, deriv) pairs, where deriv is the derivative
+        of the slice of the residual that begins at start, and the list of
+        derivatives of the constrained parameters in '_oconstraints'. The
+        latter are 0 for non-scalar parameters. The variable is restored to
+        its value, but the constrained parameters are left at perturbed
+        values.
+        """
+        self._prepareFree()
+        par = self._freepars[k]
+        conidx, residx = self._getDependencies(par)
+        v = par.getValue()
+
+        par.setValue(v + h)
+        plus, cplus = self.__evaluateParts(conidx, residx)
+        par.setValue(v - h)
+        minus, cminus = self.__evaluateParts(conidx, residx)
+        par.setValue(v)
+
+        blocks = [(start, (a - b)/(2*h))
+                for (start, a), (start, b) in izip(plus, minus)]
+
+        # FIXME - constraints are used for vectors as well!
+        dcon = []
+        for a, b in izip(cplus, cminus):
+            if isscalar(b):
+                dcon.append((a - b)/(2*h))
+            else:
+                dcon.append(0.0)
+
+        return blocks, dcon
+
+    def _analyticColumn(self, k, chiv):
+        """Differentiate the residual analytically.
+
+        The derivatives of the Parameters constrained in '_oconstraints' are
+        found first, in order. The derivative of each equation is then the
+        sum of its derivatives with respect to the variable and the
+        constrained Parameters, multiplied by the derivatives of those. See
+        '_getDerivative'.
+
+        k       --  The index of the free variable.
+        chiv    --  The residual at the current variable values.
+
+        Returns the derivative of the residual, or None if it cannot be found
+        analytically.
+        """
+        self._prepareFree()
+        par = self._freepars[k]
+        conidx, residx = self._getDependencies(par)
+
+        def chain(eq):
+            d = None
+            for p, dp in dpars:
+                deriv = self._getDerivative(eq, p)
+                if deriv is not None:
+                    term = multiply(deriv.getValue(), dp)
+                    d = term if d is None else d + term
+            return d
+
+        n = self._chivsize
+        col = zeros(n + len(self._restraintlist))
+        try:
+            # The Parameters that depend on the variable, with their
+            # derivatives.
+            dpars = [(par, 1.0)]
+            for con in self._oconstraints:
+                d = chain(con.eq)
+                if d is None:
+                    continue
+                # FIXME - the derivatives of vector constraints are directional
+                # derivatives, which cannot be combined this way.
+                if not isscalar(d):
+                    return None
+                dpars.append((_targetParameter(con.par), d))
+
+            for i in conidx:
+                con, sw, start, stop = self._chivlayout[i]
+                d = chain(con._reseq)
+                if d is not None:
+                    col[start:stop] = ravel(multiply(d, sw))
+
+            # The restraint penalties are sqrt(P), where
+            # P = (max(0, lb - val, val - ub)/sig)**2 * w
+            # and w is the point-average chi^2 if the restraint is scaled.
+            bare = chiv[:n]
+            w = dot(bare, bare)/n
+            dw = 2 * dot(bare, col[:n])/n
+            for j in residx:
+                res = self._restraintlist[j]
+                val = res.eq()
+                dval = chain(res.eq) or 0.0
+                excess = max(0, res.lb - val, val - res.ub)
+                if excess == 0:
+                    continue
+                if excess == val - res.ub:
+                    d = dval / res.sig
+                else:
+                    d = -dval / res.sig
+                if res.scaled:
+                    if w == 0:
+                        return None
+                    sw = sqrt(w)
+                    d = d * sw + excess / res.sig * dw / (2 * sw)
+                col[n + j] = d
+
+        except ValueError:
+            return None
+
+        return col
+
+    def _getDerivative(self, eq, par):
+        """Get the derivative tree of an equation with respect to a Parameter.
+
+        The derivative trees are built with the Differentiator visitor and
+        cached in '_derivatives'. They share nodes with the equations, so
+        they are recalculated as needed when the values change.
+
+        eq      --  The equation.
+        par     --  A Parameter (not a ParameterProxy) of the recipe.
+
+        Returns the root of the derivative tree, or None if the derivative is
+        zero.
+
+        Raises ValueError if the equation cannot be differentiated.
+        """
+        key = (id(eq), id(par))
+        deriv = self._derivatives.get(key, False)
+        if deriv is False:
+            # Failures are cached as well
+            try:
+                differentiator = Differentiator(par, _parameterRule(par))
+                deriv = eq.identify(differentiator)
+            except ValueError, e:
+                deriv = e
+            self._derivatives[key] = deriv
+        if isinstance(deriv, ValueError):
+            raise deriv
+        return deriv
+
+    def __evaluateParts(self, conidx, residx):
+        """Evaluate parts of the residual.
+
+        conidx  --  Indices of the FitContributions to evaluate.
+        residx  --  Indices of the Restraints to evaluate.
+
+        Returns a list of (start, values) pairs for the residual and the list
+        of values of the constrained parameters.
+        """
+        self._updateConstraints()
+
+        parts = []
+        for i in conidx:
+            con, sw, start, stop = self._chivlayout[i]
+            parts.append( (start, multiply(con.residual().ravel(), sw)) )
+
+        if residx:
+            # The restraint penalties may be scaled by the residual.
+            chiv = self.__calculateChiv()
+            n = self._chivsize
+            for j in residx:
+                parts.append( (n + j, chiv[n+j:n+j+1]) )
+
+        cvals = [con.par.getValue() for con in self._oconstraints]
+        return parts, cvals
+
+    def _updateConstraints(self):
+        """Update the constrained and projected Parameters.
+
+        The constraints are ordered such that the list only needs to be cycled
+        once. The projected Parameters are solved for afterwards, since they
+        depend on the other variables as well.
+        """
+        for obj in self._constraintupdates:
+            obj.update()
+        self._prepareFree()
+        if self._linearpars:
+            self._project()
+        return
+
+    def _project(self):
+        """Solve for the projected Parameters.
+
+        The residual of the FitContributions is an affine function of the
+        projected Parameters, r = A l + b. The columns of A and b are found by
+        evaluating the FitContributions with the projected Parameters set to 0
+        and 1, and l is then found by linear least squares. Restraints are not
+        considered.
+        """
+        if self._linearcons is None:
+            self._prepareProjection()
+
+        layout = [self._chivlayout[i] for i in self._linearcons]
+        def evaluate():
+            return concatenate([multiply(con.residual().ravel(), sw)
+                for con, sw, start, stop in layout])
+
+        pars = self._linearpars
+        for par in pars:
+            par.setValue(0.0)
+        b = evaluate()
+        A = empty((len(b), len(pars)))
+        for j, par in enumerate(pars):
+            par.setValue(1.0)
+            A[:,j] = evaluate() - b
+            par.setValue(0.0)
+
+        l = lstsq(A, -b, rcond = -1)[0]
+        for par, val in izip(pars, l.tolist()):
+            par.setValue(val)
+        return
+
+    def _prepareProjection(self):
+        """Check the projected Parameters and find what depends on them.
+
+        The residual of each FitContribution must be an affine function of the
+        projected Parameters, and nothing else may use them.
+
+        Raises SrFitError if a projected variable cannot be projected.
+        """
+        pars = self._linearpars
+        contributions = self._contributions.values()
+        self._linearcons = []
+        nodes = set()
+        for i, con in enumerate(contributions):
+            checker = LinearityChecker(pars)
+            degree = con._reseq.identify(checker)
+            if degree is None:
+                m = "The residual of '%s' is not linear in %s" % (con.name,
+                        ", ".join(v.name for v in self._linearvars))
+                raise SrFitError(m)
+            if degree == 1:
+                self._linearcons.append(i)
+            nodes |= checker.nodes
+
+        # Literals outside of the FitContribution equations, such as
+        # generators, constraint and restraint equations, must not use the
+        # projected Parameters.
+        for var, par in izip(self._linearvars, pars):
+            for callback in par._observers or ():
+                target = getattr(callback, "im_self", None)
+                if target is None or isinstance(target,
+                        (Literal, Constraint, ConstraintBlock, Restraint)):
+                    if id(target) in nodes and any(_targetParameter(arg) is
+                            par for arg in target.args):
+                        continue
+                    m = "'%s' is used outside of the residual equations" % \
+                            var.name
+                    raise SrFitError(m)
+
+        # Projected Parameters affect the dependencies
+        self._dependencies = {}
+        return
+
+    def _getDependencies(self, par):
+        """Get the parts of the residual that depend on a Parameter.
+
+        The dependencies are found by following the observers of par, and
+        continuing through the constraints that use par. This finds every
+        FitContribution whose equations or managed objects observe par. A
+        scaled Restraint depends on every Parameter that affects a
+        FitContribution.
+
+        par     --  A Parameter (not a ParameterProxy) of the recipe.
+
+        Returns a list of FitContribution indices and a list of Restraint
+        indices.
+        """
+        deps = self._dependencies.get(par)
+        if deps is not None:
+            return deps
+
+        # The nodes at which the search stops or continues through a
+        # constraint.
+        contributions = self._contributions.values()
+        nodes = {}
+        for i, con in enumerate(contributions):
+            for obj in (con, con._eq, con._reseq):
+                nodes[id(obj)] = ("c", i)
+        for con in self._oconstraints:
+            nodes[id(con)] = ("p", con.par)
+            nodes[id(con.eq)] = ("p", con.par)
+        for j, res in enumerate(self._restraintlist):
+            nodes[id(res.eq)] = ("r", j)
+
+        conset = set()
+        resset = set()
+        seen = set()
+        stack = [par]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+
+            kind, val = nodes.get(id(obj), (None, None))
+            if kind == "c":
+                conset.add(val)
+            elif kind == "r":
+                resset.add(val)
+            elif kind == "p":
+                stack.append(val)
+
+            for callback in getattr(obj, "_observers", None) or ():
+                target = getattr(callback, "im_self", None)
+                if target is None:
+                    # We cannot tell what this affects, so assume the worst.
+                    conset.update(range(len(contributions)))
+                    resset.update(range(len(self._restraintlist)))
+                    continue
+                stack.append(target)
+
+        # The projected Parameters change when a FitContribution that depends
+        # on them changes.
+        self._prepareFree()
+        if self._linearpars and conset:
+            if self._linearcons is None:
+                self._prepareProjection()
+            if conset.intersection(self._linearcons):
+                conset.update(self._linearcons)
+
+        if conset:
+            resset.update(j for j, res in enumerate(self._restraintlist)
+                    if res.scaled)
+
+        deps = (sorted(conset), sorted(resset))
+        self._dependencies[par] = deps
+        return deps
+
     def scalarResidual(self, p = []):
         """Calculate the scalar residual to be optimized.
 
@@ -270,6 +870,56 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         """Same as scalarResidual method."""
         return self.scalarResidual(p)
 
+    def evaluatePopulation(self, P, pool = None, output = "chi2"):
+        """Calculate the residual for many variable vectors.
+
+        This is meant for global optimizers that evaluate a population of
+        variable vectors per generation. The fit hooks are not called.
+
+        P       --  The variable vectors, with one row per vector and one
+                    column per free variable, in the same order as for the
+                    residual method.
+        pool    --  A RecipePool of worker processes for this recipe (default
+                    None). If this is None, the vectors are evaluated in this
+                    process. See diffpy.srfit.fitbase.recipepool.
+        output  --  "chi2" (default) to get the scalar residual of each vector,
+                    or "chiv" to get the vector residual.
+
+        Returns an array with the results for the rows of P along the first
+        axis. The variables keep their values.
+
+        Raises ValueError if pool is for another recipe, output is not known
+        or P does not have a column for each free variable.
+        Raises SrFitError if the pool is closed or the free variables have
+        changed since the pool was started.
+        """
+        if pool is not None:
+            if pool.recipe is not self:
+                raise ValueError("The pool evaluates another recipe")
+            return pool.map(P, output)
+
+        self._prepare()
+        saved = self.getValues()
+        P = _checkPopulation(P, len(saved), output)
+        try:
+            results = [_evaluate(self, p, output) for p in P]
+        finally:
+            self._applyValues(saved)
+            self._updateConstraints()
+        return array(results)
+
+    def _chiv(self, p):
+        """Calculate the vector residual without calling the fit hooks.
+
+        p   --  The list of variable values. See the residual method.
+
+        Returns the residual.
+        """
+        self._prepare()
+        self._applyValues(p)
+        self._updateConstraints()
+        return self.__calculateChiv()
+
     def _prepare(self):
         """Prepare for the residual calculation, if necessary.
 
@@ -302,16 +952,45 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         # We do this here so that the calculations that take place during the
         # validation use the most current values of the parameters. In most
         # cases, this will save us from recalculating them later.
-        for con in self._oconstraints:
-            con.update()
+        for obj in self._constraintupdates:
+            obj.update()
+
+        # Build the free-variable plan. This also folds the equations, which
+        # depends on the constraints.
+        self._freevars = None
+        self._prepareFree()
 
         # Validate!
         self._validate()
 
+        # Lay out the residual vector
+        self._prepareLayout()
+
+        # The dependencies and projected variables are found again when
+        # needed
+        self._dependencies = {}
+        self._derivatives = {}
+        self._linearcons = None
+
         self._ready = True
 
         return
 
+    def _prepareLayout(self):
+        """Compute the position of each FitContribution in the residual.
+
+        This evaluates the residual of each FitContribution to get its size.
+        """
+        conlist = self._contributions.values()
+        self._chivlayout = []
+        start = 0
+        for con, weight in zip(conlist, self._weights):
+            stop = start + con.residual().size
+            self._chivlayout.append( (con, sqrt(weight), start, stop) )
+            start = stop
+        self._chivsize = start
+        return
+
     def __verifyProfiles(self):
         """Verify that each FitContribution has a Profile."""
         # Check for profile values
@@ -369,51 +1048,24 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
             cdict.update( org._getConstraints() )
         cdict.update(self._constraints)
 
-        # The order of the restraint list does not matter
-        self._restraintlist = list(rset)
-
-        # Reorder the constraints. Constraints are ordered such that a given
-        # constraint is placed before its dependencies.
-        self._oconstraints = cdict.values()
-
-        # Create a depth-1 map of the constraint dependencies
-        depmap = {}
-        for con in self._oconstraints:
-            depmap[con] = set()
-            # Now check the constraint's equation for constrained arguments
-            for arg in con.eq.args:
-                if arg in cdict:
-                    depmap[con].add( cdict[arg] )
-
-        # Turn the dependency map into multi-level map.
-        def _extendDeps(con):
-            deps = set(depmap[con])
-            for dep in depmap[con]:
-                deps.update(_extendDeps(dep))
-
-            return deps
-
-        for con in depmap:
-            depmap[con] = _extendDeps(con)
-
-        # Now sort the constraints based on the dependency map.
-        def cmp(x, y):
-            # x == y if neither of them have dependencies
-            if not depmap[x] and not depmap[y]:
-                return 0
-            # x > y if y is a dependency of x
-            # x > y if y has no dependencies
-            if y in depmap[x] or not depmap[y]:
-                return 1
-            # x < y if x is a dependency of y
-            # x < y if x has no dependencies
-            if x in depmap[y] or not depmap[x]:
-                return -1
-            # If there are dependencies, but there is no relationship, the
-            # constraints are equivalent
-            return 0
-
-        self._oconstraints.sort(cmp)
+        # Keep the restraints in the order they were created, so that the
+        # rows of the residual do not depend on the order of the sets.
+        self._restraintlist = sorted(rset,
+                key = lambda res: getattr(res, "_serial", 0))
+
+        # Order the constraints such that a given constraint is placed after
+        # the constraints it depends on.
+        self._constraintlevels = _orderConstraints(cdict)
+        self._oconstraints = [con for level in self._constraintlevels
+                for con in level]
+
+        # Group the affine constraints of each level
+        for obj in self._constraintupdates:
+            if isinstance(obj, ConstraintBlock):
+                obj.release()
+        self._constraintupdates = []
+        for level in self._constraintlevels:
+            self._constraintupdates.extend(_blockConstraints(level))
 
         return
 
@@ -455,6 +1107,7 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
             var.setValue(value)
 
         self._addParameter(var)
+        self._freevars = None
 
         if fixed:
             self.fix(var)
@@ -480,6 +1133,7 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
 
         self._removeParameter(var)
         self._tagmanager.untag(var)
+        self._freevars = None
         return
 
     def __delattr__(self, name):
@@ -537,6 +1191,7 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         # tag this
         self._tagmanager.tag(par, par.name)
         self._tagmanager.tag(par, "all")
+        self._freevars = None
         self.fix(par.name)
         return par
 
@@ -552,7 +1207,7 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         if isinstance(var, basestring):
             var = self._parameters.get(var)
 
-        if var not in self._parameters.values():
+        if not self.__isVar(var):
             raise ValueError("Passed variable is not part of the FitRecipe")
 
         return var
@@ -569,26 +1224,25 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         a tag is passed in a keyword.
         """
         # Process args. Each variable is tagged with its name, so this is easy.
+        # The checks are done per argument, so they do not depend on the
+        # number of variables.
         strargs = set([arg for arg in args if isinstance(arg, basestring)])
         varargs = set(args) - strargs
         # Check that the tags are valid
-        alltags = set(self._tagmanager.alltags())
-        badtags = strargs - alltags
+        tagdict = self._tagmanager._tagdict
+        badtags = [tag for tag in strargs if tag not in tagdict]
         if badtags:
             names = ",".join(badtags)
             raise ValueError("Variables or tags cannot be found (%s)"% names)
 
         # Check that variables are valid
-        allvars = set(self._parameters.values())
-        badvars = varargs - allvars
+        badvars = [v for v in varargs if not self.__isVar(v)]
         if badvars:
             names = ",".join(v.name for v in badvars)
             raise ValueError("Variables cannot be found (%s)"% names)
 
         # Make sure that we only have parameters in kw
-        kwnames = set(kw.keys())
-        allnames = set(self._parameters.keys())
-        badkw = kwnames - allnames
+        badkw = [name for name in kw if name not in self._parameters]
         if badkw:
             names = ",".join(badkw)
             raise ValueError("Tags cannot be passed as keywords (%s)"% names)
@@ -598,6 +1252,11 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         varargs |= self._tagmanager.union(*kw.keys())
         return varargs
 
+    def __isVar(self, var):
+        """Check if an object is a variable of the FitRecipe."""
+        name = getattr(var, "name", None)
+        return name is not None and self._parameters.get(name) is var
+
     def fix(self, *args, **kw):
         """Fix a parameter by reference, name or tag.
 
@@ -614,9 +1273,12 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         varargs = self.__getVarsFromArgs(*args, **kw)
 
 
-        # Fix all of these
+        # Fix all of these. The plan of free variables is only discarded if
+        # one of them was free.
         for var in varargs:
-            self._tagmanager.tag(var, self._fixedtag)
+            if self.isFree(var):
+                self._tagmanager.tag(var, self._fixedtag)
+                self._freevars = None
 
         # Set the kw values
         for name, val in kw.items():
@@ -640,10 +1302,12 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         # Check the inputs and get the variables from them
         varargs = self.__getVarsFromArgs(*args, **kw)
 
-        # Free all of these
+        # Free all of these. The plan of free variables is only discarded if
+        # one of them was fixed.
         for var in varargs:
-            if not var.constrained:
+            if not (var.constrained or self.isFree(var)):
                 self._tagmanager.untag(var, self._fixedtag)
+                self._freevars = None
 
         # Set the kw values
         for name, val in kw.items():
@@ -655,6 +1319,102 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         """Check if a variable is fixed."""
         return (not self._tagmanager.hasTags(var, self._fixedtag))
 
+    def project(self, *args, **kw):
+        """Project a variable by reference, name or tag.
+
+        A projected variable is not refined. Instead, it is solved for by
+        linear least squares whenever the residual is calculated, so the
+        optimizer works on the remaining variables only. This is possible for
+        variables that enter the residual equations of the FitContributions
+        linearly, such as scale factors and background coefficients, and that
+        are not used by constraints, restraints or ProfileGenerators. Bounds
+        on projected variables are ignored. Fixed variables are not projected.
+
+        This method accepts string or variable arguments. An argument of "all"
+        selects all variables. If no arguments are passed, all free variables
+        that can be projected are selected. Keyword arguments must be
+        parameter names, followed by a value to assign to the variable.
+
+        Raises ValueError if an unknown Parameter, name or tag is passed, or if
+        a tag is passed in a keyword. Raises SrFitError during the
+        calculation if a projected variable does not enter the residual
+        linearly.
+        """
+        if not args and not kw:
+            varargs = self.__findLinear()
+        else:
+            varargs = self.__getVarsFromArgs(*args, **kw)
+
+        for var in varargs:
+            self._tagmanager.tag(var, self._lineartag)
+        self._freevars = None
+
+        # Set the kw values
+        for name, val in kw.items():
+            self.get(name).value = val
+
+        return
+
+    def unproject(self, *args, **kw):
+        """Stop projecting a variable by reference, name or tag.
+
+        The variable is refined again if it is free. This method accepts the
+        same arguments as 'project'. If no arguments are passed, all variables
+        are selected.
+
+        Raises ValueError if an unknown Parameter, name or tag is passed, or if
+        a tag is passed in a keyword.
+        """
+        if not args and not kw:
+            args = ("all",)
+        varargs = self.__getVarsFromArgs(*args, **kw)
+
+        for var in varargs:
+            self._tagmanager.untag(var, self._lineartag)
+        self._freevars = None
+
+        # Set the kw values
+        for name, val in kw.items():
+            self.get(name).value = val
+
+        return
+
+    def isProjected(self, var):
+        """Check if a variable is projected."""
+        return self._tagmanager.hasTags(var, self._lineartag)
+
+    def __findLinear(self):
+        """Find the free variables that can be projected.
+
+        Variables are added one at a time, and kept if the residual is still
+        linear in all of the selected variables.
+
+        Returns a list of variables.
+        """
+        self._prepare()
+        contributions = self._contributions.values()
+        found = []
+        for var in self._parameters.values():
+            if not self.isFree(var) or self.isProjected(var):
+                continue
+            par = _targetParameter(var)
+            if not any(getDegree(con._reseq, [par]) == 1
+                    for con in contributions):
+                continue
+            self._tagmanager.tag(var, self._lineartag)
+            self._freevars = None
+            self._prepareFree()
+            try:
+                self._prepareProjection()
+                found.append(var)
+            except SrFitError:
+                self._tagmanager.untag(var, self._lineartag)
+
+        for var in found:
+            self._tagmanager.untag(var, self._lineartag)
+        self._freevars = None
+        return found
+
     def unconstrain(self, *pars):
         """Unconstrain a Parameter.
 
@@ -680,8 +1440,9 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
                 del self._constraints[par]
                 update = True
 
-            if par in self._parameters.values():
+            if self.__isVar(par):
                 self._tagmanager.untag(par, self._fixedtag)
+                self._freevars = None
 
         if update:
             # Our configuration changed
@@ -729,13 +1490,13 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
 
         # This will pass the value of a constrained parameter to the initial
         # value of a parameter constraint.
-        if con in self._parameters.values():
+        if self.__isVar(con):
             val = con.getValue()
             if val is None:
                 val = par.getValue()
                 con.setValue(val)
 
-        if par in self._parameters.values():
+        if self.__isVar(par):
             self.fix(par)
 
         RecipeOrganizer.constrain(self, par, con, ns)
@@ -744,12 +1505,13 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
 
     def getValues(self):
         """Get the current values of the variables in a list."""
-        return array([v.value for v in self._parameters.values() if
-            self.isFree(v)])
+        self._prepareFree()
+        return array([par.getValue() for par in self._freepars])
 
     def getNames(self):
         """Get the names of the variables in a list."""
-        return [v.name for v in self._parameters.values() if self.isFree(v)]
+        self._prepareFree()
+        return [v.name for v in self._freevars]
 
     def getBounds(self):
         """Get the bounds on variables in a list.
@@ -757,7 +1519,8 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         Returns a list of (lb, ub) pairs, where lb is the lower bound and ub is
         the upper bound.
         """
-        return [v.bounds for v in self._parameters.values() if self.isFree(v)]
+        self._prepareFree()
+        return [par.bounds for par in self._freepars]
 
     def getBounds2(self):
         """Get the bounds on variables in two lists.
@@ -787,11 +1550,58 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         return
 
     def _applyValues(self, p):
-        """Apply variable values to the variables."""
+        """Apply variable values to the variables.
+
+        The notifications of the variables are coalesced, see batchUpdate.
+        """
         if len(p) == 0: return
-        vargen = (v for v in self._parameters.values() if self.isFree(v))
-        for var, pval in zip(vargen, p):
-            var.setValue(pval)
+        self._prepareFree()
+        with self.batchUpdate():
+            for par, pval in izip(self._freepars, p):
+                par.setValue(pval)
+        return
+
+    def _prepareFree(self):
+        """Build the cached plan of free variables, if necessary.
+
+        The plan holds the free variables in order, the Parameters they are
+        bound to (with ParameterProxy indirection removed) and the indices of
+        the free variables within '_parameters'. It is discarded whenever a
+        variable is added, removed, fixed or freed. Building the plan folds
+        the equations of the FitContributions (see '_fold').
+        """
+        if self._freevars is not None:
+            return
+        allvars = self._parameters.values()
+        idx = [i for i, v in enumerate(allvars)
+                if self.isFree(v) and not self.isProjected(v)]
+        self._freevars = [allvars[i] for i in idx]
+        self._freepars = [_targetParameter(v) for v in self._freevars]
+        self._freeidx = array(idx, dtype=int)
+        self._linearvars = [v for v in allvars
+                if self.isFree(v) and self.isProjected(v)]
+        self._linearpars = [_targetParameter(v) for v in self._linearvars]
+        self._linearcons = None
+        self._dependencies = {}
+        self._derivatives = {}
+        self._fold()
+        return
+
+    def _fold(self):
+        """Fold the equations of the FitContributions.
+
+        The profile and residual equations are compiled, and the parts of
+        them that depend on neither a free variable, a projected variable nor
+        a constrained Parameter are cached during the refinement. See
+        Equation.setCompiled and Equation.fold.
+        """
+        variables = self._freepars + self._linearpars
+        variables += [_targetParameter(con.par) for con in self._oconstraints]
+        for con in self._contributions.values():
+            for eq in (con._eq, con._reseq):
+                if eq is not None:
+                    eq.setCompiled()
+                    eq.fold(variables)
         return
 
     def _updateConfiguration(self):
@@ -799,4 +1609,197 @@ class FitRecipe(_fitrecipe_interface, RecipeOrganizer):
         self._ready = False
         return
 
+def _orderConstraints(cdict):
+    """Order constraints by their dependencies.
+
+    This performs a topological sort of the constraints (Kahn's algorithm). A
+    constraint depends on another if its equation uses the Parameter
+    constrained by the other.
+
+    cdict   --  Dictionary of Constraints, indexed by constrained Parameter
+                or ParameterProxy.
+
+    Returns a list of levels, each a list of Constraints. The first level
+    holds the Constraints that depend on no other Constraint. Each following
+    level holds the Constraints whose dependencies are all in previous
+    levels.
+
+    Raises SrFitError if the constraints depend on each other in a cycle.
+    """
+    # Constraints and their arguments are matched by the Parameters that hold
+    # their values, since either may be a ParameterProxy.
+    targets = dict((_targetParameter(par), con)
+            for par, con in cdict.iteritems())
+
+    # Map each constraint to the constraints that depend on it, and count the
+    # dependencies of each constraint.
+    dependents = dict((con, []) for con in cdict.itervalues())
+    ndeps = dict.fromkeys(dependents, 0)
+    for con in dependents:
+        deps = set()
+        for arg in con.eq.args:
+            dep = targets.get(_targetParameter(arg))
+            if dep is not None and dep not in deps:
+                deps.add(dep)
+                dependents[dep].append(con)
+        ndeps[con] = len(deps)
+
+    levels = []
+    level = [con for con, n in ndeps.iteritems() if n == 0]
+    nordered = 0
+    while level:
+        levels.append(level)
+        nordered += len(level)
+        nextlevel = []
+        for con in level:
+            for dep in dependents[con]:
+                ndeps[dep] -= 1
+                if ndeps[dep] == 0:
+                    nextlevel.append(dep)
+        level = nextlevel
+
+    if nordered != len(ndeps):
+        names = sorted(con.par.name for con, n in ndeps.iteritems() if n > 0)
+        m = "Constraints on %s depend on each other in a cycle" % \
+                ", ".join(map(str, names))
+        raise SrFitError(m)
+
+    return levels
+
+def _blockConstraints(constraints):
+    """Group affine constraints into a ConstraintBlock.
+
+    constraints --  A list of Constraints that do not depend on each other.
+
+    Returns a list of the non-affine Constraints, followed by a
+    ConstraintBlock of the affine ones if there are more than one. A block
+    computes its Parameters at once, so if an affine Constraint reads the
+    Parameter of another one, the affine Constraints are returned in order of
+    their dependencies instead.
+    """
+    affine = []
+    others = []
+    for con in constraints:
+        if getAffine(con.eq) is None or not isscalar(con.par.getValue()):
+            others.append(con)
+        else:
+            affine.append(con)
+    if len(affine) < 2:
+        others.extend(affine)
+    elif _readsTargets(affine):
+        cdict = dict((con.par, con) for con in affine)
+        others.extend(con for level in _orderConstraints(cdict)
+                for con in level)
+    else:
+        others.append(ConstraintBlock(affine))
+    return others
+
+def _readsTargets(constraints):
+    """Check whether a Constraint reads the Parameter of another one."""
+    targets = set(_targetParameter(con.par) for con in constraints)
+    for con in constraints:
+        for arg in con.eq.args:
+            if _targetParameter(arg) in targets:
+                return True
+    return False
+
+def _relativeStep(value, step):
+    """Get a step size relative to the value of a variable."""
+    if value == 0:
+        return step
+    return step * abs(value)
+
+def _relativeSteps(values, step):
+    """Get the relative step sizes of several variables. See _relativeStep."""
+    return array([_relativeStep(v, step) for v in values], dtype=float)
+
+def _absoluteStep(value, step):
+    """Get a step size that does not depend on the value of a variable."""
+    return step
+
+# Step rules for the finite differences of FitRecipe.jacobian
+_steprules = {
+        "relative" : _relativeStep,
+        "absolute" : _absoluteStep,
+        }
+
+def _parameterRule(par):
+    """Make the fallback derivative rule for differentiating by a Parameter.
+
+    The rule is used for Operators without a registered derivative rule (see
+    diffpy.srfit.equation.visitors.differentiator). ProfileGenerators and
+    Calculators that manage par are differentiated with their 'gradient'
+    method. Registered functions with a 'gradient' attribute are
+    differentiated with gradientRule, and other registered functions with
+    dualRule. Other Operators that par does not affect have a zero derivative.
+
+    par     --  A Parameter (not a ParameterProxy).
+
+    Returns the rule.
+    """
+    # Find what the Parameter affects
+    reached = set()
+    stack = [par]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in reached:
+            continue
+        reached.add(id(obj))
+        for callback in getattr(obj, "_observers", None) or ():
+            target = getattr(callback, "im_self", None)
+            if target is None:
+                # We cannot tell what this affects
+                reached = None
+                break
+            stack.append(target)
+        if reached is None:
+            break
+
+    def rule(op, dargs):
+        affected = any(d is not None for d in dargs)
+        if not affected and reached is not None and id(op) not in reached:
+            return None
+        if affected and hasattr(op.operation, "gradient"):
+            return gradientRule(op, dargs)
+        if affected and not isinstance(op, (ProfileGenerator, Calculator)):
+            # Evaluate now to find out if the function propagates dual
+            # numbers.
+            deriv = dualRule(op, dargs)
+            deriv.getValue()
+            return deriv
+
+        name = None
+        if isinstance(op, (ProfileGenerator, Calculator)) and not affected:
+            for pname, p in op._parameters.iteritems():
+                if _targetParameter(p) is par:
+                    name = pname
+                    break
+        if name is None:
+            raise ValueError("Cannot differentiate '%s'" % op.name)
+
+        if isinstance(op, ProfileGenerator):
+            operation = lambda y : op.gradient(op.profile.x, [name])[0]
+        else:
+            operation = lambda y, *args : op.gradient(args, [name])[0]
+        deriv = Operator("d%s_d%s" % (op.name, name), "d%s_d%s" % (op.name,
+            name), operation, len(op.args) + 1, 1)
+        # Observe the Operator so the derivative is recalculated with it
+        deriv.addLiteral(op)
+        for arg in op.args:
+            deriv.addLiteral(arg)
+        if deriv.getValue() is None:
+            raise ValueError("Cannot differentiate '%s'" % op.name)
+        return deriv
+
+    return rule
+
+def _targetParameter(var):
+    """Get the Parameter that ultimately holds the value of a variable.
+
+    This strips any number of ParameterProxy layers from var.
+    """
+    while isinstance(var, ParameterProxy):
+        var = var.par
+    return var
+
 # End of file
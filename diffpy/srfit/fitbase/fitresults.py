@@ -25,6 +25,7 @@ import numpy
 
 from diffpy.srfit.util.inpututils import inputToString
 from diffpy.srfit.util.ordereddict import OrderedDict
+from diffpy.srfit.fitbase.fitrecipe import _relativeSteps
 
 class FitResults(object):
     """Class for processing, presenting and storing results of a fit.
@@ -35,8 +36,15 @@ class FitResults(object):
     conresults  --  An ordered dictionary of ContributionResults for each
                     FitContribution, indexed by the FitContribution name.
     derivstep   --  The fractional step size for calculating numeric
-                    derivatives. Default 1e-8.
-    varnames    --  Names of the variables in the recipe.
+                    derivatives. Default 1e-8. Variables whose value is 0
+                    use derivstep itself.
+    ncpu        --  Number of parallel workers used for calculating the
+                    Jacobian (default 1). See the 'parallel' method.
+    threads     --  Flag indicating whether the parallel workers are threads
+                    rather than processes (default False).
+    pool        --  The RecipePool of the worker processes, or None.
+    varnames    --  Names of the variables in the recipe, including the
+                    projected ones.
     varvals     --  Values of the variables in the recipe.
     varunc      --  Uncertainties in the variable values.
     showfixed   --  Show fixed variables (default True).
@@ -57,6 +65,8 @@ class FitResults(object):
     precision   --  The precision of numeric output (default 8).
     _dcon       --  The derivatives of the constraint equations with respect to
                     the variables. This is used internally.
+    _ownpool    --  Flag indicating whether the pool was started by this
+                    object.
 
     Each of these attributes, except the recipe, are created or updated when
     the update method is called.
@@ -64,7 +74,7 @@ class FitResults(object):
     """
 
     def __init__(self, recipe, update = True, showfixed = True, showcon =
-            False):
+            False, jacobian = None, chiv = None, p = None):
         """Initialize the attributes.
 
         recipe   --  The recipe containing the results
@@ -72,11 +82,17 @@ class FitResults(object):
                     True).
         showcon --  Show fixed variables in the output (default True).
         showcon --  Show constraint values in the output (default False).
+        jacobian, chiv, p   --  Results of the optimizer that are passed to
+                    update (default None). See the update method.
 
         """
         self.recipe = recipe
         self.conresults = OrderedDict()
         self.derivstep = 1e-8
+        self.ncpu = 1
+        self.threads = False
+        self.pool = None
+        self._ownpool = False
         self.varnames = []
         self.varvals = []
         self.varunc = []
@@ -99,14 +115,76 @@ class FitResults(object):
         self.showcon = bool(showcon)
 
         if update:
-            self.update()
+            self.update(jacobian, chiv, p)
         return
 
-    def update(self):
-        """Update the results according to the current state of the recipe."""
-        ## Note that the order of these operations are chosen to reduce
-        ## computation time.
+    def parallel(self, ncpu, threads = False, pool = None):
+        """Calculate the Jacobian in parallel.
+
+        The columns of the Jacobian are distributed among ncpu workers, each
+        of which evaluates a replica of the recipe. The result is the same as
+        that of the serial calculation. If the workers cannot be used, the
+        Jacobian is calculated serially and a message is added.
+
+        ncpu    --  Number of parallel workers. Revert to serial mode when 1.
+        threads --  Use threads rather than processes (default False). Each
+                    thread works on a deep copy of the recipe, so this only
+                    pays off for recipes whose calculations release the GIL,
+                    and it needs a recipe that can be copied.
+        pool    --  A RecipePool of worker processes for the recipe (default
+                    None). If this is None and threads is False, a RecipePool
+                    is started for the first parallel calculation and kept
+                    for the later ones, until 'parallel' is called again. Its
+                    workers hold a replica of the recipe from when they were
+                    started, so call 'parallel' again after changing the
+                    recipe other than by the values of its free variables.
+                    See diffpy.srfit.fitbase.recipepool.
+
+        Raises ValueError if pool is for another recipe.
+        """
+        if pool is not None and pool.recipe is not self.recipe:
+            raise ValueError("The pool evaluates another recipe")
+        if self._ownpool:
+            self.pool.close()
+        self.ncpu = max(1, int(ncpu))
+        self.threads = bool(threads)
+        self.pool = pool
+        self._ownpool = False
+        if pool is not None:
+            self.ncpu = pool.ncpu
+            self.threads = False
+        return
 
+    def update(self, jacobian = None, chiv = None, p = None):
+        """Update the results according to the current state of the recipe.
+
+        An optimizer often holds the Jacobian and residual vector at the
+        solution. These can be passed to avoid recalculating them.
+
+        jacobian    --  The Jacobian of the recipe residual with respect to
+                        the free variables, with shape (len(chiv), nvars).
+                        If this is None (default), the Jacobian is calculated
+                        numerically.
+        chiv        --  The residual vector of the recipe (as returned by
+                        its residual method). If this is None (default), the
+                        residual is calculated.
+        p           --  The variable values at which jacobian and chiv were
+                        calculated (default None). This is required if
+                        jacobian or chiv is passed, and must equal the
+                        current values of the recipe variables.
+
+        Projected variables (see FitRecipe.project) are reported with the
+        other variables, at their solved values. Their uncertainties are
+        found from the Jacobian with respect to all variables, so a passed
+        jacobian, which lacks their columns, is not used.
+
+        Note that the 'fjac' output of scipy.optimize.leastsq is not the
+        Jacobian.
+
+        Raises ValueError if jacobian or chiv is passed without p, if p does
+        not match the recipe variables or if jacobian or chiv do not have the
+        expected shape.
+        """
         recipe = self.recipe
 
         if not recipe._contributions:
@@ -114,14 +192,44 @@ class FitResults(object):
 
         # Make sure everything is ready for calculation
         recipe._prepare()
+        recipe._prepareFree()
+
+        # Check the optimizer output
+        jacobian, chiv = self._checkOptimizerOutput(jacobian, chiv, p)
+
+        projected = list(recipe._linearvars)
+        if not projected:
+            self._update(jacobian, chiv)
+            return
+
+        # Solve for the projected variables at the current values, and treat
+        # them as ordinary variables while the results are calculated.
+        recipe._updateConstraints()
+        recipe.unproject(*projected)
+        try:
+            self._update(None, chiv)
+        finally:
+            recipe.project(*projected)
+        return
+
+    def _update(self, jacobian, chiv):
+        """Update the results with the projected variables released.
+
+        jacobian, chiv  --  The checked optimizer output, or None.
+        """
+        ## Note that the order of these operations are chosen to reduce
+        ## computation time.
+
+        recipe = self.recipe
+        recipe._prepare()
 
         # Store the variable names and values
         self.varnames = recipe.getNames()
         self.varvals = recipe.getValues()
         fixedpars = recipe._tagmanager.union(recipe._fixedtag)
-        fixedpars = [p for p in fixedpars if not p.constrained]
-        self.fixednames = [p.name for p in fixedpars]
-        self.fixedvals = [p.value for p in fixedpars]
+        fixedpars = [par for par in fixedpars if not par.constrained]
+        self.fixednames = [par.name for par in fixedpars]
+        self.fixedvals = [par.value for par in fixedpars]
 
         # Store the constraint information
         self.connames = [con.par.name for con in recipe._oconstraints]
@@ -129,7 +237,7 @@ class FitResults(object):
 
         if self.varnames:
             # Calculate the covariance
-            self._calculateCovariance()
+            self._calculateCovariance(jacobian)
 
             # Get the variable uncertainties
             self.varunc = [self.cov[i,i]**0.5 for i in \
@@ -144,7 +252,9 @@ class FitResults(object):
             self.conresults[con.name] = ContributionResults(con, weight, self)
 
         # Calculate the metrics
-        res = recipe.residual()
+        res = chiv
+        if res is None:
+            res = recipe.residual()
         self.residual = numpy.dot(res, res)
         self._calculateMetrics()
 
@@ -154,15 +264,57 @@ class FitResults(object):
 
         return
 
-    def _calculateCovariance(self):
+    def _checkOptimizerOutput(self, jacobian, chiv, p):
+        """Check the Jacobian and residual passed to update.
+
+        Returns jacobian and chiv as arrays, or None where they were not
+        passed.
+
+        Raises ValueError if jacobian or chiv is passed without p, if p does
+        not match the recipe variables or if jacobian or chiv do not have the
+        expected shape.
+        """
+        recipe = self.recipe
+        pvals = recipe.getValues()
+        if p is None:
+            if jacobian is not None or chiv is not None:
+                m = "The variable values of the Jacobian and residual are " \
+                        "required"
+                raise ValueError(m)
+        else:
+            p = numpy.asarray(p, dtype=float)
+            if not numpy.array_equal(p, pvals):
+                m = "The variable values do not match those of the recipe"
+                raise ValueError(m)
+
+        m = recipe._chivsize + len(recipe._restraintlist)
+        if chiv is not None:
+            chiv = numpy.asarray(chiv, dtype=float)
+            if chiv.shape != (m,):
+                raise ValueError("The residual must have shape (%i,)" % m)
+        if jacobian is not None:
+            jacobian = numpy.asarray(jacobian, dtype=float)
+            shape = (m, len(pvals))
+            if jacobian.shape != shape:
+                raise ValueError("The Jacobian must have shape %s" % (shape,))
+        return jacobian, chiv
+
+    def _calculateCovariance(self, J = None):
         """Calculate the covariance matrix. This is called by update.
 
         This code borrowed from PARK. It finds the pseudo-inverse of the
         Jacobian using the singular value decomposition.
 
+        J   --  The Jacobian. If this is None (default), it is calculated
+                numerically along with the constraint derivatives. Otherwise
+                only the constraint derivatives are calculated.
+
         """
         try:
-            J = self._calculateJacobian()
+            if J is None:
+                J = self._calculateJacobian()
+            else:
+                self._calculateConstraintDerivatives()
             u,s,vh = numpy.linalg.svd(J,0)
             self.cov = numpy.dot(vh.T.conj()/s**2,vh)
         except numpy.linalg.LinAlgError:
@@ -171,6 +323,27 @@ class FitResults(object):
             self.cov = numpy.zeros((l, l), dtype=float)
         return
 
+    def _calculateConstraintDerivatives(self):
+        """Calculate the derivatives of the constrained parameters.
+
+        This is the part of _calculateJacobian that concerns the constraints.
+        Only the constraints are updated, so the residual is not evaluated.
+        """
+        recipe = self.recipe
+        pvals = numpy.asarray(self.varvals)
+        delta = _relativeSteps(pvals, self.derivstep)
+
+        results = [_constraintDerivatives(recipe, pvals, delta, k)
+                for k in range(len(pvals))]
+
+        # Reset the variables and constrained parameters to their original
+        # values
+        recipe._applyValues(pvals)
+        recipe._updateConstraints()
+
+        self._dcon = numpy.vstack(results).T
+        return
+
     def _calculateJacobian(self):
         """Calculate the Jacobian for the fitting.
 
@@ -183,6 +356,9 @@ class FitResults(object):
         Numeric derivatives are calculated based on step, where step is the
         portion of variable value. E.g. step = dv/v.
 
+        Only the parts of the residual that depend on a variable are evaluated
+        for its column, so the fit hooks of the recipe are not called.
+
         """
         recipe = self.recipe
         step = self.derivstep
@@ -190,55 +366,67 @@ class FitResults(object):
         # Make sure the input vector is an array
         pvals = numpy.asarray(self.varvals)
         # Compute the numeric derivative using the center point formula.
-        delta = step * pvals
-
-        # Center point formula:
-        #     df/dv = lim_{h->0} ( f(v+h)-f(v-h) ) / ( 2h )
-        #
-
-        r = []
-        # The list of constraint derivatives with respect to variables
-        # The forward difference would be faster, but perhaps not as accurate.
-        conr = []
-        for k,v in enumerate(pvals):
-            h = delta[k]
-            pvals[k] = v + h
-            rk = self.recipe.residual(pvals)
-
-            # The constraints derivatives
-            cond = []
-            for con in recipe._oconstraints:
-                con.update()
-                cond.append(con.par.getValue())
-
-            pvals[k] = v - h
-            rk -= self.recipe.residual(pvals)
-
-            # FIXME - constraints are used for vectors as well!
-            for i, con in enumerate(recipe._oconstraints):
-                con.update()
-                val = con.par.getValue()
-                if numpy.isscalar(val):
-                    cond[i] -= con.par.getValue()
-                    cond[i] /= 2*h
-                else:
-                    cond[i] = 0.0
-
-            conr.append(cond)
-
-            pvals[k] = v
-            r.append(rk/(2*h))
-
-        # Reset the constrained parameters to their original values
-        for con in recipe._oconstraints:
-            con.update()
-
-        self._dcon = numpy.vstack(conr).T
+        delta = _relativeSteps(pvals, step)
+
+        # The columns are calculated at the current variable values
+        recipe._applyValues(pvals)
+        columns = range(len(pvals))
+        results = None
+        if self.ncpu > 1 and len(columns) > 1:
+            results = self._parallelJacobian(pvals, delta)
+        if results is None:
+            results = [_jacobianColumn(recipe, pvals, delta, k)
+                    for k in columns]
+
+        # Reset the variables and constrained parameters to their original
+        # values
+        recipe._applyValues(pvals)
+        recipe._updateConstraints()
+
+        # The constraint derivatives with respect to variables
+        self._dcon = numpy.vstack([cond for rk, cond in results]).T
 
         # return the jacobian
-        jac = numpy.vstack(r).T
+        jac = numpy.vstack([rk for rk, cond in results]).T
         return jac
 
+    def _parallelJacobian(self, pvals, delta):
+        """Calculate the columns of the Jacobian with the parallel workers.
+
+        Returns the list of column results from _jacobianColumn in column
+        order, or None if the workers cannot be used.
+        """
+        from diffpy.srfit.exceptions import SrFitError
+        from diffpy.srfit.fitbase.recipepool import RecipePool
+        recipe = self.recipe
+        if self.threads:
+            results = _threadJacobian(recipe, pvals, delta, self.ncpu)
+            if results is None:
+                self._addMessage("Cannot copy the recipe for the worker "
+                        "threads. The Jacobian is calculated serially.")
+            return results
+
+        if self._ownpool and self.pool.names != recipe.getNames():
+            # The free variables changed, so the replicas are outdated
+            self.pool.close()
+            self.pool = None
+            self._ownpool = False
+        if self.pool is None:
+            try:
+                self.pool = RecipePool(recipe, self.ncpu)
+            except SrFitError:
+                self._addMessage("Cannot start the worker processes. The "
+                        "Jacobian is calculated serially.")
+                return None
+            self._ownpool = True
+        return self.pool.differentiate(pvals, delta)
+
+    def _addMessage(self, m):
+        """Add a message about the results, unless it is there already."""
+        if m not in self.messages:
+            self.messages.append(m)
+        return
+
     def _calculateMetrics(self):
         """Calculate chi2, cumchi2, rchi2, rw and cumrw for the recipe."""
         cumchi2 = numpy.array([], dtype=float)
@@ -449,16 +637,16 @@ class FitResults(object):
                 val = (self.cov[i,j]/(self.cov[i,i] * self.cov[j,j])**0.5)
                 if abs(val) > corrmin:
                     cornames.append(name)
-                    tup.append((val, name))
+                    tup.append((val, i, j, name))
 
-        tup.sort(key=lambda vn : abs(vn[0]))
-        tup.reverse()
+        # Largest correlations first, equal ones by variable index
+        tup.sort(key=lambda t : (-abs(t[0]), t[1], t[2]))
 
         if cornames:
             w = max(map(len, cornames))
             w = str(w + 1)
             formatstr = "%-"+w+"s  %.4f"
-            for val, name in tup:
+            for val, i, j, name in tup:
                 lines.append(formatstr%(name, val))
         else:
             lines.append("No correlations greater than %i%%"%corint)
@@ -510,6 +698,90 @@ class FitResults(object):
 
 # End class FitResults
 
+def _jacobianColumn(recipe, pvals, delta, k):
+    """Calculate one column of the Jacobian of a recipe.
+
+    recipe  --  The FitRecipe, with its variables set to pvals.
+    pvals   --  The variable values at which to calculate the derivative.
+    delta   --  The step size for each variable.
+    k       --  The index of the variable.
+
+    Returns the derivative of the residual with respect to variable k and the
+    list of derivatives of the constrained parameters. The constraint
+    derivatives are 0 for non-scalar parameters.
+    """
+    # Only the parts of the residual that depend on the variable are
+    # evaluated. The rest of the column is zero.
+    blocks, cond = recipe._differentiate(k, delta[k])
+    rk = numpy.zeros(recipe._chivsize + len(recipe._restraintlist))
+    for start, deriv in blocks:
+        rk[start:start+len(deriv)] = deriv
+    return rk, cond
+
+def _constraintDerivatives(recipe, pvals, delta, k):
+    """Calculate the derivatives of the constrained parameters of a recipe.
+
+    This uses the same formula as _jacobianColumn, but does not evaluate the
+    residual.
+
+    Returns the list of derivatives with respect to variable k. These are 0
+    for non-scalar parameters.
+    """
+    p = numpy.array(pvals, dtype=float)
+    v = p[k]
+    h = delta[k]
+    p[k] = v + h
+    recipe._applyValues(p)
+    recipe._updateConstraints()
+    cond = [con.par.getValue() for con in recipe._oconstraints]
+
+    p[k] = v - h
+    recipe._applyValues(p)
+    recipe._updateConstraints()
+    for i, con in enumerate(recipe._oconstraints):
+        val = con.par.getValue()
+        if numpy.isscalar(val):
+            cond[i] -= val
+            cond[i] /= 2*h
+        else:
+            cond[i] = 0.0
+
+    return cond
+
+def _threadJacobianColumns(args):
+    """Calculate several columns of the Jacobian with one recipe replica."""
+    recipe, pvals, delta, columns = args
+    return [_jacobianColumn(recipe, pvals, delta, k) for k in columns]
+
+def _threadJacobian(recipe, pvals, delta, ncpu):
+    """Calculate the columns of the Jacobian in worker threads.
+
+    Returns the list of column results from _jacobianColumn in column order,
+    or None if the recipe cannot be copied. Generators that wrap C++
+    calculators often cannot be.
+    """
+    import copy
+    from multiprocessing.pool import ThreadPool
+    columns = range(len(pvals))
+    ncpu = min(ncpu, len(columns))
+    # Each thread gets its own replica of the recipe.
+    try:
+        tasks = [(copy.deepcopy(recipe), pvals, delta, columns[i::ncpu])
+                for i in range(ncpu)]
+    except Exception:
+        return None
+    pool = ThreadPool(ncpu)
+    try:
+        chunks = pool.map(_threadJacobianColumns, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    results = [None] * len(columns)
+    for i, chunk in enumerate(chunks):
+        results[i::ncpu] = chunk
+    return results
+
+
 class ContributionResults(object):
     """Class for processing, storing FitContribution results.
 
@@ -48,9 +48,13 @@ class Parameter(_parameter_interface, Argument, Validatable):
     bounds  --  A 2-list defining the bounds on the Parameter. This can be
                 used by some optimizers when the Parameter is varied. See
                 FitRecipe.getBounds and FitRecipe.boundsToRestraints.
+    _bounds --  The bounds list, or None for the default [-inf, inf]. The
+                list is created when bounds is first used.
 
     """
 
+    __slots__ = ("constrained", "_bounds")
+
     def __init__(self, name, value = None, const = False):
         """Initialization.
 
@@ -64,7 +68,7 @@ class Parameter(_parameter_interface, Argument, Validatable):
 
         """
         self.constrained = False
-        self.bounds = [-inf, inf]
+        self._bounds = None
         validateName(name)
         Argument.__init__(self, name, value, const)
         return
@@ -86,6 +90,17 @@ class Parameter(_parameter_interface, Argument, Validatable):
         if ub is not None: self.bounds[1] = ub
         return self
 
+    def _getBounds(self):
+        if self._bounds is None:
+            self._bounds = [-inf, inf]
+        return self._bounds
+
+    def _setBounds(self, bounds):
+        self._bounds = bounds
+        return
+
+    bounds = property(_getBounds, _setBounds)
+
     def setConst(self, const = True, value = None):
         """Toggle the Parameter as constant.
 
@@ -170,6 +185,16 @@ class ParameterProxy(_parameter_interface, Validatable):
         par = object.__getattribute__(self, 'par')
         return getattr(par, attrname)
 
+    # Pickle the proxy itself rather than the state of the reference
+    # Parameter, which would be found through __getattr__.
+
+    def __getstate__(self):
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        return
+
 
     # Ensure there is no __dir__ override in the base classes.
     assert (getattr(_parameter_interface, '__dir__', None) is
@@ -218,6 +243,8 @@ class ParameterAdapter(Parameter):
 
     """
 
+    __slots__ = ("obj", "getter", "setter", "attr")
+
     def __init__(self, name, obj, getter = None, setter = None, attr = None):
         """Wrap an object as a Parameter.
 
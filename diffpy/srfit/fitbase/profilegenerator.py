@@ -114,6 +114,23 @@ class ProfileGenerator(Operator, ParameterSet):
         """
         return x
 
+    # Overload me!
+    def gradient(self, x, parnames):
+        """Get the derivatives of the profile with respect to Parameters.
+
+        This method can be overloaded to provide analytic derivatives. It is
+        optional, so a derivative that is not available is None and must be
+        computed by other means, e.g. by finite differences.
+
+        x           --  The independent variables, as passed to __call__.
+        parnames    --  The names of the Parameters of this generator.
+
+        Returns a list that holds the derivative of the profile for each name
+        in parnames, or None if that derivative is not available.
+
+        """
+        return [None] * len(parnames)
+
     ## No need to overload anything below here
 
     def operation(self):
@@ -32,7 +32,8 @@ from diffpy.srfit.fitbase.parameter import Parameter
 from diffpy.srfit.fitbase.configurable import Configurable
 from diffpy.srfit.fitbase.validatable import Validatable
 
-from diffpy.srfit.util.observable import Observable
+from diffpy.srfit.util.observable import Observable, deferNotifications
+from diffpy.srfit.util.observable import _Observers
 from diffpy.srfit.equation import Equation
 from diffpy.srfit.equation.builder import EquationFactory
 from diffpy.srfit.util.nameutils import validateName
@@ -45,7 +46,10 @@ class RecipeContainer(Observable, Configurable, Validatable):
     RecipeContainers are hierarchical organizations of Parameters and other
     RecipeContainers. This class provides attribute-access to these contained
     objects.  Parameters and other RecipeContainers can be found within the
-    hierarchy with the _locateManagedObject method.
+    hierarchy with the _locateManagedObject method, and by their dotted path
+    with the getPath, getByPath and iterPaths methods. These use an index of
+    the hierarchy that is rebuilt when objects are added or removed anywhere
+    within it.
 
     A RecipeContainer can manage dictionaries for that store various objects.
     These dictionaries can be added to the RecipeContainer using the _manage
@@ -69,6 +73,12 @@ class RecipeContainer(Observable, Configurable, Validatable):
                         attribute access, addition and removal.
     _configobjs     --  A set of configurable objects that must know of
                         configuration changes within this object.
+    _pathindex      --  The _PathIndex of the managed hierarchy, or None if it
+                        must be rebuilt.
+    _indexparents   --  The _invalidatePathIndex methods of the
+                        RecipeContainers that manage this object, held by
+                        weak references. Their indices are discarded along
+                        with the index of this object.
 
     Properties
     names           --  Variable names (read only). See getNames.
@@ -88,6 +98,8 @@ class RecipeContainer(Observable, Configurable, Validatable):
         self.__managed = []
         self._manage(self._parameters)
 
+        self._pathindex = None
+        self._indexparents = _Observers()
         return
 
     def _manage(self, d):
@@ -106,25 +118,58 @@ class RecipeContainer(Observable, Configurable, Validatable):
     def iterPars(self, name = ".", recurse = True):
         """Iterate over Parameters.
 
-        name    --  Select parameters with this name (regular expression,
-                    default ".").
+        name    --  Select parameters with this name (regular expression or
+                    compiled pattern, default ".").
         recurse --  Recurse into managed objects (default True)
         """
-        for par in self._parameters.itervalues():
-            if re.match(name, par.name):
+        pattern = re.compile(name)
+        if recurse:
+            pars = self._getPathIndex().pars
+        else:
+            pars = self._parameters.values()
+
+        for par in pars:
+            if pattern.match(par.name):
                 yield par
 
-        if not recurse:
-            return
+        return
+
+    def getPath(self, obj):
+        """Get the dotted path of a managed object within the hierarchy.
 
-        # Iterate over objects within the managed dictionaries.
-        managed = self.__managed[:]
-        managed.remove(self._parameters)
-        for m in managed:
-            for obj in m.values():
-                if hasattr(obj, "iterPars"):
-                    for par in obj.iterPars(name = name):
-                        yield par
+        obj     --  The object to find.
+
+        Returns the path relative to this object, or None if obj cannot be
+        found. The path of an object that is managed in several places is the
+        one of the location returned by _locateManagedObject.
+        """
+        loc = self._getPathIndex().locs.get(obj)
+        if loc is None:
+            return None
+        return ".".join(o.name for o in loc)
+
+    def getByPath(self, path, default = None):
+        """Get a managed object within the hierarchy by its dotted path.
+
+        path    --  The path relative to this object, e.g. "phase.Ni0.x".
+        default --  The value returned if there is no such object (default
+                    None).
+        """
+        return self._getPathIndex().paths.get(path, default)
+
+    def iterPaths(self, pattern = "."):
+        """Iterate over managed objects within the hierarchy by dotted path.
+
+        pattern --  Select objects whose path relative to this object matches
+                    this regular expression or compiled pattern (default ".").
+
+        Yields (path, object) tuples in the order of the hierarchy.
+        """
+        pattern = re.compile(pattern)
+        index = self._getPathIndex()
+        for path in index.order:
+            if pattern.match(path):
+                yield path, index.paths[path]
 
         return
 
@@ -221,6 +266,23 @@ class RecipeContainer(Observable, Configurable, Validatable):
         """Get the values of managed parameters."""
         return [p.value for p in self._parameters.values()]
 
+    def batchUpdate(self):
+        """Get a context manager that coalesces change notifications.
+
+        Parameters that change within the block notify their observers when
+        the block ends, and each changed object notifies once. Operators that
+        depend on many of the Parameters are then invalidated once rather than
+        once per Parameter. Values that depend on the changed Parameters must
+        not be read within the block.
+
+        > with recipe.batchUpdate():
+        >     for par, val in zip(pars, values):
+        >         par.setValue(val)
+
+        See diffpy.srfit.util.observable.deferNotifications.
+        """
+        return deferNotifications()
+
     def _addObject(self, obj, d, check = True):
         """Add an object to a managed dictionary.
 
@@ -255,12 +317,17 @@ class RecipeContainer(Observable, Configurable, Validatable):
         # Detach the old object, if there is one
         if oldobj is not None:
             oldobj.removeObserver(self._flush)
+            if isinstance(oldobj, RecipeContainer):
+                oldobj._indexparents.discard(self._invalidatePathIndex)
 
         # Add the object
         d[obj.name] = obj
 
         # Observe the object
         obj.addObserver(self._flush)
+        if isinstance(obj, RecipeContainer):
+            obj._indexparents.addWeak(self._invalidatePathIndex)
+        self._invalidatePathIndex()
 
         # Store this as a configurable object
         self._storeConfigurable(obj)
@@ -271,15 +338,39 @@ class RecipeContainer(Observable, Configurable, Validatable):
 
         Raises ValueError if obj is not part of the dictionary.
         """
-        if obj not in d.values():
+        name = getattr(obj, "name", None)
+        if name is None or d.get(name) is not obj:
             m = "'%s' is not part of the %s" % (obj, self.__class__.__name__)
             raise ValueError(m)
 
-        del d[obj.name]
+        del d[name]
         obj.removeObserver(self._flush)
+        if isinstance(obj, RecipeContainer):
+            obj._indexparents.discard(self._invalidatePathIndex)
+        self._invalidatePathIndex()
 
         return
 
+    def _getPathIndex(self):
+        """Get the _PathIndex of the managed hierarchy.
+
+        The index is built from the indices of the managed RecipeContainers,
+        so the indices within the hierarchy are valid whenever this one is.
+        """
+        if self._pathindex is None:
+            self._pathindex = _PathIndex(self)
+        return self._pathindex
+
+    def _invalidatePathIndex(self):
+        """Discard the index of this object and of the objects managing it."""
+        # The indices of the managing objects were discarded with this one.
+        if self._pathindex is None:
+            return
+        self._pathindex = None
+        for invalidate in tuple(self._indexparents):
+            invalidate()
+        return
+
     def _locateManagedObject(self, obj):
         """Find the location a managed object within the hierarchy.
 
@@ -290,27 +381,14 @@ class RecipeContainer(Observable, Configurable, Validatable):
         last entry in the list is obj. If obj cannot be found, the list is
         empty.
         """
-        loc = [self]
-
         # This handles the case that an object is asked to locate itself.
         if obj is self:
-            return loc
-
-        for m in self._iterManaged():
-
-            # Check locally for the object
-            if m is obj:
-                loc.append(obj)
-                return loc
-
-            # Check within managed objects
-            if hasattr(m, "_locateManagedObject"):
+            return [self]
 
-                subloc = m._locateManagedObject(obj)
-                if subloc:
-                    return loc + subloc
-
-        return []
+        loc = self._getPathIndex().locs.get(obj)
+        if loc is None:
+            return []
+        return [self] + list(loc)
 
     def _flush(self, other):
         """Invalidate cached state.
@@ -813,6 +891,35 @@ class RecipeOrganizer(_recipeorganizer_interface, RecipeContainer):
                 m.clearRestraints(recurse)
         return
 
+    def mergeCommonSubexpressions(self, recurse = True):
+        """Merge common subexpressions of the equations of this organizer.
+
+        Structurally identical subtrees over the same Parameters in the
+        equations built by this organizer are replaced by a single shared
+        node, so that each is computed once per residual. This includes the
+        profile and residual equations of FitContributions, registered
+        functions, constraints and restraints.
+
+        recurse --  Merge with the equations of managed sub-objects as well
+                    (default True).
+
+        Returns the number of nodes that were replaced.
+        """
+        factories = self._getEquationFactories(recurse)
+        nmerged = self._eqfactory.mergeCommonSubexpressions(factories[1:])
+        if nmerged:
+            self._updateConfiguration()
+        return nmerged
+
+    def _getEquationFactories(self, recurse = True):
+        """Get the EquationFactories of this and managed sub-objects."""
+        factories = [self._eqfactory]
+        if recurse:
+            f = lambda m : hasattr(m, "_getEquationFactories")
+            for m in ifilter(f, self._iterManaged()):
+                factories.extend(m._getEquationFactories(recurse))
+        return factories
+
     def _getConstraints(self, recurse = True):
         """Get the constrained Parameters for this and managed sub-objects."""
         constraints = {}
@@ -958,6 +1065,48 @@ class RecipeOrganizer(_recipeorganizer_interface, RecipeContainer):
 
 # End RecipeOrganizer
 
+class _PathIndex(object):
+    """Index of the managed hierarchy of a RecipeContainer.
+
+    Attributes
+    paths   --  Dictionary of the managed objects within the hierarchy,
+                indexed by their dotted path relative to the container.
+    order   --  List of the paths, in the order of a depth-first traversal
+                of the hierarchy.
+    locs    --  Dictionary of the locations of the managed objects, indexed
+                by object. A location is the tuple of objects below the
+                container that leads to the object, ending with the object.
+                Objects that are managed in several places have the first
+                location in a depth-first traversal of the hierarchy.
+    pars    --  List of the Parameters within the hierarchy, in the order of
+                RecipeContainer.iterPars.
+    """
+
+    def __init__(self, container):
+        """Build the index of a RecipeContainer."""
+        paths = self.paths = {}
+        order = self.order = []
+        locs = self.locs = {}
+        self.pars = container._parameters.values()
+        for m in container._iterManaged():
+            paths[m.name] = m
+            order.append(m.name)
+            locs.setdefault(m, (m,))
+            if not isinstance(m, RecipeContainer):
+                continue
+            sub = m._getPathIndex()
+            prefix = m.name + "."
+            suborder = [prefix + path for path in sub.order]
+            paths.update(zip(suborder, (sub.paths[p] for p in sub.order)))
+            order.extend(suborder)
+            for obj, loc in sub.locs.iteritems():
+                if obj not in locs:
+                    locs[obj] = (m,) + loc
+            self.pars.extend(sub.pars)
+        return
+
+# End class _PathIndex
+
 def equationFromString(eqstr, factory, ns = {}, buildargs = False,
         argclass = Parameter, argkw = {}):
     """Make an equation from a string.
@@ -982,10 +1131,8 @@ def equationFromString(eqstr, factory, ns = {}, buildargs = False,
     Raises ValueError if the equation has undefined parameters.
     """
 
-    defined = set(factory.builders.keys())
-
     # Check if ns overloads any parameters.
-    if defined.intersection(ns.keys()):
+    if any(name in factory.builders for name in ns):
         raise ValueError("ns contains defined names")
 
     # Register the ns parameters in the equation factory
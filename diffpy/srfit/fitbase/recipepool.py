@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+"""The RecipePool class for evaluating a FitRecipe in worker processes.
+
+A RecipePool holds a persistent pool of worker processes that evaluate the
+residual of a FitRecipe for many variable vectors, such as the members of the
+population of a global optimizer. The workers are forked when the pool is
+started, so they inherit a replica of the recipe rather than receive it in
+pickled form. This works for generators that wrap C++ calculators, such as
+those of diffpy.srreal and pyobjcryst. After that, only the variable vectors
+and the residuals are sent between the processes, and the workers are reused
+until the pool is closed. Since the recipe is inherited, a RecipePool can only
+be started on platforms that fork processes.
+
+See FitRecipe.evaluatePopulation and FitResults.parallel.
+
+"""
+
+__all__ = ["RecipePool"]
+
+import itertools
+import os
+
+import numpy
+
+from diffpy.srfit.exceptions import SrFitError
+
+# The recipes of the pools, indexed by a pool token. These are set before the
+# workers are forked, so the workers inherit them.
+_poolrecipes = {}
+_tokens = itertools.count()
+
+class RecipePool(object):
+    """Persistent pool of worker processes for evaluating a FitRecipe.
+
+    The workers hold a replica of the recipe as it was when the pool was
+    started. The values of the fixed variables and the configuration of the
+    recipe are those of that time. Start a new pool when they change.
+
+    Attributes
+    recipe  --  The FitRecipe.
+    ncpu    --  The number of worker processes.
+    names   --  The names of the free variables when the pool was started.
+    _pool   --  The multiprocessing.Pool of the workers, or None if the pool
+                is closed.
+    _token  --  The key of the recipe in the recipes inherited by the
+                workers.
+
+    """
+
+    def __init__(self, recipe, ncpu = None):
+        """Start the worker processes.
+
+        recipe  --  The FitRecipe to evaluate.
+        ncpu    --  The number of worker processes (default None). If this is
+                    None, the number of CPUs is used.
+
+        Raises SrFitError if the platform cannot fork processes.
+
+        """
+        if not hasattr(os, "fork"):
+            raise SrFitError("The workers of a RecipePool must be forked")
+        import multiprocessing
+        if ncpu is None:
+            ncpu = multiprocessing.cpu_count()
+        self.recipe = recipe
+        self.ncpu = ncpu
+        # Prepare the recipe before forking, so the workers do not each do it
+        recipe._prepare()
+        self.names = recipe.getNames()
+        self._token = _tokens.next()
+        _poolrecipes[self._token] = recipe
+        self._pool = multiprocessing.Pool(ncpu, _initWorker, (self._token,))
+        return
+
+    def map(self, P, output = "chi2"):
+        """Evaluate the recipe for many variable vectors.
+
+        P       --  The variable vectors, with one row per vector and one
+                    column per free variable.
+        output  --  "chi2" (default) to get the scalar residual of each vector,
+                    or "chiv" to get the vector residual.
+
+        Returns an array with the results for the rows of P along the first
+        axis.
+
+        Raises SrFitError if the pool is closed or the free variables of the
+        recipe have changed since the pool was started.
+        Raises ValueError if output is not known or P does not have a column
+        for each free variable.
+
+        """
+        self._check()
+        P = _checkPopulation(P, len(self.names), output)
+        tasks = [(self._token, p, output) for p in P]
+        chunksize = max(1, len(tasks) // (4 * self.ncpu))
+        results = self._pool.map(_workerEvaluate, tasks, chunksize)
+        return numpy.array(results)
+
+    def differentiate(self, p, delta):
+        """Calculate the columns of the Jacobian by finite differences.
+
+        p       --  The variable values at which to calculate the Jacobian.
+        delta   --  The step size for each variable.
+
+        Returns the list of the results of
+        diffpy.srfit.fitbase.fitresults._jacobianColumn, one for each
+        variable.
+
+        Raises SrFitError if the pool is closed or the free variables of the
+        recipe have changed since the pool was started.
+
+        """
+        self._check()
+        tasks = [(self._token, p, delta, k) for k in range(len(p))]
+        return self._pool.map(_workerDifferentiate, tasks)
+
+    def _check(self):
+        """Check that the workers can evaluate the recipe.
+
+        Raises SrFitError if the pool is closed or the free variables of the
+        recipe have changed since the pool was started.
+
+        """
+        if self._pool is None:
+            raise SrFitError("The pool is closed")
+        if self.recipe.getNames() != self.names:
+            raise SrFitError("The free variables have changed since the pool "
+                    "was started")
+        return
+
+    def close(self):
+        """Stop the worker processes."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            del _poolrecipes[self._token]
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+# End class RecipePool
+
+def _evaluate(recipe, p, output):
+    """Evaluate the residual of a recipe without calling its fit hooks.
+
+    recipe  --  The FitRecipe.
+    p       --  The variable vector.
+    output  --  "chi2" for the scalar residual or "chiv" for the vector
+                residual.
+
+    Returns the residual. The variables are left at the values in p.
+
+    """
+    chiv = recipe._chiv(p)
+    if output == "chi2":
+        return numpy.dot(chiv, chiv)
+    return chiv
+
+def _checkPopulation(P, nvars, output):
+    """Check the arguments of a population evaluation.
+
+    Returns P as a 2-dimensional array.
+
+    Raises ValueError if output is not known or P does not have nvars
+    columns.
+
+    """
+    if output not in ("chi2", "chiv"):
+        raise ValueError("Unknown output '%s'" % output)
+    P = numpy.array(P, dtype = float, ndmin = 2)
+    if P.ndim != 2 or P.shape[1] != nvars:
+        raise ValueError("The variable vectors must have %i values" % nvars)
+    return P
+
+def _initWorker(token):
+    """Prepare the inherited recipe of a worker process."""
+    recipe = _poolrecipes[token]
+    # Fit hooks report on the refinement in the main process
+    recipe.fithooks = []
+    return
+
+def _workerEvaluate(args):
+    """Evaluate a variable vector within a worker process."""
+    token, p, output = args
+    return _evaluate(_poolrecipes[token], p, output)
+
+def _workerDifferentiate(args):
+    """Calculate a column of the Jacobian within a worker process."""
+    from diffpy.srfit.fitbase.fitresults import _jacobianColumn
+    token, p, delta, k = args
+    recipe = _poolrecipes[token]
+    recipe._applyValues(p)
+    return _jacobianColumn(recipe, p, delta, k)
+
+# End of file
@@ -23,12 +23,17 @@ equation calculated by a FitRecipe.
 
 __all__ = ["Restraint"]
 
+from itertools import count
+
 from numpy import inf
 
 from diffpy.srfit.fitbase.validatable import Validatable
 from diffpy.srfit.exceptions import SrFitError
 
 
+# The creation numbers of Restraints
+_serials = count()
+
 class Restraint(Validatable):
     """Restraint class.
 
@@ -41,6 +46,8 @@ class Restraint(Validatable):
     scaled  --  A flag indicating if the restraint is scaled (multiplied) by
                 the unrestrained point-average chi^2 (chi^2/numpoints)
                 (default False).
+    _serial --  The creation number of the restraint. FitRecipe orders its
+                restraints by this.
 
     The penalty is calculated as
     (max(0, lb - val, val - ub)/sig)**2
@@ -69,6 +76,7 @@ class Restraint(Validatable):
         self.ub = float(ub)
         self.sig = float(sig)
         self.scaled = bool(scaled)
+        self._serial = next(_serials)
         return
 
     def penalty(self, w = 1.0):
@@ -299,4 +299,40 @@ class BasePDFGenerator(ProfileGenerator):
             y = numpy.interp(r, rcalc, y)
         return y
 
+    def gradient(self, r, parnames):
+        """Get the derivatives of the PDF with respect to Parameters.
+
+        The SrReal calculators do not compute derivatives with respect to
+        their Parameters, so these are only available where they follow from
+        the PDF itself. These are the scale factor and qdamp, which enters
+        through the resolution envelope exp(-0.5*(qdamp*r)**2). The
+        derivative with respect to scale is None if scale is 0.
+
+        r           --  The r-grid, as passed to __call__.
+        parnames    --  The names of the Parameters of this generator.
+
+        Returns a list that holds the derivative of the PDF for each name in
+        parnames, or None if that derivative is not available.
+
+        """
+        y = None
+        grads = []
+        for name in parnames:
+            grad = None
+            if name in ("scale", "qdamp"):
+                if y is None:
+                    if self.profile is not None and r is self.profile.x:
+                        y = self.getValue()
+                    else:
+                        y = self(r)
+                if name == "scale":
+                    scale = self.scale.getValue()
+                    if scale != 0:
+                        grad = y / scale
+                else:
+                    qdamp = self.qdamp.getValue()
+                    grad = -qdamp * r**2 * y
+            grads.append(grad)
+        return grads
+
 # End class BasePDFGenerator
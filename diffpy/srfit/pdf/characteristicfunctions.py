@@ -23,6 +23,12 @@ Gcryst(f) is the crystal PDF.
 These functions are meant to be imported and added to a FitContribution using
 the 'registerFunction' method of that class.
 
+The functions have a 'gradient' attribute. This is a function with the same
+arguments that returns the list of the derivatives of the characteristic
+function with respect to the arguments that follow r. The derivative rules of
+the functions are registered with diffpy.srfit.equation.visitors, so the
+equations that use them can be differentiated.
+
 """
 
 __all__ = ["sphericalCF", "spheroidalCF", "spheroidalCF2",
@@ -36,6 +42,7 @@ from numpy.fft import ifft, fftfreq
 from scipy.special import erf
 
 from diffpy.srfit.fitbase.calculator import Calculator
+from diffpy.srfit.equation.visitors import registerRule, gradientRule
 
 def sphericalCF(r, psize):
     """Spherical nanoparticle characteristic function.
@@ -55,6 +62,18 @@ def sphericalCF(r, psize):
         f[inside] = 1.0 - 1.5*xin + 0.5*xin*xin*xin
     return f
 
+def _sphericalCFGradient(r, psize):
+    """Derivative of sphericalCF with respect to psize."""
+    g = numpy.zeros(numpy.shape(r), dtype=float)
+    if psize > 0:
+        x = numpy.array(r, dtype=float) / psize
+        inside = (x < 1.0)
+        xin = x[inside]
+        g[inside] = 1.5 * xin * (1.0 - xin*xin) / psize
+    return [g]
+
+sphericalCF.gradient = _sphericalCFGradient
+
 def spheroidalCF(r, erad, prad):
     """Spheroidal characteristic function specified using radii.
 
@@ -72,6 +91,13 @@ def spheroidalCF(r, erad, prad):
     pelpt = 1.0 * prad / erad
     return spheroidalCF2(r, psize, pelpt)
 
+def _spheroidalCFGradient(r, erad, prad):
+    """Derivatives of spheroidalCF with respect to erad and prad."""
+    gd, gv = _spheroidalCF2Gradient(r, 2.0 * erad, 1.0 * prad / erad)
+    return [2 * gd - prad * gv / erad**2, gv / erad]
+
+spheroidalCF.gradient = _spheroidalCFGradient
+
 def spheroidalCF2(r, psize, axrat):
     """Spheroidal nanoparticle characteristic function.
 
@@ -139,6 +165,89 @@ def spheroidalCF2(r, psize, axrat):
     return f
 
 
+def _spheroidalCF2Gradient(r, psize, axrat):
+    """Derivatives of spheroidalCF2 with respect to psize and axrat.
+
+    spheroidalCF2 depends on r and psize only through p = r/psize, so the
+    derivatives are found from those with respect to p and axrat.
+
+    """
+    v = 1.0 * axrat
+    d = 1.0 * psize
+
+    if d <= 0 or v <= 0:
+        return [numpy.zeros_like(r), numpy.zeros_like(r)]
+    if v == 1:
+        return [_sphericalCFGradient(r, psize)[0], numpy.zeros_like(r)]
+
+    v2 = v*v
+    rx = r
+
+    def common(p):
+        """Get the derivatives of P(p, v), and Q(p) and its derivative."""
+        p2 = p*p
+        dP = 3/(4*v) - 9*p2/(16*v) - 3*p2/(8*v*v2)
+        vP = -3*p/(4*v2) + 3*p*p2/(16*v2) + 3*p*p2/(8*v2*v2)
+        Q = 3*p/4 - 3*p*p2/16
+        dQ = 0.75 - 9*p2/16
+        return dP, vP, Q, dQ
+
+    if v < 1:
+        w = sqrt(1-v2)
+        A = atanh(w)
+        K = v*A/w
+        vK = A/w - 1/(w*w) + v2*A/(w*w*w)
+        M = v/w
+        vM = 1/(w*w*w)
+
+        pa = rx[rx <= v*psize] / d
+        dP, vP, Q, dQ = common(pa)
+        df1 = -dP - dQ*K
+        vf1 = -vP - Q*vK
+
+        pb = rx[numpy.logical_and(rx > v*psize, rx <= psize)] / d
+        pb2 = pb*pb
+        dP, vP, Q, dQ = common(pb)
+        S = sqrt(1-pb2)
+        R = (3/(8*pb) + 3*pb/16)*S - Q*atanh(S)
+        df2 = (S*(9.0/16 - 3/(8*pb2)) - dQ*atanh(S)) * M
+        vf2 = R * vM
+
+    elif v > 1:
+        w = sqrt(v2-1)
+        T = atan(w)
+        K = v*T/w
+        vK = T/w + 1/(w*w) - v2*T/(w*w*w)
+        M = v/w
+        vM = -1/(w*w*w)
+
+        pa = rx[rx <= psize] / d
+        dP, vP, Q, dQ = common(pa)
+        df1 = -dP - dQ*K
+        vf1 = -vP - Q*vK
+
+        pb = rx[numpy.logical_and(rx > psize, rx <= v*psize)] / d
+        pb2 = pb*pb
+        dP, vP, Q, dQ = common(pb)
+        Z = sqrt(1 - 1/pb2)
+        Y = sqrt(pb2 - 1)
+        V = 3.0/8*(1 + pb2/2)*Z
+        df2 = -dP - 3.0/8*pb*Z*M - M*dQ*(T - atan(Y)) \
+                - 3.0/16*M*(pb2 - 2)*Y/pb2
+        vf2 = -vP - V*vM - Q*(vM*(T - atan(Y)) + 1/(w*w))
+
+    else:
+        # v is nan
+        return [numpy.zeros_like(r), numpy.zeros_like(r)]
+
+    f3 = numpy.zeros_like(rx[rx > max(v, 1)*psize])
+    # f depends on p = r/d, so df/dd = -(p/d) df/dp
+    gd = numpy.concatenate((-pa*df1/d, -pb*df2/d, f3))
+    gv = numpy.concatenate((vf1, vf2, f3))
+    return [gd, gv]
+
+spheroidalCF2.gradient = _spheroidalCF2Gradient
+
 def lognormalSphericalCF(r, psize, psig):
     """Spherical nanoparticle characteristic function with lognormal size
     distribution.
@@ -179,6 +288,49 @@ def lognormalSphericalCF(r, psize, psig):
            + 0.25*r*r*r*erfc((-mu+log(r))/(sqrt2*s))*exp(-3*mu-4.5*s*s) \
            - 0.75*r*erfc((-mu-2*s*s+log(r))/(sqrt2*s))*exp(-mu-2.5*s*s)
 
+def _lognormalSphericalCFGradient(r, psize, psig):
+    """Derivatives of lognormalSphericalCF with respect to psize and psig."""
+    if psize <= 0:
+        return [numpy.zeros_like(r), numpy.zeros_like(r)]
+    if psig <= 0:
+        return [_sphericalCFGradient(r, psize)[0], numpy.zeros_like(r)]
+
+    erfc = lambda x: 1.0-erf(x)
+    derfc = lambda x: -2/sqrt(pi)*exp(-x*x)
+
+    sqrt2 = sqrt(2.0)
+    q = psig*psig/(1.0*psize*psize) + 1
+    s = sqrt(log(q))
+    mu = log(psize) - s*s/2;
+    if mu < 0:
+        return [numpy.zeros_like(r), numpy.zeros_like(r)]
+
+    # Derivatives with respect to mu and s
+    L = log(r)
+    u1 = (-mu-3*s*s+L)/(sqrt2*s)
+    u2 = (-mu+L)/(sqrt2*s)
+    u3 = (-mu-2*s*s+L)/(sqrt2*s)
+    E2 = exp(-3*mu-4.5*s*s)
+    E3 = exp(-mu-2.5*s*s)
+    umu = -1/(sqrt2*s)
+    us = -(-mu+L)/(sqrt2*s*s)
+
+    fmu = 0.5*derfc(u1)*umu \
+            + 0.25*r*r*r*E2*(derfc(u2)*umu - 3*erfc(u2)) \
+            - 0.75*r*E3*(derfc(u3)*umu - erfc(u3))
+    fs = 0.5*derfc(u1)*(us - 3/sqrt2) \
+            + 0.25*r*r*r*E2*(derfc(u2)*us - 9*s*erfc(u2)) \
+            - 0.75*r*E3*(derfc(u3)*(us - 2/sqrt2) - 5*s*erfc(u3))
+
+    # Chain to psize and psig
+    sd = -psig*psig/(s*q*psize*psize*psize)
+    ssig = psig/(s*q*psize*psize)
+    mud = 1.0/psize - s*sd
+    musig = -s*ssig
+    return [fmu*mud + fs*sd, fmu*musig + fs*ssig]
+
+lognormalSphericalCF.gradient = _lognormalSphericalCFGradient
+
 def sheetCF(r, sthick):
     """Nanosheet characteristic function.
 
@@ -195,6 +347,17 @@ def sheetCF(r, sthick):
     f[sel] = 1 - f[sel]
     return f
 
+def _sheetCFGradient(r, sthick):
+    """Derivative of sheetCF with respect to sthick."""
+    if sthick <= 0: return [numpy.zeros_like(r)]
+
+    g = 0.5/r
+    sel = (r <= sthick)
+    g[sel] = -g[sel]
+    return [g]
+
+sheetCF.gradient = _sheetCFGradient
+
 def shellCF(r, radius, thickness):
     """Spherical shell characteristic function.
 
@@ -210,6 +373,15 @@ def shellCF(r, radius, thickness):
     a = 1.0*radius + d/2.0
     return shellCF2(r, a, d)
 
+def _shellCFGradient(r, radius, thickness):
+    """Derivatives of shellCF with respect to radius and thickness."""
+    d = 1.0*thickness
+    a = 1.0*radius + d/2.0
+    ga, gd = _shellCF2Gradient(r, a, d)
+    return [ga, 0.5*ga + gd]
+
+shellCF.gradient = _shellCFGradient
+
 def shellCF2(r, a, delta):
     """Spherical shell characteristic function.
 
@@ -242,6 +414,53 @@ def shellCF2(r, a, delta):
     f[zmask] = 1
     return f
 
+def _shellCF2Gradient(r, a, delta):
+    """Derivatives of shellCF2 with respect to a and delta."""
+    a = 1.0*a
+    d = 1.0*delta
+    a2 = a**2
+    d2 = d**2
+    dmr = d-r
+    dmr2 = dmr**2
+    s1 = sign(dmr)
+    s2 = sign(2*a-r)
+    s3 = sign(2*a-d-r)
+
+    f = r * (16*a*a2 + 12*a*d*dmr + 36*a2*(2*d-r) + 3*dmr2*(2*d+r)) \
+      + 2*dmr2 * (r*(2*d+r)-12*a2) * s1 \
+      - 2*(2*a-r)**2 * (r*(4*a+r)-3*d2) * s2 \
+      + r*(4*a-2*d+r)*(2*a-d-r)**2*s3
+
+    fa = r * (48*a2 + 12*d*dmr + 72*a*(2*d-r)) \
+      - 48*a*dmr2 * s1 \
+      - 8*(2*a-r) * ((r*(4*a+r)-3*d2) + r*(2*a-r)) * s2 \
+      + 4*r*(2*a-d-r) * ((2*a-d-r) + (4*a-2*d+r)) * s3
+
+    fd = r * (12*a*dmr + 12*a*d + 72*a2 + 6*dmr*(2*d+r) + 6*dmr2) \
+      + (4*dmr*(r*(2*d+r)-12*a2) + 4*r*dmr2) * s1 \
+      + 12*d*(2*a-r)**2 * s2 \
+      - 2*r*(2*a-d-r) * ((2*a-d-r) + (4*a-2*d+r)) * s3
+
+    den = 8.0*r*d*(12*a2+d2)
+    dena = 8.0*r*d*24*a
+    dend = 8.0*r*(12*a2+3*d2)
+
+    ga = numpy.zeros_like(f)
+    gd = numpy.zeros_like(f)
+    vmask = numpy.logical_and(den != 0.0, r <= 2*a+d)
+    den = den[vmask]
+    f = f[vmask]
+    ga[vmask] = (fa[vmask] - f*dena[vmask]/den) / den
+    gd[vmask] = (fd[vmask] - f*dend[vmask]/den) / den
+    return [ga, gd]
+
+shellCF2.gradient = _shellCF2Gradient
+
+for _f in (sphericalCF, spheroidalCF, spheroidalCF2, lognormalSphericalCF,
+        sheetCF, shellCF, shellCF2):
+    registerRule(_f, gradientRule)
+del _f
+
 
 class SASCF(Calculator):
     """Calculator class for characteristic functions from sas-models.
@@ -127,6 +127,8 @@ def speedTest2(mutate = 2):
     """
     factory.registerConstant("x", x)
     eq = factory.makeEquation(eqstr)
+    eqc = factory.makeEquation(eqstr)
+    eqc.setCompiled()
     eq.qsig.setValue(qsig)
     eq.sigma1.setValue(sigma)
     eq.sigma2.setValue(sigma)
@@ -147,6 +149,7 @@ def speedTest2(mutate = 2):
 
     tnpy = 0
     teq = 0
+    teqc = 0
     # Randomly change variables
     numargs = len(eq.args)
     choices = range(numargs)
@@ -169,12 +172,15 @@ def speedTest2(mutate = 2):
         # Time the different functions with these arguments
         tnpy += timeFunction(f, *args)
         teq += timeFunction(eq, *args)
+        teqc += timeFunction(eqc, *args)
 
     print "Average call time (%i calls, %i mutations/call):" % (numcalls,
             mutate)
     print "numpy: ", tnpy/numcalls
     print "equation: ", teq/numcalls
     print "ratio: ", teq/tnpy
+    print "compiled: ", teqc/numcalls
+    print "ratio: ", teqc/tnpy
 
     return
 
@@ -428,8 +434,443 @@ def profileTest():
 
     return
 
+def residualScalingTest(sizes = (250, 500, 1000, 2000, 4000), numcalls = 20):
+    """Show how FitRecipe.residual scales with the number of contributions.
+
+    Each contribution is a small linear model over 20 points. The time per
+    contribution should stay roughly constant as the number of contributions
+    grows.
+    """
+    from diffpy.srfit.fitbase import FitRecipe, FitContribution, Profile
+
+    xp = numpy.linspace(0, 1, 20)
+    print "%10s %12s %18s" % ("ncon", "ms/call", "us/contribution")
+    for ncon in sizes:
+        recipe = FitRecipe()
+        recipe.clearFitHooks()
+        for i in xrange(ncon):
+            profile = Profile()
+            profile.setObservedProfile(xp, i * xp)
+            con = FitContribution("c%i" % i)
+            con.setProfile(profile)
+            con.setEquation("m * x")
+            recipe.addContribution(con)
+            recipe.addVar(con.m, 1.0, name = "m%i" % i)
+
+        p = recipe.getValues()
+        recipe.residual(p)
+        t = 0
+        for _i in xrange(numcalls):
+            p = p + 0.1
+            t += timeFunction(recipe.residual, p)
+        t /= numcalls
+        print "%10i %12.3f %18.3f" % (ncon, t, 1000 * t / ncon)
+
+    return
+
+def blockJacobianTest(ncon = 40, npoints = 2000):
+    """Compare the block Jacobian with differentiating the full residual.
+
+    This creates a temperature series where each contribution has its own
+    peak parameters and all share a width.
+    """
+    from diffpy.srfit.fitbase import FitRecipe, FitContribution, Profile
+
+    xp = numpy.linspace(0, 10, npoints)
+    recipe = FitRecipe()
+    recipe.clearFitHooks()
+    recipe.newVar("sig", 0.5)
+    for i in xrange(ncon):
+        profile = Profile()
+        profile.setObservedProfile(xp, numpy.exp(-0.5*(xp - 5)**2))
+        con = FitContribution("c%i" % i)
+        con.setProfile(profile)
+        con.setEquation("A * exp(-0.5*(x - x0)**2/sig**2) + bg")
+        recipe.addContribution(con)
+        recipe.addVar(con.A, 1.0, name = "A%i" % i)
+        recipe.addVar(con.x0, 5.1, name = "x0%i" % i)
+        recipe.addVar(con.bg, 0.1, name = "bg%i" % i)
+        recipe.constrain(con.sig, "sig")
+    p = recipe.getValues()
+    recipe.residual(p)
+
+    def fullJacobian():
+        delta = 1e-8 * p
+        cols = []
+        for k in xrange(len(p)):
+            pk = p.copy()
+            pk[k] = p[k] + delta[k]
+            rk = recipe.residual(pk)
+            pk[k] = p[k] - delta[k]
+            rk -= recipe.residual(pk)
+            cols.append(rk / (2 * delta[k]))
+        recipe.residual(p)
+        return numpy.vstack(cols).T
+
+    from diffpy.srfit.util import instrumentation
+    tfull = timeFunction(fullJacobian)
+    instrumentation.resetCounts()
+    tblock = timeFunction(recipe.blockJacobian, p)
+    print "Jacobian of %i variables over %i contributions:" % (len(p), ncon)
+    print "full residual (ms): ", tfull
+    print "block (ms): ", tblock
+    print "ratio: ", tfull / tblock
+    print "constraint updates (evaluated/skipped): %i/%i" % (
+            instrumentation.getCount("constraint.updated"),
+            instrumentation.getCount("constraint.skipped"))
+    return
+
+def constraintBlockTest(natoms = 2000, numcalls = 20):
+    """Compare grouped affine constraints with individual constraint updates.
+
+    This mimics the position constraints of a P1 supercell expanded from a
+    single atom, with three constraints per atom.
+    """
+    from diffpy.srfit.fitbase import FitRecipe, FitContribution, Profile
+    from diffpy.srfit.fitbase.parameterset import ParameterSet
+
+    xp = numpy.linspace(0, 1, 20)
+    profile = Profile()
+    profile.setObservedProfile(xp, xp)
+    con = FitContribution("c")
+    con.setProfile(profile)
+    con.setEquation("m * x")
+
+    recipe = FitRecipe()
+    recipe.clearFitHooks()
+    recipe.addContribution(con)
+    recipe.addVar(con.m, 1.0)
+    for name in ("x", "y", "z"):
+        recipe.newVar(name, 0.1)
+    supercell = ParameterSet("supercell")
+    for i in xrange(natoms):
+        for name in ("x", "y", "z"):
+            par = supercell.newParameter("%s%i" % (name, i), 0)
+            recipe.constrain(par, "%s + %f" % (name, (i % 7) / 7.0))
+    recipe.addParameterSet(supercell)
+
+    p = recipe.getValues()
+    recipe.residual(p)
+
+    def timeResidual():
+        pk = p.copy()
+        t = 0
+        for _i in xrange(numcalls):
+            pk[1:] += 0.01
+            t += timeFunction(recipe.residual, pk)
+        return t / numcalls
+
+    tblock = timeResidual()
+    # Update the constraints individually
+    recipe._constraintupdates = list(recipe._oconstraints)
+    tsingle = timeResidual()
+    print "Residual with %i affine constraints:" % (3 * natoms)
+    print "individual (ms): ", tsingle
+    print "block (ms): ", tblock
+    print "ratio: ", tsingle / tblock
+    return
+
+def projectionTest(npoints = 5000, nterms = 40):
+    """Compare a fit with and without projecting the linear variables.
+
+    The profile is a scaled sum of Gaussians on a linear background. The
+    profile function is expensive compared to the scale and background.
+    """
+    from scipy.optimize import leastsq
+    from diffpy.srfit.fitbase import FitRecipe, FitContribution, Profile
+
+    xp = numpy.linspace(0, 10, npoints)
+    centers = numpy.linspace(1, 9, nterms)
+    ncalls = [0]
+    def peaks(x, sig):
+        ncalls[0] += 1
+        return sum(numpy.exp(-0.5*(x - c)**2/sig**2) for c in centers)
+
+    yobs = 2.5 * peaks(xp, 0.3) + 0.5 - 0.1*xp
+
+    def makeRecipe():
+        profile = Profile()
+        profile.setObservedProfile(xp, yobs)
+        con = FitContribution("c")
+        con.setProfile(profile)
+        con.registerFunction(peaks)
+        con.setEquation("scale * peaks(x, sig) + b0 + b1 * x")
+        recipe = FitRecipe()
+        recipe.clearFitHooks()
+        recipe.addContribution(con)
+        recipe.addVar(con.scale, 1)
+        recipe.addVar(con.sig, 0.25)
+        recipe.addVar(con.b0, 0)
+        recipe.addVar(con.b1, 0)
+        return recipe
+
+    print "%12s %10s %12s %8s" % ("mode", "ms", "profiles", "sig")
+    for project in (False, True):
+        recipe = makeRecipe()
+        if project:
+            recipe.project()
+        ncalls[0] = 0
+        t = timeFunction(leastsq, recipe.residual, recipe.getValues())
+        mode = "projected" if project else "full"
+        print "%12s %10.1f %12i %8.4f" % (mode, t, ncalls[0],
+                recipe.sig.value)
+    return
+
+def bufferReuseTest(npoints = 100000, numcalls = 50):
+    """Count the arrays allocated by ufunc Operators.
+
+    Before output buffers were reused, every ufunc evaluation allocated an
+    array, so the number of evaluations is the allocation count without
+    reuse.
+    """
+    from diffpy.srfit.equation.builder import EquationFactory
+    from diffpy.srfit.util import instrumentation
+
+    x = numpy.linspace(0, 20, npoints)
+    eqstr = """\
+    A0*exp(-(x*qsig)**2)*(exp(-((x-x1)/sigma1)**2)+exp(-((x-x2)/sigma2)**2))\
+    + b0 + b1*x + b2*x**2\
+    """
+    for compiled in (False, True):
+        factory = EquationFactory()
+        factory.registerConstant("x", x)
+        eq = factory.makeEquation(eqstr)
+        eq.setCompiled(compiled)
+        args = [1.0] * len(eq.args)
+        eq(*args)
+
+        instrumentation.resetCounts()
+        t = 0
+        for _i in xrange(numcalls):
+            args[random.randrange(len(args))] = random.random()
+            t += timeFunction(eq, *args)
+        allocated = instrumentation.getCount("operator.allocated")
+        reused = instrumentation.getCount("operator.reused")
+        print "%s equation, %i calls:" % (
+                "compiled" if compiled else "lazy", numcalls)
+        print "ufunc evaluations: ", allocated + reused
+        print "allocations: ", allocated
+        print "time (ms/call): ", t / numcalls
+    return
+
+def mergeTest(npoints = 100000, numcalls = 50):
+    """Time equations that share a subexpression, before and after merging.
+    """
+    from diffpy.srfit.equation.builder import EquationFactory
+    from diffpy.srfit.util import instrumentation
+
+    x = numpy.linspace(0, 20, npoints)
+    factory = EquationFactory()
+    factory.registerConstant("x", x)
+    damp = "exp(-0.5*(x*qdamp)**2)"
+    eqs = [factory.makeEquation("A%i*sin(k%i*x)*%s" % (i, i, damp))
+            for i in range(4)]
+    qdamp = eqs[0].qdamp
+
+    def evaluate():
+        qdamp.setValue(random.random())
+        for eq in eqs:
+            eq()
+        return
+
+    for merge in (False, True):
+        if merge:
+            print "merged nodes: ", factory.mergeCommonSubexpressions()
+        for eq in eqs:
+            for arg in eq.args:
+                arg.setValue(1.0)
+        instrumentation.resetCounts()
+        t = 0
+        for _i in xrange(numcalls):
+            t += timeFunction(evaluate)
+        evals = instrumentation.getCount("operator.allocated") + \
+                instrumentation.getCount("operator.reused")
+        print "%s: ufunc evaluations %i, time (ms/call) %f" % (
+                "merged" if merge else "unmerged", evals, t / numcalls)
+    return
+
+
+def invalidationTest(ncon = 100, nterms = 50, numcalls = 10):
+    """Compare the observer and version invalidation models.
+
+    Each contribution is a polynomial with nterms coefficients, all of which
+    are variables. The residual is timed after changing every variable, as in
+    an optimizer step, and after changing one variable, as in a finite
+    difference derivative.
+    """
+    from diffpy.srfit.fitbase import FitRecipe, FitContribution, Profile
+    from diffpy.srfit.equation.literals import setInvalidation
+
+    xp = numpy.linspace(0, 1, 20)
+    eqstr = " + ".join("b%i*x**%i" % (j, j) for j in xrange(nterms))
+    recipe = FitRecipe()
+    recipe.clearFitHooks()
+    for i in xrange(ncon):
+        profile = Profile()
+        profile.setObservedProfile(xp, xp)
+        con = FitContribution("c%i" % i)
+        con.setProfile(profile)
+        con.setEquation(eqstr)
+        recipe.addContribution(con)
+        for j in xrange(nterms):
+            recipe.addVar(getattr(con, "b%i" % j), 0.1,
+                    name = "b%i_%i" % (j, i))
+
+    print "Residual of %i variables (ms/call):" % len(recipe.getNames())
+    print "%10s %12s %12s" % ("model", "all changed", "one changed")
+    for model in ("observer", "version"):
+        setInvalidation(model, flush = True)
+        p = recipe.getValues()
+        recipe.residual(p)
+        tall = 0
+        tone = 0
+        for _i in xrange(numcalls):
+            p = p + 0.01
+            tall += timeFunction(recipe.residual, p)
+            p = p.copy()
+            p[random.randrange(len(p))] += 0.01
+            tone += timeFunction(recipe.residual, p)
+        print "%10s %12.3f %12.3f" % (model, tall / numcalls, tone / numcalls)
+    setInvalidation("observer", flush = True)
+    return
+
+
+def batchUpdateTest(natoms = 2000, numcalls = 10):
+    """Time setting many Parameters with and without coalescing.
+
+    This mimics a structure ParameterSet with three position Parameters per
+    atom. Each change is passed on through the ParameterSet, the
+    FitContribution and the FitRecipe.
+    """
+    from diffpy.srfit.fitbase import FitRecipe, FitContribution, Profile
+    from diffpy.srfit.fitbase.parameterset import ParameterSet
+    from diffpy.srfit.util import instrumentation
+
+    xp = numpy.linspace(0, 1, 20)
+    structure = ParameterSet("structure")
+    pars = [structure.newParameter("%s%i" % (name, i), 0.1)
+            for i in xrange(natoms) for name in ("x", "y", "z")]
+    profile = Profile()
+    profile.setObservedProfile(xp, xp)
+    con = FitContribution("c")
+    con.setProfile(profile)
+    con.addParameterSet(structure)
+    con.setEquation("s * x")
+    recipe = FitRecipe()
+    recipe.clearFitHooks()
+    recipe.addContribution(con)
+    recipe.addVar(con.s, 1.0)
+    recipe.residual()
+
+    def setAll(value):
+        for par in pars:
+            par.setValue(value)
+        return
+
+    def setBatch(value):
+        with recipe.batchUpdate():
+            setAll(value)
+        return
+
+    print "Setting %i Parameters (ms/call):" % len(pars)
+    for name, f in (("plain", setAll), ("batched", setBatch)):
+        t = 0
+        instrumentation.resetCounts()
+        for i in xrange(numcalls):
+            t += timeFunction(f, 0.2 + 0.01 * i)
+            recipe.residual()
+        print "%10s %12.3f" % (name, t / numcalls)
+    print "notifications deferred: ", instrumentation.getCount(
+            "notify.deferred") / numcalls
+    print "notifications coalesced: ", instrumentation.getCount(
+            "notify.coalesced") / numcalls
+    return
+
+def pathIndexTest(natoms = 3000, nlookups = 200):
+    """Time queries of a deep hierarchy of Parameters.
+
+    This mimics a structure ParameterSet with a ParameterSet of position and
+    displacement Parameters for each atom.
+    """
+    from diffpy.srfit.fitbase.parameterset import ParameterSet
+
+    structure = ParameterSet("structure")
+    for i in xrange(natoms):
+        atom = ParameterSet("atom%i" % i)
+        for name in ("x", "y", "z", "Uiso"):
+            atom.newParameter(name, 0.1)
+        structure.addParameterSet(atom)
+    phase = ParameterSet("phase")
+    phase.addParameterSet(structure)
+    pars = list(phase.iterPars())
+    targets = [pars[-1 - i] for i in xrange(nlookups)]
+
+    def iterate():
+        return len(list(phase.iterPars("Uiso")))
+
+    def locate():
+        for par in targets:
+            phase._locateManagedObject(par)
+        return
+
+    print "%i Parameters in %i ParameterSets (ms/call):" % (len(pars),
+            natoms + 2)
+    print "%10s %12.3f" % ("iterPars", timeFunction(iterate))
+    print "%10s %12.3f" % ("locate", timeFunction(locate) / nlookups)
+    # Adding an atom rebuilds the index on the next query
+    atom = ParameterSet("extra")
+    atom.newParameter("x", 0.1)
+    structure.addParameterSet(atom)
+    print "%10s %12.3f" % ("rebuild", timeFunction(phase.getPath, atom))
+    return
+
+def memoryTest(npars = 100000):
+    """Report the memory used per Parameter in a ParameterSet.
+
+    The memory is the growth of the peak resident size of the process, so
+    run this test on its own.
+    """
+    import gc
+    import resource
+    from diffpy.srfit.fitbase.parameter import ParameterAdapter
+    from diffpy.srfit.fitbase.parameterset import ParameterSet
+
+    class Atom(object):
+        def __init__(self):
+            self.x = 0.1
+            return
+
+    def peak():
+        # ru_maxrss is in kB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    atoms = [Atom() for i in xrange(npars)]
+    names = ["x%i" % i for i in xrange(npars)]
+    print "%18s %12s" % ("class", "bytes/par")
+    sets = []
+    for cls in ("Parameter", "ParameterAdapter"):
+        gc.collect()
+        m0 = peak()
+        parset = ParameterSet("structure")
+        if cls == "Parameter":
+            for name in names:
+                parset.newParameter(name, 0.1)
+        else:
+            for name, atom in zip(names, atoms):
+                parset.addParameter(ParameterAdapter(name, atom, attr = "x"))
+        sets.append(parset)
+        gc.collect()
+        print "%18s %12.0f" % (cls, float(peak() - m0) / npars)
+    return
+
 
 if __name__ == "__main__":
+    import sys
+    # Run the tests named on the command line, if any.
+    if len(sys.argv) > 1:
+        for name in sys.argv[1:]:
+            globals()[name]()
+        sys.exit()
     for i in range(1, 13):
         speedTest2(i)
     """
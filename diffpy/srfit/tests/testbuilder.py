@@ -194,6 +194,50 @@ class TestBuilder(unittest.TestCase):
         # Equation with partition
         return
 
+    def testMergeCommonSubexpressions(self):
+        """Test merging subexpressions shared by equations of a factory."""
+        from numpy import array_equal, exp
+        factory = builder.EquationFactory()
+        _r = numpy.arange(0, 5, 0.5)
+        factory.registerConstant("r", _r)
+        eq1 = factory.makeEquation("A * exp(-0.5*(r*qdamp)**2)")
+        eq2 = factory.makeEquation("B * exp(-0.5*(r*qdamp)**2) + 1")
+        eq1.A.setValue(2)
+        eq2.B.setValue(3)
+        eq2.qdamp.setValue(0.1)
+        f = lambda q : exp(-0.5*(_r*q)**2)
+        self.assertTrue(array_equal(2*f(0.1), eq1()))
+        self.assertFalse(eq1.root.args[1] is eq2.root.args[0].args[1])
+        # r*qdamp of both equations
+        rq = lambda damp : damp.args[0].args[1].args[0]
+        rq1 = rq(eq1.root.args[1])
+        rq2 = rq(eq2.root.args[0].args[1])
+        self.assertEquals(2, len(eq1.qdamp._observers))
+
+        # exp, **, *, *, and the constants -0.5 and 2 are shared
+        self.assertEquals(6, factory.mergeCommonSubexpressions())
+        self.assertEquals(0, factory.mergeCommonSubexpressions())
+        damp = eq1.root.args[1]
+        self.assertTrue(damp is eq2.root.args[0].args[1])
+        self.assertEquals(2, len(damp._observers))
+        # The replaced r*qdamp no longer observes qdamp
+        self.assertTrue(rq(damp) in (rq1, rq2))
+        replaced = rq2 if rq(damp) is rq1 else rq1
+        self.assertEquals(1, len(eq1.qdamp._observers))
+        self.assertFalse(replaced._flush in eq1.qdamp._observers)
+        self.assertEquals(["A", "qdamp"], eq1.argdict.keys())
+        self.assertTrue(array_equal(2*f(0.1), eq1()))
+        self.assertTrue(array_equal(3*f(0.1) + 1, eq2()))
+
+        # Changes are seen by both equations
+        eq1.qdamp.setValue(0.2)
+        self.assertTrue(array_equal(3*f(0.2) + 1, eq2()))
+        self.assertTrue(array_equal(2*f(0.2), eq1()))
+        eq2.qdamp.setValue(0.3)
+        self.assertTrue(array_equal(2*f(0.3), eq1()))
+        self.assertTrue(array_equal(3*f(0.3) + 1, eq2()))
+        return
+
     def testBuildEquation(self):
 
         from numpy import array_equal
@@ -143,6 +143,59 @@ class TestSASCF(testoptional(TestCaseSaS, TestCasePDF)):
         return
 
 
+class TestCFGradient(testoptional(TestCasePDF)):
+
+    def setUp(self):
+        global cf
+        import diffpy.srfit.pdf.characteristicfunctions as cf
+
+    def testGradients(self):
+        """Compare the gradients to central differences."""
+        r = numpy.arange(0.05, 40, 0.1)
+        cases = [
+                (cf.sphericalCF, (12.0,)),
+                (cf.spheroidalCF, (5.0, 8.0)),
+                (cf.spheroidalCF2, (10.0, 0.6)),
+                (cf.spheroidalCF2, (10.0, 1.7)),
+                (cf.lognormalSphericalCF, (15.0, 3.0)),
+                (cf.sheetCF, (7.02,)),
+                (cf.shellCF, (6.0, 4.0)),
+                (cf.shellCF2, (8.0, 3.0)),
+                ]
+        for f, pars in cases:
+            grad = f.gradient(r, *pars)
+            self.assertEqual(len(pars), len(grad))
+            for idx, g in enumerate(grad):
+                h = 1e-6 * pars[idx]
+                pp = list(pars)
+                pp[idx] += h
+                fp = f(r, *pp)
+                pp[idx] -= 2 * h
+                fm = f(r, *pp)
+                num = (fp - fm) / (2 * h)
+                self.assertTrue(numpy.allclose(num, g, atol = 1e-5),
+                        "%s %s" % (f.__name__, idx))
+        return
+
+    def testDifferentiate(self):
+        """Differentiate an equation that uses a characteristic function."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        from diffpy.srfit.equation.literals import Argument
+        factory = EquationFactory()
+        r = numpy.arange(0.05, 40, 0.1)
+        factory.registerArgument("r", Argument(name = "r", value = r))
+        factory.registerArgument("psize",
+                Argument(name = "psize", value = 12.0))
+        factory.registerFunction("sphericalCF", cf.sphericalCF,
+                ["r", "psize"])
+        eq = factory.makeEquation("2 * sphericalCF")
+        deq = eq.differentiate("psize")
+        grad = 2 * cf.sphericalCF.gradient(r, 12.0)[0]
+        self.assertTrue(numpy.allclose(grad, deq()))
+        self.assertRaises(ValueError, eq.differentiate, "r")
+        return
+
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -16,10 +16,11 @@
 
 import unittest
 
-from diffpy.srfit.fitbase.constraint import Constraint
+from diffpy.srfit.fitbase.constraint import Constraint, ConstraintBlock
 from diffpy.srfit.fitbase.recipeorganizer import equationFromString
 from diffpy.srfit.fitbase.parameter import Parameter
 from diffpy.srfit.equation.builder import EquationFactory
+from diffpy.srfit.util import instrumentation
 
 
 class TestConstraint(unittest.TestCase):
@@ -60,6 +61,143 @@ class TestConstraint(unittest.TestCase):
         self.assertEquals(16.2, p1.getValue())
         return
 
+    def testDirtyUpdate(self):
+        """Test that unchanged constraints are not re-evaluated."""
+        p1 = Parameter("p1", 1)
+        p2 = Parameter("p2", 2)
+        p3 = Parameter("p3", 3)
+
+        factory = EquationFactory()
+        factory.registerArgument("p1", p1)
+        factory.registerArgument("p2", p2)
+
+        c = Constraint()
+        eq = equationFromString("2*p2", factory)
+        c.constrain(p1, eq)
+        self.assertEquals(4, p1.getValue())
+
+        instrumentation.resetCounts()
+        c.update()
+        c.update()
+        self.assertEquals(2, instrumentation.getCount("constraint.skipped"))
+        self.assertEquals(0, instrumentation.getCount("constraint.updated"))
+
+        # A change to an unrelated parameter does not flag the constraint
+        p3.setValue(4)
+        c.update()
+        self.assertEquals(3, instrumentation.getCount("constraint.skipped"))
+
+        # A change to the equation does
+        p2.setValue(3)
+        c.update()
+        self.assertEquals(1, instrumentation.getCount("constraint.updated"))
+        self.assertEquals(6, p1.getValue())
+
+        # So does a change to the constrained parameter
+        p1.setValue(1)
+        c.update()
+        self.assertEquals(2, instrumentation.getCount("constraint.updated"))
+        self.assertEquals(6, p1.getValue())
+
+        # An unconstrained parameter is no longer observed
+        c.unconstrain()
+        p2.setValue(5)
+        self.assertEquals(6, p1.getValue())
+        self.assertFalse(p1._observers)
+        return
+
+    def testVersionedUpdate(self):
+        """Test updates in the version invalidation model."""
+        from diffpy.srfit.equation.literals import setInvalidation
+        p1 = Parameter("p1", 1)
+        p2 = Parameter("p2", 2)
+
+        factory = EquationFactory()
+        factory.registerArgument("p2", p2)
+
+        c = Constraint()
+        eq = equationFromString("2*(p2 + 1)", factory)
+        setInvalidation("version", flush = True)
+        try:
+            c.constrain(p1, eq)
+            self.assertEquals(6, p1.getValue())
+
+            instrumentation.resetCounts()
+            c.update()
+            self.assertEquals(1, instrumentation.getCount("constraint.skipped"))
+
+            # The equation does not notify, but its version changes
+            p2.setValue(3)
+            c.update()
+            self.assertEquals(8, p1.getValue())
+            self.assertEquals(1, instrumentation.getCount("constraint.updated"))
+        finally:
+            setInvalidation("observer", flush = True)
+        return
+
+    def testConstraintBlock(self):
+        """Test the ConstraintBlock class."""
+        x = Parameter("x", 1)
+        y = Parameter("y", 2)
+        k = Parameter("k", 3)
+        k.setConst()
+        pars = [Parameter("p%i" % i, 0) for i in range(3)]
+
+        factory = EquationFactory()
+        factory.registerArgument("x", x)
+        factory.registerArgument("y", y)
+        factory.registerArgument("k", k)
+
+        formulas = ["x + 0.5", "-y", "k*(x - y)*1.0/2"]
+        cons = []
+        for par, formula in zip(pars, formulas):
+            c = Constraint()
+            c.constrain(par, equationFromString(formula, factory))
+            cons.append(c)
+
+        block = ConstraintBlock(cons)
+        self.assertEquals((3, 2), block.matrix.shape)
+        self.assertEquals([x, y], block.args)
+
+        def check():
+            for c in cons:
+                self.assertAlmostEquals(c.eq(), c.par.getValue())
+            return
+
+        x.setValue(4)
+        y.setValue(-1)
+        block.update()
+        check()
+        self.assertEquals(4.5, pars[0].getValue())
+
+        # Nothing changed
+        instrumentation.resetCounts()
+        block.update()
+        self.assertEquals(3, instrumentation.getCount("constraint.skipped"))
+
+        # The block restores externally changed parameters
+        pars[1].setValue(10)
+        block.update()
+        check()
+
+        # The coefficients follow a change of a constant
+        k.setValue(5)
+        block.update()
+        check()
+        self.assertEquals(12.5, pars[2].getValue())
+
+        # Non-affine constraints are rejected
+        c = Constraint()
+        p = Parameter("p", 0)
+        c.constrain(p, equationFromString("x*y", factory))
+        self.assertRaises(ValueError, ConstraintBlock, [c])
+
+        block.release()
+        x.setValue(7)
+        block.update()
+        self.assertEquals(4.5, pars[0].getValue())
+        return
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -204,6 +204,61 @@ class TestContribution(unittest.TestCase):
 
         return
 
+    def testEvaluateBatch(self):
+        """Test the evaluation of the equation for many samples."""
+        import numpy
+        fc = self.fitcontribution
+        profile = self.profile
+        xobs = arange(0, 10, 0.5)
+        profile.setObservedProfile(xobs, xobs)
+        fc.setProfile(profile)
+
+        # A generator that depends on one of the sampled Parameters
+        class Generator(ProfileGenerator):
+            def __init__(self):
+                ProfileGenerator.__init__(self, "g")
+                self.newParameter("w", 1.0)
+            def __call__(self, x):
+                return numpy.exp(-(x/self.w.value)**2)
+        gen = Generator()
+        fc.addProfileGenerator(gen)
+
+        def gaussian(x, mu, sig):
+            return numpy.exp(-0.5*((x - mu)/sig)**2)
+        fc.registerFunction(gaussian, "peak", ["x", "mu", "sig"])
+        fc.registerFunction(lambda x, mu : float(mu)*x, "ramp", ["x", "mu"])
+        fc.setEquation("A*peak + convolve(peak, g) + ramp + polyval(list(A, "
+                "b), x)")
+        fc.A.setValue(2)
+        fc.b.setValue(1)
+        fc.mu.setValue(5)
+        fc.sig.setValue(1)
+
+        samples = numpy.array([[1.0, 4.0, 0.5, 1.0], [2.0, 5.0, 1.5, 2.0],
+            [3.0, 6.0, 2.5, 0.5]])
+        args = [fc.A, fc.mu, fc.sig, gen.w]
+        expected = []
+        for row in samples:
+            for arg, v in zip(args, row):
+                arg.setValue(v)
+            expected.append(fc.evaluate())
+        for arg, v in zip(args, [2, 5, 1, 1]):
+            arg.setValue(v)
+
+        values = fc.evaluate(samples, args)
+        self.assertEquals((3, len(xobs)), values.shape)
+        self.assertTrue(numpy.allclose(expected, values))
+        self.assertEquals([2, 5, 1, 1], [arg.value for arg in args])
+
+        # The Parameters of the equation other than the profile
+        self.assertEquals(["A", "mu", "sig", "b"],
+                [arg.name for arg in fc._eq.args if arg.name != "x"])
+        values = fc.evaluate([[2, 5, 1, 1], [2, 5, 1, 2]])
+        self.assertTrue(numpy.allclose(fc.evaluate(), values[0]))
+        self.assertTrue(numpy.allclose(values[0] + 1, values[1]))
+        self.assertRaises(ValueError, fc.evaluate, samples[:,:2])
+        return
+
 
 if __name__ == "__main__":
     unittest.main()
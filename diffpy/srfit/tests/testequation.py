@@ -185,6 +185,76 @@ class TestEquation(unittest.TestCase):
 
         return
 
+    def testCompiledEquation(self):
+        """Test evaluation in compiled mode."""
+
+        # Make some variables
+        v1, v2, v3, v4, c = _makeArgs(5)
+        c.name = "c"
+        c.const = True
+
+        # Make some operations
+        mult = literals.MultiplicationOperator()
+        mult2 = literals.MultiplicationOperator()
+        plus = literals.AdditionOperator()
+        minus = literals.SubtractionOperator()
+
+        # Create the equation c*(v1+v3)*(v4-v2)
+        plus.addLiteral(v1)
+        plus.addLiteral(v3)
+        minus.addLiteral(v4)
+        minus.addLiteral(v2)
+        mult.addLiteral(plus)
+        mult.addLiteral(minus)
+        mult2.addLiteral(mult)
+        mult2.addLiteral(c)
+        v1.setValue(1)
+        v2.setValue(2)
+        v3.setValue(3)
+        v4.setValue(4)
+        c.setValue(2.5)
+
+        eq = Equation("eq", mult2)
+        eq.setCompiled()
+        self.assertTrue(eq.compiled)
+        self.assertEqual(5, len(eq._program.leaves))
+        self.assertEqual(4, len(eq._program.code))
+
+        # Observers of the equation are notified of changes to the leaves
+        outer = Equation("outer", eq)
+        self.assertEqual(20, outer())
+        self.assertEqual(25, eq(v1=2))
+        self.assertEqual(25, outer())
+        v2.setValue(0)
+        self.assertTrue(eq._value is None)
+        self.assertTrue(outer._value is None)
+        self.assertEqual(50, outer())
+
+        # Only the affected instructions are stale
+        v4.setValue(1)
+        self.assertEqual([False, True, True, True], eq._program._stale)
+        self.assertEqual(12.5, eq())
+        c.setValue(1)
+        self.assertEqual(5, eq())
+
+        # Swapping rebuilds the program
+        eq.swap(v4, v3)
+        self.assertTrue(v4 not in eq._program.leaves)
+        self.assertEqual(15, eq()) # 1*(2+3)*(3-0)
+        v4.setValue(10)
+        self.assertTrue(eq._value is not None)
+        v3.setValue(2)
+        self.assertEqual(8, eq()) # 1*(2+2)*(2-0)
+
+        # Back to the lazy tree
+        eq.setCompiled(False)
+        self.assertTrue(eq._program is None)
+        self.assertTrue(eq._flushLeaf not in v1._observers)
+        self.assertEqual(8, eq())
+        v1.setValue(0)
+        self.assertEqual(4, eq())
+        return
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -14,14 +14,23 @@
 ##############################################################################
 """Tests for refinableobj module."""
 
+import gc
+import sys
+import threading
 import unittest
+import weakref
 
-from numpy import linspace, array_equal, pi, sin, dot
+import numpy
+from numpy import linspace, array, array_equal, pi, sin, dot
 
 from diffpy.srfit.fitbase.fitrecipe import FitRecipe
 from diffpy.srfit.fitbase.fitcontribution import FitContribution
 from diffpy.srfit.fitbase.profile import Profile
+from diffpy.srfit.fitbase.profilegenerator import ProfileGenerator
 from diffpy.srfit.fitbase.parameter import Parameter
+from diffpy.srfit.fitbase.parameterset import ParameterSet
+from diffpy.srfit.fitbase.constraint import ConstraintBlock
+from diffpy.srfit.exceptions import SrFitError
 
 class TestFitRecipe(unittest.TestCase):
 
@@ -140,6 +149,50 @@ class TestFitRecipe(unittest.TestCase):
         self.assertTrue(2 in values)
         return
 
+    def testFreePlan(self):
+        """Test the cached plan of free variables."""
+        recipe = self.recipe
+        con = self.fitcontribution
+
+        recipe.addVar(con.A, 2)
+        recipe.addVar(con.k, 1)
+        B = recipe.newVar("B", 0)
+
+        # The plan binds the variables to the underlying Parameters
+        recipe._prepareFree()
+        self.assertTrue(recipe._freepars[0] is con.A)
+        self.assertTrue(recipe._freepars[1] is con.k)
+        self.assertTrue(recipe._freepars[2] is B)
+        self.assertEquals([0, 1, 2], list(recipe._freeidx))
+
+        recipe._applyValues([3, 4, 5])
+        self.assertEquals(3, con.A.value)
+        self.assertEquals(4, con.k.value)
+        self.assertEquals(5, B.value)
+
+        # Each of these must invalidate the plan
+        recipe.fix("k")
+        self.assertEquals(["A", "B"], recipe.getNames())
+        self.assertEquals([0, 2], list(recipe._freeidx))
+        recipe._applyValues([6, 7])
+        self.assertEquals(6, con.A.value)
+        self.assertEquals(4, con.k.value)
+        self.assertEquals(7, B.value)
+        recipe.free("k")
+        self.assertEquals(["A", "k", "B"], recipe.getNames())
+        recipe.delVar(recipe.A)
+        self.assertEquals(["k", "B"], recipe.getNames())
+        recipe.addVar(con.c, 8)
+        self.assertEquals(["k", "B", "c"], recipe.getNames())
+        self.assertTrue((recipe.getValues() == [4, 7, 8]).all())
+        recipe.newVar("D", 9)
+        self.assertTrue((recipe.getValues() == [4, 7, 8, 9]).all())
+        recipe.constrain(B, "2*D")
+        self.assertEquals(["k", "c", "D"], recipe.getNames())
+        recipe.unconstrain(B)
+        self.assertEquals(["k", "B", "c", "D"], recipe.getNames())
+        return
+
     def testResidual(self):
         """Test the residual and everything that can change it."""
 
@@ -235,6 +288,604 @@ class TestFitRecipe(unittest.TestCase):
 
         return
 
+    def testResidualLayout(self):
+        """Test the residual of a recipe with several contributions."""
+        recipe = self.recipe
+        recipe.cont.c.setValue(1)
+        x = self.profile.x
+        res1 = sin(x+1) - self.profile.y
+
+        # Add a second contribution with a different number of points.
+        profile = Profile()
+        x2 = linspace(0, pi, 7)
+        profile.setObservedProfile(x2, 2*x2)
+        con2 = FitContribution("cont2")
+        con2.setProfile(profile)
+        con2.setEquation("m*x")
+        con2.m.setValue(1)
+        recipe.addContribution(con2, 4)
+        res2 = 2 * (x2 - 2*x2)
+
+        r1 = recipe.restrain(recipe.cont.c, 0, 0, 1)
+        res = recipe.residual()
+        self.assertEquals(10 + 7 + 1, len(res))
+        self.assertTrue( array_equal(res1, res[:10]) )
+        self.assertTrue( array_equal(res2, res[10:17]) )
+        self.assertAlmostEquals(1, res[17])
+
+        # Each call returns a new array
+        self.assertFalse(res is recipe.residual())
+
+        # Change the weight
+        recipe.setWeight(con2, 1)
+        res = recipe.residual()
+        self.assertTrue( array_equal(res2/2, res[10:17]) )
+
+        # Change the size of the first contribution
+        self.profile.setCalculationRange(xmax = x[5])
+        res = recipe.residual()
+        self.assertEquals(6 + 7 + 1, len(res))
+        self.assertTrue( array_equal(res1[:6], res[:6]) )
+        self.assertTrue( array_equal(res2/2, res[6:13]) )
+        self.assertAlmostEquals(1, res[13])
+        return
+
+    def testBlockJacobian(self):
+        """Test the Jacobian that only evaluates dependent contributions."""
+        recipe = self.recipe
+        con1 = self.fitcontribution
+
+        profile = Profile()
+        x2 = linspace(0, pi, 7)
+        profile.setObservedProfile(x2, 2*x2)
+        con2 = FitContribution("cont2")
+        con2.setProfile(profile)
+        con2.setEquation("m*x + b")
+        recipe.addContribution(con2, 4)
+
+        recipe.addVar(con1.A, 1.5)
+        recipe.addVar(con1.k, 0.9)
+        recipe.addVar(con2.m, 1.2)
+        recipe.newVar("c0", 0.2)
+        recipe.constrain(con1.c, "c0")
+        recipe.constrain(con2.b, "0.5 * c0")
+        resA = recipe.restrain(con1.A, 2, 3, 0.5)
+        resk = recipe.restrain("k", 0.5, 0.8, 0.1, scaled = True)
+
+        # Check the dependencies. The restraints are in creation order.
+        recipe._prepare()
+        self.assertEquals([resA, resk], recipe._restraintlist)
+        ia, ik = 0, 1
+        self.assertEquals(([0], [ia, ik]), recipe._getDependencies(con1.A))
+        self.assertEquals(([0], [ik]), recipe._getDependencies(con1.k))
+        self.assertEquals(([1], [ik]), recipe._getDependencies(con2.m))
+        self.assertEquals(([0, 1], [ik]),
+                recipe._getDependencies(recipe.c0))
+
+        # Compare to the central difference of the full residual
+        p = recipe.getValues()
+        m = len(recipe.residual())
+        J = recipe.blockJacobian(sparse = False)
+        self.assertEquals((m, 4), J.shape)
+        for k in range(4):
+            h = 1e-8 * p[k]
+            pk = p.copy()
+            pk[k] = p[k] + h
+            rk = recipe.residual(pk)
+            pk[k] = p[k] - h
+            rk -= recipe.residual(pk)
+            self.assertTrue(array_equal(rk/(2*h), J[:,k]))
+        self.assertEquals(0, J[10:17, 0].any())
+        self.assertEquals(0, J[:10, 2].any())
+        self.assertTrue(J[:17, 3].all())
+        self.assertEquals(0, J[17 + ia, 3])
+
+        Js = recipe.blockJacobian(p)
+        self.assertTrue(array_equal(J, Js.toarray()))
+        self.assertTrue(Js.nnz < J.size)
+        self.assertTrue(array_equal(p, recipe.getValues()))
+
+        # A variable with value 0 is stepped by the step size itself
+        p[3] = 0
+        J = recipe.blockJacobian(p, sparse = False)
+        self.assertTrue(numpy.isfinite(J).all())
+        self.assertTrue(numpy.allclose(recipe.jacobian(p)[:,3], J[:,3],
+            rtol = 1e-5, atol = 1e-7))
+        return
+
+    def testJacobian(self):
+        """Test the Jacobian with analytic derivatives."""
+        recipe = self.recipe
+        con1 = self.fitcontribution
+
+        profile = Profile()
+        x2 = linspace(0, pi, 7)
+        profile.setObservedProfile(x2, 2*x2)
+        con2 = FitContribution("cont2")
+        con2.setProfile(profile)
+        con2.setEquation("m*x + b")
+        recipe.addContribution(con2, 4)
+
+        # A generator that only knows the derivative by amp
+        class Generator(ProfileGenerator):
+            def __init__(self):
+                ProfileGenerator.__init__(self, "g")
+                self.newParameter("amp", 1.0)
+                self.newParameter("w", 1.0)
+            def __call__(self, x):
+                return self.amp.value * numpy.exp(-(x/self.w.value)**2)
+            def gradient(self, x, parnames):
+                g = numpy.exp(-(x/self.w.value)**2)
+                return [g if name == "amp" else None for name in parnames]
+        gen = Generator()
+        con2.addProfileGenerator(gen)
+        con2.setEquation("m*x + b + g")
+
+        recipe.addVar(con1.A, 1.5)
+        recipe.addVar(con1.k, 0.9)
+        recipe.addVar(con2.m, 1.2)
+        recipe.newVar("c0", 0.2)
+        recipe.constrain(con1.c, "c0")
+        recipe.constrain(con2.b, "0.5 * c0**2")
+        recipe.addVar(gen.amp, 0.5)
+        recipe.addVar(gen.w, 0.7)
+        resA = recipe.restrain(con1.A, 2, 3, 0.5)
+        resk = recipe.restrain("k", 0.5, 0.8, 0.1, scaled = True)
+
+        # Only the column of w uses finite differences
+        recipe._prepare()
+        chiv = recipe.residual()
+        cols = [recipe._analyticColumn(k, chiv) for k in range(6)]
+        self.assertEquals([True, True, True, True, True, False],
+                [col is not None for col in cols])
+
+        p = recipe.getValues()
+        J = recipe.jacobian()
+        self.assertEquals((len(chiv), 6), J.shape)
+        Jn = recipe.blockJacobian(step = 1e-6, sparse = False)
+        self.assertTrue(numpy.allclose(J, Jn, atol = 1e-7))
+        self.assertTrue(numpy.allclose(J, recipe.jacobian(analytic = False),
+            atol = 1e-7))
+        # The restraints follow the contributions
+        ia = 17 + recipe._restraintlist.index(resA)
+        ik = 17 + recipe._restraintlist.index(resk)
+        self.assertNotEquals(0, J[ia, 0])
+        self.assertEquals(0, J[ia, 1])
+        self.assertNotEquals(0, J[ik, 1])
+        self.assertTrue(array_equal(p, recipe.getValues()))
+
+        # The derivatives follow the values
+        p[0] = 2.5
+        p[4] = 2.0
+        J = recipe.jacobian(p)
+        Jn = recipe.jacobian(p, step = 1e-7, steprule = "absolute",
+                analytic = False)
+        self.assertTrue(numpy.allclose(J, Jn, atol = 1e-6))
+        self.assertEquals(0, J[ia, 0])
+        self.assertRaises(ValueError, recipe.jacobian, steprule = "none")
+        return
+
+    def testJacobianDual(self):
+        """Test the Jacobian of registered functions with dual numbers."""
+        recipe = self.recipe
+        con1 = self.fitcontribution
+        con1.registerFunction(lambda x, w : numpy.exp(-(w*x)**2), "g",
+                ["x", "w"])
+        con1.setEquation("A*sin(k*x + c)*g")
+
+        # A function that breaks dual numbers
+        con2 = FitContribution("cont2")
+        con2.setProfile(self.profile)
+        con2.registerFunction(lambda x, v : numpy.i0(v*x), "h", ["x", "v"])
+        con2.setEquation("h")
+        recipe.addContribution(con2)
+
+        recipe.addVar(con1.A, 1.5)
+        recipe.addVar(con1.k, 0.9)
+        recipe.addVar(con1.w, 0.3)
+        recipe.addVar(con2.v, 0.2)
+
+        # The function that breaks dual numbers uses finite differences
+        recipe._prepare()
+        chiv = recipe.residual()
+        cols = [recipe._analyticColumn(k, chiv) for k in range(4)]
+        self.assertEquals([True, True, True, False],
+                [col is not None for col in cols])
+        J = recipe.jacobian()
+        self.assertTrue(numpy.allclose(J, recipe.jacobian(analytic = False),
+            atol = 1e-7))
+        return
+
+    def testEvaluatePopulation(self):
+        """Test the evaluation of many variable vectors."""
+        from diffpy.srfit.fitbase.recipepool import RecipePool
+        import threading
+        recipe = self.recipe
+        con = self.fitcontribution
+
+        # A generator that cannot be pickled, like those that wrap C++
+        # calculators
+        class Generator(ProfileGenerator):
+            def __init__(self):
+                ProfileGenerator.__init__(self, "g")
+                self.newParameter("w", 1.0)
+                self.lock = threading.Lock()
+            def __call__(self, x):
+                with self.lock:
+                    return numpy.exp(-(x/self.w.value)**2)
+        gen = Generator()
+        con.addProfileGenerator(gen)
+        con.setEquation("A*sin(k*x + c) + g")
+        recipe.addVar(con.A, 1.5)
+        recipe.addVar(con.k, 0.9)
+        recipe.addVar(gen.w, 0.7)
+        recipe.restrain("k", 0.5, 0.8, 0.1)
+
+        P = [[1.0, 1.0, 0.5], [2.0, 0.7, 1.0], [0.5, 1.2, 2.0]]
+        p0 = recipe.getValues()
+        expected = [recipe.residual(p) for p in P]
+        recipe.residual(p0)
+
+        chiv = recipe.evaluatePopulation(P, output = "chiv")
+        self.assertTrue(numpy.allclose(expected, chiv))
+        chi2 = recipe.evaluatePopulation(P)
+        self.assertTrue(numpy.allclose([dot(r, r) for r in expected], chi2))
+        self.assertTrue(array_equal(p0, recipe.getValues()))
+
+        pool = RecipePool(recipe, 2)
+        try:
+            # The workers are reused
+            for i in range(2):
+                self.assertTrue(numpy.allclose(chi2,
+                    recipe.evaluatePopulation(P, pool)))
+            self.assertTrue(numpy.allclose(chiv,
+                recipe.evaluatePopulation(P, pool, "chiv")))
+            self.assertRaises(ValueError, recipe.evaluatePopulation,
+                    [[1.0, 2.0]], pool)
+            self.assertRaises(ValueError, recipe.evaluatePopulation, P,
+                    pool, "chi")
+            recipe.fix("w")
+            self.assertRaises(SrFitError, recipe.evaluatePopulation,
+                    [[1.0, 2.0]], pool)
+        finally:
+            pool.close()
+        self.assertRaises(SrFitError, pool.map, P)
+        self.assertRaises(ValueError, recipe.evaluatePopulation, P,
+                RecipePool(FitRecipe(), 1))
+        return
+
+    def testConstraintOrder(self):
+        """Test the ordering of dependent constraints."""
+        recipe = self.recipe
+        con = self.fitcontribution
+
+        recipe.newVar("c0", 2)
+        con.constrain(con.c, "A * k")
+        con.constrain(con.A, "k + 1")
+        recipe.constrain(con.k, "c0")
+        recipe._prepare()
+
+        levels = [[c.par for c in level] for level in recipe._constraintlevels]
+        self.assertEquals([[con.k], [con.A], [con.c]], levels)
+        self.assertEquals([con.k, con.A, con.c],
+                [c.par for c in recipe._oconstraints])
+
+        recipe.residual([3])
+        self.assertEquals(3, con.k.getValue())
+        self.assertEquals(4, con.A.getValue())
+        self.assertEquals(12, con.c.getValue())
+
+        # Break the chain with a cycle
+        recipe.unconstrain(con.k)
+        con.constrain(con.k, "c")
+        self.assertRaises(SrFitError, recipe._prepare)
+        return
+
+    def testConstrainedVariableOrder(self):
+        """Test constraints that depend on a constrained variable."""
+        recipe = self.recipe
+        con = self.fitcontribution
+        con.newParameter("b", 0)
+
+        recipe.addVar(con.A)
+        recipe.newVar("D", 1)
+        recipe.constrain("A", "2*D")
+        recipe.constrain(con.b, "A + 1")
+        recipe._prepare()
+        levels = [[c.par for c in level] for level in recipe._constraintlevels]
+        self.assertEquals([[recipe.A], [con.b]], levels)
+
+        recipe.residual([5])
+        self.assertEquals(10, con.A.getValue())
+        self.assertEquals(11, con.b.getValue())
+        return
+
+    def testConstraintBlocks(self):
+        """Test the grouping of affine constraints."""
+        recipe = self.recipe
+        con = self.fitcontribution
+
+        recipe.newVar("c0", 2)
+        recipe.constrain(con.k, "2*c0 - 1")
+        recipe.constrain(con.A, "c0/4")
+        recipe.constrain(con.c, "sin(c0)")
+        recipe._prepare()
+
+        updates = recipe._constraintupdates
+        self.assertEquals(2, len(updates))
+        self.assertTrue(updates[0] is recipe._constraints[con.c])
+        self.assertTrue(isinstance(updates[1], ConstraintBlock))
+        self.assertEquals(set([con.k, con.A]), set(updates[1].pars))
+
+        recipe.residual([3])
+        self.assertEquals(5, con.k.getValue())
+        self.assertEquals(0.75, con.A.getValue())
+        self.assertEquals(sin(3), con.c.getValue())
+
+        # Rebuilding the blocks releases the old ones
+        recipe.unconstrain(con.A)
+        recipe._prepare()
+        self.assertFalse(updates[1]._flush in recipe.c0._observers)
+        self.assertEquals([recipe._constraints[con.c],
+            recipe._constraints[con.k]], recipe._constraintupdates)
+        return
+
+    def testChainedAffineConstraints(self):
+        """Test affine constraints that depend on each other."""
+        from diffpy.srfit.fitbase.fitrecipe import _blockConstraints
+        recipe = self.recipe
+        con = self.fitcontribution
+        con.newParameter("b", 0)
+
+        recipe.addVar(con.A)
+        recipe.newVar("D", 1)
+        recipe.constrain("A", "2*D")
+        recipe.constrain(con.b, "A + 1")
+        recipe._prepare()
+        self.assertFalse([obj for obj in recipe._constraintupdates
+            if isinstance(obj, ConstraintBlock)])
+
+        recipe.residual([5])
+        self.assertEquals(10, con.A.getValue())
+        self.assertEquals(11, con.b.getValue())
+        recipe.residual([2])
+        self.assertEquals(4, con.A.getValue())
+        self.assertEquals(5, con.b.getValue())
+
+        # A level that mixes the chain is updated in order
+        cons = [recipe._constraints[con.b], recipe._constraints[recipe.A]]
+        self.assertEquals(cons[::-1], _blockConstraints(cons))
+        return
+
+    def testProjection(self):
+        """Test solving linear variables by least squares."""
+        recipe = self.recipe
+        con = self.fitcontribution
+
+        profile = Profile()
+        x2 = linspace(0, 1, 5)
+        profile.setObservedProfile(x2, 3 - 2*x2)
+        con2 = FitContribution("cont2")
+        con2.setProfile(profile)
+        con2.setEquation("polyval(list(b1, b0), x)")
+        recipe.addContribution(con2)
+
+        recipe.addVar(con.A, 2)
+        recipe.addVar(con.k, 1.1)
+        recipe.addVar(con.c, 0.1)
+        recipe.addVar(con2.b0, 1)
+        recipe.addVar(con2.b1, 1)
+
+        recipe.project()
+        self.assertEquals(["k", "c"], recipe.getNames())
+        self.assertTrue(recipe.isProjected(recipe.A))
+        self.assertTrue(recipe.isProjected(recipe.b0))
+        self.assertTrue(recipe.isProjected(recipe.b1))
+
+        chiv = recipe.residual([1, 0])
+        self.assertAlmostEquals(0, dot(chiv, chiv))
+        self.assertAlmostEquals(1, recipe.A.value)
+        self.assertAlmostEquals(3, recipe.b0.value)
+        self.assertAlmostEquals(-2, recipe.b1.value)
+
+        # The solved variables minimize the residual
+        p = array([1.1, 0.1])
+        chi2 = dot(recipe.residual(p), recipe.residual(p))
+        A = recipe.A.value
+        recipe.unproject("A")
+        self.assertEquals(["A", "k", "c"], recipe.getNames())
+        for dA in [-1e-4, 1e-4]:
+            chiv = recipe.residual([A + dA, 1.1, 0.1])
+            self.assertTrue(chi2 < dot(chiv, chiv))
+
+        # The Jacobians account for the projected variables
+        recipe.project("A")
+        recipe.residual(p)
+        J = recipe.blockJacobian(p, sparse = False)
+        J2 = recipe.jacobian(p)
+        for k in range(2):
+            h = 1e-6
+            pk = p.copy()
+            pk[k] = p[k] + h
+            rk = recipe.residual(pk)
+            pk[k] = p[k] - h
+            rk -= recipe.residual(pk)
+            self.assertTrue(numpy.allclose(rk/(2*h), J[:,k], atol = 1e-6))
+            self.assertTrue(numpy.allclose(rk/(2*h), J2[:,k], atol = 1e-6))
+        # The analytic derivative with A held fixed differs
+        recipe.unproject("A")
+        dA = recipe.jacobian([A] + list(p))[:,1:]
+        self.assertFalse(numpy.allclose(dA, J2, atol = 1e-6))
+        recipe.project("A")
+
+        # Nonlinear variables cannot be projected
+        recipe.project("k")
+        self.assertRaises(SrFitError, recipe.residual, [0.1])
+        recipe.unproject("k")
+        recipe.constrain(con.c, "2*b0")
+        self.assertRaises(SrFitError, recipe.residual, [1.1])
+        return
+
+    def testFold(self):
+        """Test folding the invariant parts of the equations."""
+        recipe = self.recipe
+        con = self.fitcontribution
+        con.setEquation("A*sin(k*x + c)")
+        con.setResidualEquation("resv")
+        recipe.addVar(con.A, 2)
+        recipe.addVar(con.k, 1)
+        recipe.addVar(con.c, 0)
+        p = array([1.5, 1.2, 0.1])
+        res = recipe.residual(p)
+
+        # The recipe compiles the equations
+        self.assertTrue(con._eq.compiled)
+        self.assertTrue(con._reseq.compiled)
+        x = self.profile.x
+        y = self.profile.y
+        self.assertTrue(numpy.allclose(res,
+            (1.5 * sin(1.2*x + 0.1) - y) / dot(y, y)**0.5))
+        # sum(y**2)**0.5 is a leaf of the residual program
+        program = con._reseq._program
+        self.assertEquals(2, len(program.code))
+        self.assertEquals(4, len(con._eq._program.code))
+
+        # Fixing a variable folds its subtrees
+        recipe.fix("k")
+        self.assertTrue(array_equal(res, recipe.residual([1.5, 0.1])))
+        self.assertEquals(3, len(con._eq._program.code))
+        # Folded subtrees still see changes
+        recipe.k.setValue(1.3)
+        res = (1.5 * sin(1.3*x + 0.1) - y) / dot(y, y)**0.5
+        self.assertTrue(numpy.allclose(res, recipe.residual([1.5, 0.1])))
+        recipe.free("k")
+        self.assertTrue(numpy.allclose(res, recipe.residual([1.5, 1.3, 0.1])))
+        self.assertEquals(4, len(con._eq._program.code))
+        return
+
+    def testMergeCommonSubexpressions(self):
+        """Test merging subexpressions shared by contributions."""
+        recipe = self.recipe
+        con = self.fitcontribution
+        con.setEquation("A*sin(k*x + c) + sin(k*c)")
+
+        profile = Profile()
+        x2 = linspace(0, 1, 5)
+        profile.setObservedProfile(x2, 3 - 2*x2)
+        con2 = FitContribution("cont2")
+        con2.setProfile(profile)
+        con2.setEquation("m*x + sin(k*c)", ns = {"k" : con.k, "c" : con.c})
+        con2.m.setValue(2)
+        recipe.addContribution(con2)
+        recipe.addVar(con.k, 1.1)
+        recipe.addVar(con.c, 0.1)
+
+        p1 = array([1.2, 0.3])
+        p2 = array([0.7, 0.2])
+        res1 = recipe.residual(p1)
+        res2 = recipe.residual(p2)
+
+        # sin(k*c) is shared. The factory of con also merges with the
+        # equation from setUp.
+        self.assertTrue(recipe.mergeCommonSubexpressions() >= 2)
+        self.assertEquals(0, recipe.mergeCommonSubexpressions())
+        self.assertTrue(con._eq.root.args[1] is con2._eq.root.args[1])
+        self.assertTrue(array_equal(res1, recipe.residual(p1)))
+        self.assertTrue(array_equal(res2, recipe.residual(p2)))
+        return
+
+    def testDispose(self):
+        """Test detaching a recipe from a shared ParameterSet."""
+        recipe = self.recipe
+        con = self.fitcontribution
+        phase = ParameterSet("phase")
+        phase.addParameter(Parameter("a", 1.0))
+        phase.addParameter(Parameter("b", 2.0))
+        con.addParameterSet(phase)
+        recipe.addVar(phase.a)
+        recipe.constrain(phase.b, "2 * a")
+        recipe.restrain("a", lb = 0)
+        recipe.scalarResidual()
+        self.assertTrue(phase.b.constrained)
+
+        recipe.dispose()
+        self.assertFalse(phase.b.constrained)
+        self.assertEqual([], recipe.getNames())
+        self.assertEqual([], list(recipe.iterPars()))
+        self.assertFalse(recipe._restraints)
+        self.assertFalse(recipe._flush in con._observers)
+        self.assertFalse(recipe._flush in phase.a._observers)
+
+        # The parts can be used by another recipe
+        recipe2 = FitRecipe("recipe2")
+        recipe2.clearFitHooks()
+        recipe2.addContribution(con)
+        recipe2.addVar(phase.a)
+        recipe2.constrain(phase.b, "3 * a")
+        phase.a.setValue(2.0)
+        recipe2.scalarResidual()
+        self.assertEqual(6, phase.b.value)
+        return
+
+    def testRecipesAreFreed(self):
+        """Test that recipes sharing a ParameterSet are freed."""
+        phase = ParameterSet("phase")
+        phase.addParameter(Parameter("a", 1.0))
+        observers = set(phase.a._observers)
+        refs = []
+        for i in xrange(10000):
+            recipe = FitRecipe()
+            con = FitContribution("con")
+            con.addParameterSet(phase)
+            con.setEquation("a * x", ns = {"a" : phase.a})
+            recipe.addContribution(con)
+            recipe.addVar(phase.a)
+            refs.append(weakref.ref(recipe))
+        del recipe, con
+        gc.collect()
+        self.assertEqual([], [ref for ref in refs if ref() is not None])
+        self.assertEqual(observers, set(phase.a._observers))
+        self.assertFalse(phase._observers)
+        self.assertFalse(phase._indexparents)
+        return
+
+    def testThreads(self):
+        """Test that threads update their own recipes."""
+        x = self.profile.x
+        y = self.profile.y
+        errors = []
+
+        def run(c0):
+            recipe = FitRecipe("recipe")
+            recipe.clearFitHooks()
+            con = FitContribution("cont")
+            con.setProfile(self.profile)
+            con.setEquation("A*sin(k*x + c)")
+            con.A.setValue(1)
+            con.k.setValue(1)
+            recipe.addContribution(con)
+            recipe.addVar(con.c, c0)
+            for i in xrange(200):
+                c = c0 + 0.01 * i
+                res = recipe.residual([c])
+                if not numpy.allclose(sin(x + c) - y, res):
+                    errors.append((c0, i))
+            return
+
+        # Switch threads as often as possible
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            threads = [threading.Thread(target = run, args = (c0,))
+                    for c0 in (1, 2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assertEqual([], errors)
+        return
 
 if __name__ == "__main__":
     unittest.main()
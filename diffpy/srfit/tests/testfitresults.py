@@ -16,11 +16,219 @@
 
 import unittest
 
+import numpy
+
 from diffpy.srfit.fitbase.fitrecipe import FitRecipe
-from diffpy.srfit.fitbase.fitresults import initializeRecipe
+from diffpy.srfit.fitbase.fitcontribution import FitContribution
+from diffpy.srfit.fitbase.profile import Profile
+from diffpy.srfit.fitbase.fitresults import FitResults, initializeRecipe
+from diffpy.srfit.fitbase.fithook import FitHook
 from diffpy.srfit.tests.utils import datafile
 
 
+class TestFitResults(unittest.TestCase):
+
+    def setUp(self):
+        self.recipe = recipe = FitRecipe("recipe")
+        recipe.fithooks[0].verbose = 0
+
+        profile = Profile()
+        x = numpy.linspace(0, 10, 50)
+        y = 2.0 * numpy.exp(-0.5 * (x - 4.8)**2 / 1.1**2)
+        profile.setObservedProfile(x, y, 0.1 + 0 * x)
+
+        con = FitContribution("cont")
+        con.setProfile(profile)
+        con.setEquation("A * exp(-0.5 * (x - x0)**2 / sig**2) + b")
+        recipe.addContribution(con)
+        recipe.addVar(con.A, 1.9)
+        recipe.addVar(con.x0, 5.0)
+        recipe.addVar(con.sig, 1.0)
+        recipe.newVar("b0", 0.1)
+        recipe.constrain(con.b, "2 * b0 * sig")
+        return
+
+    def testParallelJacobian(self):
+        """Check that the parallel Jacobian equals the serial one."""
+        recipe = self.recipe
+        p0 = recipe.getValues()
+        res0 = recipe.residual()
+
+        serial = FitResults(recipe, update = False)
+        serial.update()
+        J = serial._calculateJacobian()
+        dcon = serial._dcon
+        self.assertEquals((50, 4), J.shape)
+        self.assertEquals((1, 4), dcon.shape)
+        self.assertAlmostEquals(2 * recipe.sig.value, dcon[0, 3])
+        self.assertAlmostEquals(2 * recipe.b0.value, dcon[0, 2])
+
+        # The recipe is left at the evaluation point
+        self.assertTrue(numpy.array_equal(p0, recipe.getValues()))
+        self.assertTrue(numpy.array_equal(res0, recipe.residual()))
+
+        for threads in (False, True):
+            results = FitResults(recipe, update = False)
+            results.parallel(2, threads = threads)
+            results.update()
+            self.assertTrue(numpy.array_equal(serial.cov, results.cov))
+            self.assertTrue(numpy.array_equal(J,
+                results._calculateJacobian()))
+            self.assertTrue(numpy.array_equal(dcon, results._dcon))
+            self.assertEquals(serial.conunc, results.conunc)
+            self.assertTrue(numpy.array_equal(p0, recipe.getValues()))
+            results.parallel(1)
+            self.assertTrue(results.pool is None)
+        return
+
+    def testJacobianWorkers(self):
+        """Check the reuse and the fallbacks of the parallel workers."""
+        import threading
+        from diffpy.srfit.fitbase.recipepool import RecipePool
+        recipe = self.recipe
+        serial = FitResults(recipe)
+
+        # The worker processes are kept between updates
+        results = FitResults(recipe, update = False)
+        results.parallel(2)
+        results.update()
+        pool = results.pool
+        self.assertTrue(pool is not None)
+        results.update()
+        self.assertTrue(pool is results.pool)
+        self.assertTrue(numpy.array_equal(serial.cov, results.cov))
+        results.parallel(1)
+        self.assertTrue(pool._pool is None)
+
+        # A pool of the caller is not closed
+        pool = RecipePool(recipe, 2)
+        try:
+            results.parallel(4, pool = pool)
+            self.assertEquals(2, results.ncpu)
+            results.update()
+            self.assertTrue(numpy.array_equal(serial.cov, results.cov))
+            results.parallel(1)
+            self.assertTrue(pool._pool is not None)
+        finally:
+            pool.close()
+        pool = RecipePool(FitRecipe(), 1)
+        try:
+            self.assertRaises(ValueError, results.parallel, 2, pool = pool)
+        finally:
+            pool.close()
+
+        # A recipe that cannot be copied is differentiated serially
+        recipe.lock = threading.Lock()
+        results.parallel(2, threads = True)
+        results.update()
+        self.assertTrue(numpy.array_equal(serial.cov, results.cov))
+        self.assertEquals(1, len([m for m in results.messages
+            if "serially" in m]))
+        return
+
+    def testZeroVariable(self):
+        """Check the derivatives by a variable with value 0."""
+        recipe = self.recipe
+        recipe.b0.setValue(0)
+        results = FitResults(recipe)
+        self.assertTrue(numpy.isfinite(results.cov).all())
+        self.assertTrue(numpy.isfinite(results._dcon).all())
+        self.assertAlmostEquals(2 * recipe.sig.value, results._dcon[0, 3])
+        self.assertTrue(results.varunc[3] > 0)
+        return
+
+    def testCorrelationOrder(self):
+        """Check that equal correlations are listed by variable index."""
+        results = FitResults(self.recipe)
+        # corr(A, sig) and corr(x0, b0) equal 0.5, corr(A, x0) is -0.9
+        results.cov = numpy.array([
+            [1.0, -0.9, 0.5, 0.0],
+            [-0.9, 1.0, 0.0, 0.5],
+            [0.5, 0.0, 1.0, 0.0],
+            [0.0, 0.5, 0.0, 1.0]])
+        lines = results.formatResults().splitlines()
+        corrs = [l.split()[:2] for l in lines if l.startswith("corr(")]
+        self.assertEqual([["corr(A,", "x0)"], ["corr(A,", "sig)"],
+            ["corr(x0,", "b0)"]], corrs)
+        return
+
+    def testOptimizerJacobian(self):
+        """Check the use of a Jacobian passed from the optimizer."""
+        recipe = self.recipe
+        p0 = recipe.getValues()
+        serial = FitResults(recipe)
+        J = serial._calculateJacobian()
+        chiv = recipe.residual()
+
+        # Count the residual evaluations
+        counter = FitHook()
+        counter.count = 0
+        def precall(recipe):
+            counter.count += 1
+        counter.precall = precall
+        recipe.pushFitHook(counter)
+        recipe._prepare()
+
+        results = FitResults(recipe, jacobian = J, chiv = chiv, p = p0)
+        self.assertEquals(0, counter.count)
+        self.assertTrue(numpy.array_equal(serial.cov, results.cov))
+        self.assertTrue(numpy.array_equal(serial._dcon, results._dcon))
+        self.assertEquals(serial.conunc, results.conunc)
+        self.assertEquals(serial.residual, results.residual)
+        self.assertEquals(serial.rw, results.rw)
+        self.assertTrue(numpy.array_equal(p0, recipe.getValues()))
+
+        # Check the inputs
+        results = FitResults(recipe, update = False)
+        self.assertRaises(ValueError, results.update, J, chiv, p0 + 1)
+        self.assertRaises(ValueError, results.update, J[:, 1:], chiv, p0)
+        self.assertRaises(ValueError, results.update, J, chiv[1:], p0)
+
+        # Output from another point cannot be used
+        recipe.sig.setValue(1.2)
+        self.assertRaises(ValueError, results.update, J, chiv)
+        self.assertRaises(ValueError, results.update, J)
+        self.assertRaises(ValueError, results.update, chiv = chiv)
+        self.assertRaises(ValueError, results.update, J, chiv, p0)
+        results.update()
+        self.assertFalse(numpy.array_equal(serial.cov, results.cov))
+        return
+
+    def testProjectedVariable(self):
+        """Check the results of a recipe with a projected variable."""
+        recipe = self.recipe
+        recipe.project("A")
+        self.assertEquals(["x0", "sig", "b0"], recipe.getNames())
+        p0 = recipe.getValues()
+        chiv = recipe.residual(p0)
+        A = recipe.A.value
+
+        results = FitResults(recipe, jacobian = numpy.ones((50, 3)),
+                chiv = chiv, p = p0)
+        self.assertEquals(["A", "x0", "sig", "b0"], results.varnames)
+        self.assertEquals(A, results.varvals[0])
+        self.assertEquals(4, len(results.varunc))
+        self.assertTrue(results.varunc[0] > 0)
+        self.assertEquals([], results.fixednames)
+        self.assertAlmostEquals(results.chi2 / (50 - 4), results.rchi2)
+
+        # The results equal those of the unprojected recipe at the solution
+        recipe.unproject("A")
+        unprojected = FitResults(recipe)
+        self.assertEquals(unprojected.varnames, results.varnames)
+        self.assertTrue(numpy.allclose(unprojected.varunc, results.varunc))
+        self.assertTrue(numpy.allclose(unprojected.conunc, results.conunc))
+        self.assertAlmostEquals(unprojected.rchi2, results.rchi2)
+
+        # The variable is projected afterwards
+        recipe.project("A")
+        results.update()
+        self.assertTrue(recipe.isProjected(recipe.A))
+        self.assertEquals(["x0", "sig", "b0"], recipe.getNames())
+        self.assertTrue(numpy.array_equal(p0, recipe.getValues()))
+        return
+
+
 class TestInitializeRecipe(unittest.TestCase):
 
     def setUp(self):
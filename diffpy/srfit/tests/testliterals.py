@@ -15,11 +15,14 @@
 """Tests for refinableobj module."""
 
 import unittest
+import pickle
+import weakref
 
 import numpy
 
 import diffpy.srfit.equation.literals as literals
 import diffpy.srfit.equation.literals.abcs as abcs
+from diffpy.srfit.util import instrumentation
 
 
 class TestArgument(unittest.TestCase):
@@ -140,6 +143,193 @@ class TestOperator(unittest.TestCase):
 
         return
 
+    def testBufferReuse(self):
+        """Test reuse of the output array of a ufunc operator."""
+        op = literals.Operator(symbol = "*", operation = numpy.multiply,
+                nin = 2)
+        a = literals.Argument(value = numpy.arange(5.0))
+        b = literals.Argument(value = 2.0)
+        op.addLiteral(a)
+        op.addLiteral(b)
+        neg = literals.NegationOperator()
+        neg.addLiteral(op)
+
+        # The buffer of op is only read by neg, so it is reused
+        instrumentation.resetCounts()
+        self.assertTrue(numpy.array_equal([0, -2, -4, -6, -8], neg.value))
+        buf = op._buffer
+        b.setValue(3.0)
+        self.assertTrue(numpy.array_equal([0, -3, -6, -9, -12], neg.value))
+        self.assertTrue(buf is op._buffer)
+        self.assertTrue(numpy.array_equal([0, 3, 6, 9, 12], buf))
+        self.assertEqual(1, instrumentation.getCount("operator.reused"))
+        # The value of neg was handed out, so it is not reused
+        self.assertTrue(neg._buffer is None)
+        self.assertEqual(3, instrumentation.getCount("operator.allocated"))
+
+        # A value that was handed out is never overwritten, no matter how
+        # many references to it exist
+        v = op.getValue()
+        self.assertTrue(op._buffer is None)
+        w = v
+        b.setValue(4.0)
+        self.assertTrue(numpy.array_equal([0, -4, -8, -12, -16], neg.value))
+        self.assertTrue(numpy.array_equal([0, 3, 6, 9, 12], w))
+        self.assertFalse(op._buffer is v)
+        del v, w
+
+        # A change of shape gives a new array
+        buf = op._buffer
+        a.setValue(numpy.arange(3.0))
+        self.assertTrue(numpy.array_equal([0, -4, -8], neg.value))
+        self.assertFalse(buf is op._buffer)
+        return
+
+    def testProgramBufferReuse(self):
+        """Test reuse of the slot values of a compiled equation."""
+        from diffpy.srfit.equation import Equation
+        a = literals.Argument(value = numpy.arange(3.0))
+        b = literals.Argument(value = 2.0)
+        mult = literals.MultiplicationOperator()
+        mult.addLiteral(a)
+        mult.addLiteral(b)
+        plus = literals.AdditionOperator()
+        plus.addLiteral(mult)
+        plus.addLiteral(b)
+        lst = literals.ListOperator()
+        lst.addLiteral(plus)
+        lst.addLiteral(mult)
+        eq = Equation(root = lst)
+        eq.setCompiled()
+        first = eq()
+        self.assertTrue(numpy.array_equal([2, 4, 6], first[0]))
+
+        # The list holds on to the values of plus and mult, so they are not
+        # reused
+        b.setValue(3.0)
+        second = eq()
+        self.assertTrue(numpy.array_equal([2, 4, 6], first[0]))
+        self.assertTrue(numpy.array_equal([0, 2, 4], first[1]))
+        self.assertTrue(numpy.array_equal([3, 6, 9], second[0]))
+
+        # Slots only read by ufuncs are reused, the result is not
+        eq.setRoot(plus)
+        eq.setCompiled()
+        program = eq._program
+        self.assertEqual([True, False], program._reuse)
+        x = eq()
+        b.setValue(4.0)
+        self.assertTrue(numpy.array_equal([3, 6, 9], x))
+        self.assertTrue(numpy.array_equal([4, 8, 12], eq()))
+        return
+
+    def testVersions(self):
+        """Test the version invalidation model."""
+        from diffpy.srfit.equation import Equation
+        a = literals.Argument(value = 1.0)
+        b = literals.Argument(value = 2.0)
+        c = literals.Argument(value = numpy.arange(3.0))
+        plus = literals.AdditionOperator()
+        plus.addLiteral(a)
+        plus.addLiteral(b)
+        mult = literals.MultiplicationOperator()
+        mult.addLiteral(plus)
+        mult.addLiteral(c)
+        eq = Equation(root = mult)
+        eqc = Equation(root = mult)
+        eqc.setCompiled()
+        self.assertTrue(numpy.array_equal([0, 3, 6], mult.value))
+
+        self.assertEqual("observer", literals.getInvalidation())
+        self.assertRaises(ValueError, literals.setInvalidation, "lazy")
+        # The model is not switched while Operators hold cached values
+        self.assertRaises(ValueError, literals.setInvalidation, "version")
+        self.assertEqual("observer", literals.getInvalidation())
+        literals.setInvalidation("version", flush = True)
+        self.assertTrue(mult._value is None)
+        try:
+            self.assertTrue(numpy.array_equal([0, 3, 6], mult.value))
+            # The change only reaches the Operator that observes a
+            version = mult.getVersion()
+            a.setValue(2.0)
+            self.assertTrue(plus._value is None)
+            self.assertFalse(mult._value is None)
+            self.assertTrue(mult.getVersion() > version)
+            self.assertTrue(numpy.array_equal([0, 4, 8], mult.value))
+            self.assertTrue(numpy.array_equal([0, 4, 8], eq()))
+            self.assertTrue(numpy.array_equal([0, 4, 8], eqc()))
+            version = mult.getVersion()
+            self.assertEqual(version, eq.getVersion())
+
+            # Arrays are compared by identity
+            x = c.value
+            c.setValue(x)
+            self.assertEqual(version, mult.getVersion())
+            c.setValue(x.copy())
+            self.assertTrue(mult.getVersion() > version)
+
+            # An Equation within a compiled Equation
+            outer = Equation(root = eq)
+            outer.setCompiled()
+            self.assertTrue(numpy.array_equal([0, 4, 8], outer()))
+            b.setValue(3.0)
+            self.assertTrue(numpy.array_equal([0, 5, 10], outer()))
+            self.assertTrue(numpy.array_equal([0, 5, 10], eqc()))
+            a.setValue(1.0)
+            self.assertRaises(ValueError, literals.setInvalidation,
+                    "observer")
+        finally:
+            literals.setInvalidation("observer", flush = True)
+
+        # Values cached in the version model are discarded
+        self.assertTrue(mult._value is None)
+        self.assertTrue(numpy.array_equal([0, 4, 8], mult.value))
+        self.assertTrue(numpy.array_equal([0, 4, 8], eqc()))
+        a.setValue(2.0)
+        self.assertTrue(numpy.array_equal([0, 5, 10], eq()))
+        self.assertTrue(numpy.array_equal([0, 5, 10], eqc()))
+
+        # Unused trees do not prevent a switch
+        del a, b, c, plus, mult, eq, eqc, outer
+        literals.setInvalidation("version")
+        literals.setInvalidation("observer")
+        return
+
+    def testWeakObservers(self):
+        """Test that Operators do not stay alive by observing Literals."""
+        a = literals.Argument(name = "a", value = 1.0)
+        op = literals.AdditionOperator()
+        op.addLiteral(a)
+        op.addLiteral(a)
+        self.assertTrue(op._flush in a._observers)
+        self.assertEqual(2, op.value)
+        a.setValue(2.0)
+        self.assertEqual(4, op.value)
+
+        # Observers survive pickling
+        a2, op2 = pickle.loads(pickle.dumps((a, op), 2))
+        self.assertTrue(op2._flush in a2._observers)
+        a2.setValue(3.0)
+        self.assertEqual(6, op2.value)
+
+        # The weak observer is dropped once the Operator is freed
+        ref = weakref.ref(op)
+        del op, op2
+        self.assertTrue(ref() is None)
+        self.assertFalse(a._observers)
+        a.setValue(1.0)
+
+        # Strong observers keep their instance alive
+        op = literals.AdditionOperator()
+        a.addObserver(op._flush, weak = False)
+        ref = weakref.ref(op)
+        del op
+        self.assertFalse(ref() is None)
+        a.removeObserver(ref()._flush)
+        self.assertFalse(a._observers)
+        return
+
+
 class TestConvolutionOperator(unittest.TestCase):
 
     def testValue(self):
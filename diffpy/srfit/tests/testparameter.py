@@ -48,6 +48,27 @@ class TestParameter(unittest.TestCase):
         self.assertAlmostEqual(1.01, l.value)
         return
 
+    def testCompact(self):
+        """Test the slots, the bounds and pickling."""
+        import pickle
+        from numpy import inf
+        l = Parameter("l", 3.14)
+        self.assertFalse(hasattr(l, "__dict__"))
+        self.assertTrue(l._observers is None)
+        self.assertTrue(l._bounds is None)
+        self.assertEqual([-inf, inf], l.bounds)
+        l.setValue(2.0, lb = 1.0)
+        self.assertEqual([1.0, inf], l.bounds)
+        l.boundWindow(0.5)
+        self.assertEqual([1.5, 2.5], l.bounds)
+
+        for protocol in (0, 2):
+            l2 = pickle.loads(pickle.dumps(l, protocol))
+            self.assertEqual("l", l2.name)
+            self.assertEqual(2.0, l2.value)
+            self.assertEqual([1.5, 2.5], l2.bounds)
+        return
+
 class TestParameterProxy(unittest.TestCase):
 
     def testProxy(self):
@@ -110,6 +131,7 @@ class TestParameterAdapter(unittest.TestCase):
         # Change the adapter
         la.setValue(3.2)
         self.assertEqual(l.getValue(), la.getValue())
+        self.assertFalse(hasattr(la, "__dict__"))
 
         return
 
@@ -149,6 +149,44 @@ class TestRecipeContainer(unittest.TestCase):
 
         return
 
+    def testPathIndex(self):
+        """Test the path index of the hierarchy."""
+        m1 = self.m
+        p1 = Parameter("p1", 1)
+        m1._addObject(p1, m1._parameters)
+        m2 = RecipeContainer("m2")
+        m2._containers = {}
+        m2._manage(m2._containers)
+        p2 = Parameter("p2", 2)
+        m2._addObject(p2, m2._parameters)
+        m1._addObject(m2, m1._containers)
+
+        self.assertEqual("m2.p2", m1.getPath(p2))
+        self.assertTrue(m1.getByPath("m2.p2") is p2)
+        self.assertEqual([p1, p2], list(m1.iterPars()))
+        self.assertEqual([p2], list(m1.iterPars("p2")))
+
+        # The index follows changes deeper in the hierarchy
+        m3 = RecipeContainer("m3")
+        p3 = Parameter("p3", 3)
+        m3._addObject(p3, m3._parameters)
+        m2._addObject(m3, m2._containers)
+        self.assertEqual([m1, m2, m3, p3], m1._locateManagedObject(p3))
+        self.assertEqual(["m2.m3", "m2.m3.p3"],
+                [path for path, obj in m1.iterPaths(r"m2\.m3")])
+        self.assertEqual([p1, p2, p3], list(m1.iterPars()))
+
+        m3._removeObject(p3, m3._parameters)
+        self.assertEqual([], m1._locateManagedObject(p3))
+        self.assertTrue(m1.getByPath("m2.m3.p3") is None)
+        self.assertEqual(None, m1.getPath(p3))
+
+        m2._removeObject(m3, m2._containers)
+        self.assertFalse(m3._indexparents)
+        m3._addObject(p3, m3._parameters)
+        self.assertEqual([p1, p2], list(m1.iterPars()))
+        return
+
 class TestRecipeOrganizer(unittest.TestCase):
 
     def setUp(self):
@@ -176,6 +214,48 @@ class TestRecipeOrganizer(unittest.TestCase):
 
         return
 
+    def testBatchUpdate(self):
+        """Test the coalescing of notifications."""
+        from diffpy.srfit.util import instrumentation
+        m = self.m
+        p1 = m._newParameter("p1", 1)
+        p2 = m._newParameter("p2", 2)
+        p3 = m._newParameter("p3", 3)
+        eq = m.registerStringFunction("p1 + p2 * p3", "eq")
+        self.assertEquals(7, eq())
+
+        calls = []
+        def observer(other):
+            calls.append(other[0])
+        m.addObserver(observer)
+        eq.root.addObserver(observer)
+        instrumentation.resetCounts()
+        with m.batchUpdate():
+            p1.setValue(2)
+            with m.batchUpdate():
+                p2.setValue(3)
+            p3.setValue(4)
+            p1.setValue(3)
+            self.assertEquals([], calls)
+        # The organizer and the root are notified once
+        self.assertEquals(2, len(calls))
+        self.assertEquals(15, eq())
+        # The Parameters, the organizer, the Operators and the Equation
+        self.assertEquals(7, instrumentation.getCount("notify.deferred"))
+        # p1 is notified twice and the organizer by each Parameter
+        self.assertEquals(3, instrumentation.getCount("notify.coalesced"))
+
+        # Notifications are sent if the block fails
+        try:
+            with m.batchUpdate():
+                p2.setValue(1)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEquals(4, len(calls))
+        self.assertEquals(7, eq())
+        return
+
     def testAddParameter(self):
         """Test the addParameter method."""
 
@@ -108,6 +108,27 @@ class TestTagManager(unittest.TestCase):
         self.assertFalse(m.hasTags(3, "fail"))
         return
 
+    def test_reverse_index(self):
+        """check that the object index follows tagging and untagging
+        """
+        m = self.m
+        m.tag(3, "3", "number")
+        m.tag(4, "number")
+        self.assertEqual(set(["3", "number"]), m._objdict[3])
+        m.untag(3, "number")
+        self.assertEqual(set(["3"]), m._objdict[3])
+        self.assertTrue(m.hasTags(4, "number"))
+        self.assertFalse(m.hasTags(3, "number"))
+        m.untag(3)
+        self.assertFalse(3 in m._objdict)
+        self.assertEqual([], m.tags(3))
+        self.assertTrue(m.hasTags(4, "number"))
+        # The union does not share the sets of the manager
+        objs = m.union("number")
+        objs.add(5)
+        self.assertEqual(set([4]), m.union("number"))
+        return
+
 # End of class TestTagManager
 
 if __name__ == '__main__':
@@ -18,6 +18,8 @@ import diffpy.srfit.equation.visitors as visitors
 import diffpy.srfit.equation.literals as literals
 import unittest
 
+import numpy
+
 from diffpy.srfit.tests.utils import _makeArgs
 
 class TestValidator(unittest.TestCase):
@@ -203,6 +205,305 @@ class TestSwapper(unittest.TestCase):
 
         return
 
+class TestAffineFinder(unittest.TestCase):
+
+    def testAffine(self):
+        """Test the coefficients of affine equations."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        factory = EquationFactory()
+
+        eq = factory.makeEquation("2*a - (b + 1)/4 + 3*a + -b*0.5")
+        eq.a.setValue(1.0)
+        eq.b.setValue(2.0)
+        coefs, offset = visitors.getAffine(eq)
+        coefs = [(arg.name, c) for arg, c in coefs]
+        self.assertEquals([("a", 5.0), ("b", -0.75)], coefs)
+        self.assertEquals(-0.25, offset)
+        self.assertAlmostEqual(eq(), 5.0 - 1.5 - 0.25)
+
+        # Constants are folded into the offset
+        eq = factory.makeEquation("a + sin(0)*2 + 1.5")
+        eq.a.setValue(1.0)
+        coefs, offset = visitors.getAffine(eq)
+        self.assertEquals(1, len(coefs))
+        self.assertEquals(1.5, offset)
+        return
+
+    def testNotAffine(self):
+        """Test equations that are not affine."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        factory = EquationFactory()
+
+        for eqstr in ["a*b", "1/a", "a**2", "sin(a)", "a/(b-b)"]:
+            eq = factory.makeEquation(eqstr)
+            for arg in eq.args:
+                arg.setValue(1.0)
+            self.assertTrue(visitors.getAffine(eq) is None, eqstr)
+
+        # Arrays are not affine
+        eq = factory.makeEquation("2*a")
+        eq.a.setValue(numpy.arange(3.0))
+        self.assertTrue(visitors.getAffine(eq) is None)
+        return
+
+class TestFolder(unittest.TestCase):
+
+    def testFolded(self):
+        """Test finding the invariant subtrees."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        factory = EquationFactory()
+
+        eq = factory.makeEquation("(a*x - y)/sum(y**2)**0.5 + exp(b*c)")
+        for arg in eq.args:
+            arg.setValue(1.0)
+        def show(literal):
+            printer = visitors.Printer()
+            literal.identify(printer)
+            return printer.output
+
+        folded = visitors.getFolded(eq, [eq.a])
+        self.assertEquals(["(sum((y ** 2)) ** 0.5)", "exp((b * c))"],
+                map(show, folded))
+
+        folded = visitors.getFolded(eq, [eq.a, eq.y])
+        self.assertEquals(["exp((b * c))"], map(show, folded))
+
+        # Invariant trees fold at the root
+        folded = visitors.getFolded(eq, [])
+        self.assertEquals([eq], folded)
+        self.assertEquals([], visitors.getFolded(eq.a, []))
+        return
+
+class TestDifferentiator(unittest.TestCase):
+
+    def testDerivatives(self):
+        """Test derivatives against central differences."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        factory = EquationFactory()
+        factory.registerConstant("x", numpy.linspace(0.1, 3, 7))
+        values = {"A" : 1.3, "k" : 0.7, "c" : 0.4, "q" : 0.2}
+
+        eqstrs = ["A*sin(k*x + c)*exp(-0.5*(x*q)**2)",
+                "(A - x)/sum(x**2)**0.5 + sum(A + x)",
+                "polyval(list(A, k, c), x)",
+                "A**k + sqrt(c*x)/q - log(k)*tanh(A*x) + x**A",
+                "arctan(k)*arccos(c/10)/cos(A) + -q"]
+        for eqstr in eqstrs:
+            eq = factory.makeEquation(eqstr)
+            for arg in eq.args:
+                arg.setValue(values[arg.name])
+            for arg in eq.args:
+                deq = eq.differentiate(arg.name)
+                v = arg.value
+                h = 1e-6
+                arg.setValue(v + h)
+                d = eq()
+                arg.setValue(v - h)
+                d -= eq()
+                arg.setValue(v)
+                self.assertTrue(numpy.allclose(d / (2*h), deq(), rtol = 1e-6),
+                        "d(%s)/d%s" % (eqstr, arg.name))
+
+        # The derivative follows changes of the Arguments
+        eq = factory.makeEquation("A*exp(k*x)")
+        eq.A.setValue(2)
+        eq.k.setValue(0.5)
+        deq = eq.differentiate(eq.k)
+        x = factory.builders["x"].literal.value
+        self.assertTrue(numpy.allclose(x * eq(), deq()))
+        eq.k.setValue(-0.5)
+        self.assertTrue(numpy.allclose(2 * x * numpy.exp(-0.5*x), deq()))
+
+        # Constant derivatives
+        deq = eq.differentiate(factory.makeEquation("b").b)
+        self.assertEquals(0, deq())
+        return
+
+    def testFallback(self):
+        """Test the fallback rule for Operators without a rule."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        factory = EquationFactory()
+        factory.registerFunction("f", lambda a, b : a * b**2, ["a", "b"])
+        eq = factory.makeEquation("3*f + c")
+        a = factory.builders["a"].literal
+        b = factory.builders["b"].literal
+        a.setValue(2)
+        b.setValue(3)
+        eq.c.setValue(1)
+
+        self.assertRaises(ValueError, eq.differentiate, a)
+        self.assertEquals(1, eq.differentiate("c")())
+
+        # The fallback gets the derivatives of the arguments of f
+        def fallback(op, dargs):
+            self.assertTrue(op.args == [a, b])
+            da, db = dargs
+            self.assertEquals(1, da.value)
+            self.assertTrue(db is None)
+            return literals.Argument(value = b.value**2, const = True)
+        deq = eq.differentiate(a, fallback)
+        self.assertEquals(27, deq())
+        return
+
+    def testGradientRule(self):
+        """Test the rule for functions with a gradient."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        from diffpy.srfit.equation.visitors import registerRule, gradientRule
+        def f(x, a, b):
+            return x * a * b**2
+        f.gradient = lambda x, a, b : [x * b**2, 2 * x * a * b]
+        registerRule(f, gradientRule)
+
+        factory = EquationFactory()
+        factory.registerFunction("f", f, ["x", "a", "b"])
+        eq = factory.makeEquation("f")
+        x = factory.builders["x"].literal
+        a = factory.builders["a"].literal
+        b = factory.builders["b"].literal
+        x.setValue(numpy.arange(3.0))
+        a.setValue(2)
+        b.setValue(3)
+        self.assertTrue(numpy.array_equal([0, 9, 18], eq.differentiate(a)()))
+        self.assertTrue(numpy.array_equal([0, 12, 24], eq.differentiate(b)()))
+        self.assertRaises(ValueError, eq.differentiate, x)
+        return
+
+    def testDualRule(self):
+        """Test the rule for functions evaluated with dual numbers."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        from diffpy.srfit.equation.visitors import dualRule
+        factory = EquationFactory()
+        factory.registerFunction("f", lambda x, a : numpy.exp(-a * x**2),
+                ["x", "a"])
+        eq = factory.makeEquation("A*f")
+        factory.builders["x"].literal.setValue(numpy.arange(3.0))
+        a = factory.builders["a"].literal
+        a.setValue(0.5)
+        eq.A.setValue(2)
+
+        def fallback(op, dargs):
+            return dualRule(op, dargs)
+        deq = eq.differentiate(a, fallback)
+        x = numpy.arange(3.0)
+        expected = -2 * x**2 * numpy.exp(-0.5 * x**2)
+        self.assertTrue(numpy.allclose(expected, deq()))
+        a.setValue(1.0)
+        expected = -2 * x**2 * numpy.exp(-x**2)
+        self.assertTrue(numpy.allclose(expected, deq()))
+        return
+
+class TestDualEvaluator(unittest.TestCase):
+
+    def testDerivatives(self):
+        """Test derivatives against the symbolic derivatives."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        factory = EquationFactory()
+        factory.registerConstant("x", numpy.linspace(0.1, 3, 7))
+        factory.registerFunction("g",
+                lambda x, w : numpy.sum(x * numpy.tanh(w * x)), ["x", "w"])
+        values = {"A" : 1.3, "k" : 0.7, "c" : 0.4, "q" : 0.2, "w" : 0.6}
+
+        eqstrs = ["A*sin(k*x + c)*exp(-0.5*(x*q)**2)",
+                "(A - x)/sum(x**2)**0.5 + sum(A + x)",
+                "polyval(list(A, k, c), x)",
+                "A**k + sqrt(c*x)/q - log(k)*tanh(A*x) + x**A",
+                "arctan(k)*arccos(c/10)/cos(A) + -q",
+                "A*g + k"]
+        for eqstr in eqstrs:
+            eq = factory.makeEquation(eqstr)
+            for arg in eq.args:
+                arg.setValue(values[arg.name])
+            value, derivs = eq.autodiff()
+            self.assertTrue(numpy.allclose(eq(), value))
+            self.assertEquals(len(eq.args), len(derivs))
+            for arg, d in zip(eq.args, derivs):
+                deq = eq.differentiate(arg, visitors.dualRule)
+                self.assertTrue(numpy.allclose(deq(), d),
+                        "d(%s)/d%s" % (eqstr, arg.name))
+
+        # Some of the Arguments
+        eq = factory.makeEquation("A*exp(k*x)")
+        eq.A.setValue(2)
+        eq.k.setValue(0.5)
+        x = factory.builders["x"].literal.value
+        value, derivs = eq.autodiff(["k"])
+        self.assertEquals((1, 7), derivs.shape)
+        self.assertTrue(numpy.allclose(x * value, derivs[0]))
+        value, derivs = eq.autodiff([factory.makeEquation("b").b])
+        self.assertTrue(numpy.array_equal(numpy.zeros((1, 7)), derivs))
+        return
+
+    def testBrokenPropagation(self):
+        """Test functions that do not propagate dual numbers."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        factory = EquationFactory()
+        factory.registerFunction("f", lambda a : float(a)**2, ["a"])
+        factory.registerFunction("g", numpy.i0, ["a"])
+        a = factory.builders["a"].literal
+        a.setValue(2.0)
+        for eqstr in ["f", "g", "convolve(list(a, 1), list(1, 2))"]:
+            eq = factory.makeEquation(eqstr)
+            self.assertRaises(ValueError, eq.autodiff, [a])
+            # The regular evaluation is not affected
+            eq()
+
+        # Operators that do not depend on the seeds are not evaluated
+        eq = factory.makeEquation("f + b")
+        eq.b.setValue(1.0)
+        self.assertEquals([1.0], list(eq.autodiff()[1]))
+
+        # Other Operators need the fallback
+        class Generator(literals.Operator):
+            pass
+        eq = factory.makeEquation("b*h")
+        op = Generator("h", "h", lambda : 3.0, 0)
+        eq.swap(eq.h, op)
+        self.assertRaises(ValueError, eq.autodiff)
+        fallback = lambda op, values : op.getValue()
+        self.assertEquals([3.0], list(eq.autodiff(["b"], fallback)[1]))
+        return
+class TestBatchEvaluator(unittest.TestCase):
+
+    def testBroadcast(self):
+        """Test that samples are broadcast through the tree."""
+        from diffpy.srfit.equation.builder import EquationFactory
+        from diffpy.srfit.equation.batch import Batch
+        factory = EquationFactory()
+        x = numpy.linspace(0, 3, 5)
+        factory.registerConstant("x", x)
+        calls = []
+        def f(x, a):
+            calls.append(a)
+            return numpy.sum(x * a) * numpy.sin(a * x)
+        factory.registerFunction("f", f, ["x", "a"])
+        factory.registerFunction("g", lambda a : float(a)**2, ["a"])
+        eq = factory.makeEquation("A*f + g + sum(x)")
+        a = factory.builders["a"].literal
+        a.setValue(1.0)
+        eq.A.setValue(2.0)
+
+        samples = numpy.array([[1.0, 0.5], [2.0, 1.0], [3.0, 1.5]])
+        value = visitors.getBatchValue(eq, [eq.A, a], samples)
+        self.assertTrue(isinstance(value, Batch))
+        # f broadcasts the samples, g is called for each
+        self.assertEquals(1, len(calls))
+        for row, v in zip(samples, value.data):
+            A, av = row
+            expected = A * numpy.sum(x * av) * numpy.sin(av * x) + av**2 + \
+                    numpy.sum(x)
+            self.assertTrue(numpy.allclose(expected, v))
+
+        # The Arguments keep their values
+        values = eq.evaluateBatch(samples, [eq.A, a])
+        self.assertTrue(numpy.allclose(value.data, values))
+        self.assertEquals(2.0, eq.A.value)
+        self.assertEquals(1.0, a.value)
+
+        # Invariant equations
+        values = eq.evaluateBatch(samples[:,:1], [factory.makeEquation("b").b])
+        self.assertTrue(numpy.allclose([eq()] * 3, values))
+        return
+
 
 if __name__ == "__main__":
     unittest.main()
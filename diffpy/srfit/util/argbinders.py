@@ -23,6 +23,9 @@ class bind2nd(object):
     '''Freeze second argument of a callable object to a given constant.
     '''
 
+    # bind2nd is used by every ParameterAdapter, so keep it small.
+    __slots__ = ("func", "arg1")
+
     def __init__(self, func, arg1):
         """Freeze the second argument of function func to arg1.
         """
@@ -30,6 +33,13 @@ class bind2nd(object):
         self.arg1 = arg1
         return
 
+    def __getstate__(self):
+        return (self.func, self.arg1)
+
+    def __setstate__(self, state):
+        self.func, self.arg1 = state
+        return
+
     def __call__(self, *args, **kwargs):
         boundargs = ((args[0], self.arg1) + args[1:])
         return self.func(*boundargs, **kwargs)
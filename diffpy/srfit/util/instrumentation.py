@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+########################################################################
+#
+# diffpy.srfit      by DANSE Diffraction group
+#                   Simon J. L. Billinge
+#                   (c) 2026 The Trustees of Columbia University
+#                   in the City of New York.  All rights reserved.
+#
+# See AUTHORS.txt for a list of people who contributed.
+# See LICENSE_DANSE.txt for license information.
+#
+########################################################################
+
+"""Counters for profiling the work done during a refinement.
+
+The counters are identified by name and are shared by the whole process. Code
+that wants to record an event calls 'increment'. The counters can be read with
+'getCount' or 'getCounts' and cleared with 'resetCounts'.
+
+Counters in use:
+constraint.updated  --  Number of Constraint updates that evaluated the
+                        constraint equation.
+constraint.skipped  --  Number of Constraint updates that were skipped because
+                        no input of the constraint changed.
+operator.reused     --  Number of ufunc evaluations that wrote into a reused
+                        output buffer.
+operator.allocated  --  Number of ufunc evaluations that allocated a new
+                        output array.
+notify.deferred     --  Number of notifications sent at the end of
+                        diffpy.srfit.util.observable.deferNotifications.
+notify.coalesced    --  Number of notifications that were dropped during a
+                        deferral, because the object was already pending.
+"""
+
+__all__ = ["increment", "getCount", "getCounts", "resetCounts"]
+
+_counts = {}
+
+def increment(name, n = 1):
+    """Increment a counter.
+
+    name    --  The name of the counter.
+    n       --  The amount to add to the counter (default 1).
+
+    """
+    _counts[name] = _counts.get(name, 0) + n
+    return
+
+def getCount(name):
+    """Get the value of a counter.
+
+    Returns 0 for a counter that has not been incremented.
+
+    """
+    return _counts.get(name, 0)
+
+def getCounts():
+    """Get a dictionary of all counters, indexed by name."""
+    return dict(_counts)
+
+def resetCounts(name = None):
+    """Reset counters to 0.
+
+    name    --  The name of the counter to reset. If this is None (default),
+                all counters are reset.
+
+    """
+    if name is None:
+        _counts.clear()
+    else:
+        _counts.pop(name, None)
+    return
+
+# End of file
@@ -11,7 +11,14 @@
 # Derived from pyre-1.0/packages/pyre/patterns/Observable.py
 # See pyre-1.0 for full copyright and license information
 
-__all__ = ["Observable"]
+__all__ = ["Observable", "deferNotifications"]
+
+import threading
+import weakref
+from contextlib import contextmanager
+
+from diffpy.srfit.util import instrumentation
+
 
 class Observable(object):
     """
@@ -28,33 +35,57 @@ class Observable(object):
     The event handlers are callables that take the observable instance as their single
     argument.
 
+    Bound methods are held by weak references to their instances by default, so observing an
+    object does not keep the observer alive. An observer that is freed is dropped from the set
+    of handlers. This allows the observers of long-lived observables, such as Parameters that
+    are shared by many objects, to be freed once they are no longer used.
+
     interface:
-      addObserver: registers its callable argument with the list of handlers to invoke
+      addObserver: registers its callable argument with the list of handlers to invoke, by a
+        weak reference if it is a bound method
       removeObserver: remove an event handler from the list of handlers to invoke
       notify: invoke the registered handlers in the order in which they were registered
 
+    The set of handlers is created when the first one is registered, so observables that are
+    never observed do not carry an empty set. Observable defines no instance layout, so that
+    descendants can use __slots__.
+
     """
 
+    __slots__ = ()
+
 
     def notify(self, other=()):
         """
         Notify all observers
         """
-        # build a list before notification, just in case the observer's callback behavior
-        # involves removing itself from our callback set
-        semaphors = (self,) + other
-        for callable in tuple(self._observers):
-            callable(semaphors)
+        if _deferral.depth:
+            _deferral.add(self, other)
+            return
+
+        observers = self._observers
+        if not observers:
+            return
 
+        _notifyObservers(observers, (self,) + other)
         return
 
 
     # callback management
-    def addObserver(self, callable):
+    def addObserver(self, callable, weak=True):
         """
         Add callable to the set of observers
+
+        If weak is true (default), a bound method is held by a weak reference to its instance.
+        Other callables, and the methods of instances that cannot be weakly referenced, are
+        held by strong references.
         """
-        self._observers.add(callable)
+        if self._observers is None:
+            self._observers = _Observers()
+        if weak:
+            self._observers.addWeak(callable)
+        else:
+            self._observers.add(callable)
         return callable
 
 
@@ -62,6 +93,8 @@ class Observable(object):
         """
         Remove callable from the set of observers
         """
+        if self._observers is None:
+            raise KeyError(callable)
         self._observers.remove(callable)
         return callable
 
@@ -69,7 +102,7 @@ class Observable(object):
     # meta methods
     def __init__(self, **kwds):
         super(Observable, self).__init__(**kwds)
-        self._observers = set()
+        self._observers = None
         return
 
 
@@ -77,4 +110,250 @@ class Observable(object):
     _observers = None
 
 
+class _WeakMethod(weakref.ref):
+    """
+    A bound method that is held by a weak reference to its instance
+
+    The method compares and hashes like the bound method, so it can be found and removed with
+    the bound method. Calling it after its instance was freed does nothing. When the instance is
+    freed, the method is discarded from the set of observers it was added to.
+    """
+
+    __slots__ = ("im_func", "_hash", "_owner")
+
+
+    @property
+    def im_self(self):
+        """
+        The instance of the method, or None if it was freed
+        """
+        return _deref(self)
+
+
+    def __call__(self, *args):
+        obj = _deref(self)
+        if obj is not None:
+            return self.im_func(obj, *args)
+        return
+
+
+    def __hash__(self):
+        return self._hash
+
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        obj = _deref(self)
+        if obj is None:
+            return False
+        if isinstance(other, _WeakMethod):
+            return obj is other.im_self and self.im_func is other.im_func
+        return obj is getattr(other, "im_self", None) and \
+                self.im_func is getattr(other, "im_func", None)
+
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+    # meta methods
+    def __new__(cls, method, owner):
+        return weakref.ref.__new__(cls, method.im_self, _discardObserver)
+
+
+    def __init__(self, method, owner):
+        super(_WeakMethod, self).__init__(method.im_self, _discardObserver)
+        self.im_func = method.im_func
+        self._hash = hash(method)
+        self._owner = weakref.ref(owner)
+        return
+
+
+# the referent of a _WeakMethod, which overrides __call__
+_deref = weakref.ref.__call__
+
+
+def _discardObserver(method):
+    """
+    Discard a _WeakMethod whose instance was freed from its set of observers
+    """
+    owner = method._owner()
+    if owner is not None:
+        owner.discard(method)
+    return
+
+
+class _Observers(set):
+    """
+    The set of observers of an Observable
+
+    Bound methods added with addWeak are held as _WeakMethods. Other callables are held as they
+    are. The set is pickled with the bound methods of its live weak observers, which are held by
+    weak references again when the set is restored.
+    """
+
+    __slots__ = ()
+
+
+    def addWeak(self, callable):
+        """
+        Add callable, by a weak reference to its instance if it is a bound method
+        """
+        if getattr(callable, "im_self", None) is None:
+            self.add(callable)
+            return
+        try:
+            method = _WeakMethod(callable, self)
+        except TypeError:
+            # the instance cannot be weakly referenced
+            self.add(callable)
+            return
+        # replace a weak or strong entry of the same method
+        self.discard(method)
+        self.add(method)
+        return
+
+
+    def __reduce__(self):
+        items = []
+        for callable in self:
+            if isinstance(callable, _WeakMethod):
+                obj = callable.im_self
+                if obj is None:
+                    continue
+                items.append((callable.im_func.__get__(obj, type(obj)), True))
+            else:
+                items.append((callable, False))
+        return (_restoreObservers, (items,))
+
+
+def _restoreObservers(items):
+    """
+    Restore a pickled set of observers
+    """
+    observers = _Observers()
+    for callable, weak in items:
+        if weak:
+            observers.addWeak(callable)
+        else:
+            observers.add(callable)
+    return observers
+
+
+def _notifyObservers(observers, semaphors):
+    """
+    Invoke the observers, if any, with semaphors
+    """
+    if not observers:
+        return
+    # build a list before notification, just in case the observer's callback behavior
+    # involves removing itself from our callback set
+    for callable in tuple(observers):
+        # call weak methods without their __call__, since notification is frequent
+        if callable.__class__ is _WeakMethod:
+            obj = _deref(callable)
+            if obj is not None:
+                callable.im_func(obj, semaphors)
+        else:
+            callable(semaphors)
+    return
+
+
+class _Deferral(threading.local):
+    """
+    The notifications held back by deferNotifications
+
+    Each observable is notified at most once per deferral, with the arguments of its first
+    notification. While the held notifications are sent, the notifications raised by the
+    observers are sent at once, unless the observable was already notified. Each thread has
+    its own deferral, so the notifications of other threads are neither held back nor sent
+    early.
+    """
+
+
+    def add(self, observable, other):
+        """
+        Hold back or send a notification, unless the observable is already notified
+        """
+        seen = self.seen
+        key = id(observable)
+        if key in seen:
+            self.coalesced += 1
+            return
+        # this holds on to the observable, so its id is not reused while seen
+        seen[key] = observable
+        if self.sending:
+            _notifyObservers(observable._observers, (observable,) + other)
+        else:
+            self.pending.append((observable, other))
+        return
+
+
+    def send(self):
+        """
+        Send the held notifications
+        """
+        self.sending = True
+        for observable, other in self.pending:
+            _notifyObservers(observable._observers, (observable,) + other)
+        return
+
+
+    def reset(self):
+        """
+        Forget the notifications and record the counts of the deferral
+        """
+        if self.seen:
+            instrumentation.increment("notify.deferred", len(self.seen))
+        if self.coalesced:
+            instrumentation.increment("notify.coalesced", self.coalesced)
+        self.sending = False
+        self.pending = []
+        self.seen = {}
+        self.coalesced = 0
+        return
+
+
+    def __init__(self):
+        self.depth = 0
+        self.seen = {}
+        self.coalesced = 0
+        self.reset()
+        return
+
+
+_deferral = _Deferral()
+
+
+@contextmanager
+def deferNotifications():
+    """
+    Defer notifications until the outermost deferral ends
+
+    Within the block, observables record that they changed instead of notifying their
+    observers. When the block ends, each changed observable notifies its observers once. The
+    observers are not up to date within the block, so cached values that depend on the changed
+    observables must not be read there.
+
+    The deferral applies to the notifications of the current thread only.
+
+    Notifications that were coalesced are counted by the "notify.coalesced" counter of
+    diffpy.srfit.util.instrumentation, and the ones that were sent by "notify.deferred".
+    """
+    _deferral.depth += 1
+    try:
+        yield
+    finally:
+        _deferral.depth -= 1
+        if _deferral.depth == 0:
+            # keep coalescing the notifications raised by the observers
+            _deferral.depth = 1
+            try:
+                _deferral.send()
+            finally:
+                _deferral.depth = 0
+                _deferral.reset()
+
+
 # end of file
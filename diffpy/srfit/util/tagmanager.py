@@ -30,12 +30,15 @@ class TagManager(object):
                         cannot be found (bool, True). If this is False, then a
                         KeyError will be thrown when a tag cannot be found.
     _tagdict        --  A dictionary of tags to sets of tagged objects.
+    _objdict        --  A dictionary of tagged objects to sets of their tags.
+                        This is the reverse of _tagdict.
 
     """
 
     def __init__(self):
         """Initialization."""
         self._tagdict = {}
+        self._objdict = {}
         self.silent = True
         return
 
@@ -56,9 +59,18 @@ class TagManager(object):
         Raises TypeError if obj is not hashable.
 
         """
+        if not tags:
+            return
+        objtags = self._objdict.get(obj)
+        if objtags is None:
+            objtags = self._objdict[obj] = set()
         for tag in tags:
-            oset = self._tagdict.setdefault(str(tag), set())
+            tag = str(tag)
+            oset = self._tagdict.get(tag)
+            if oset is None:
+                oset = self._tagdict[tag] = set()
             oset.add(obj)
+            objtags.add(tag)
         return
 
 
@@ -73,15 +85,20 @@ class TagManager(object):
         is False
 
         """
+        objtags = self._objdict.get(obj, ())
         if not tags:
-            tags = self.tags(obj)
+            tags = list(objtags)
 
         for tag in tags:
             oset = self.__getObjectSet(tag)
             if obj not in oset and not self.silent:
                 raise KeyError("Tag '%s' does not apply" % tag)
             oset.discard(obj)
+            if objtags:
+                objtags.discard(str(tag))
 
+        if not objtags:
+            self._objdict.pop(obj, None)
         return
 
 
@@ -91,20 +108,25 @@ class TagManager(object):
         Returns list
 
         """
-        tags = [k for (k, v) in self._tagdict.iteritems() if obj in v]
-        return tags
+        return list(self._objdict.get(obj, ()))
 
 
     def hasTags(self, obj, *tags):
         """Determine if an object has all passed tags.
 
+        Raises KeyError if a passed tag does not exist and self.silent is False
+
         Returns bool
 
         """
-        setgen = (self.__getObjectSet(t) for t in tags)
-        resgen = ((obj in s) for s in setgen)
-        result = reduce(bool.__and__, resgen, True)
-        return result
+        if not self.silent:
+            for tag in tags:
+                self.__getObjectSet(tag)
+        objtags = self._objdict.get(obj, ())
+        for tag in tags:
+            if str(tag) not in objtags:
+                return False
+        return True
 
 
     def union(self, *tags):
@@ -113,12 +135,9 @@ class TagManager(object):
         Returns set
 
         """
-        if not tags:
-            return set()
-
-        setgen = (self.__getObjectSet(t) for t in tags)
-        objs = reduce(set.union, setgen)
-
+        objs = set()
+        for tag in tags:
+            objs.update(self.__getObjectSet(tag))
         return objs
 
 
@@ -131,9 +150,12 @@ class TagManager(object):
         if not tags:
             return set()
 
-        setgen = (self.__getObjectSet(t) for t in tags)
-        objs = reduce(set.intersection, setgen)
-
+        sets = sorted((self.__getObjectSet(t) for t in tags), key = len)
+        objs = set(sets[0])
+        for oset in sets[1:]:
+            objs.intersection_update(oset)
+            if not objs:
+                break
         return objs
 
 
@@ -144,9 +166,8 @@ class TagManager(object):
         self.silent.
 
         """
-        keys = self._tagdict.keys()
         for tag in tags:
-            if tag not in keys:
+            if tag not in self._tagdict:
                 raise KeyError("Tag '%s' does not exist" % tag)
 
         return True